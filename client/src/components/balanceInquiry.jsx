@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from "react";
 import { useNavigate } from "react-router-dom";
 import { FaCreditCard } from "react-icons/fa";
+import { sessionHeaders } from "../session";
 
 const BalanceInquiry = ({ selectedAccount, onBack, onReceipt }) => {
   const [showReceiptOption, setShowReceiptOption] = useState(false);
@@ -21,7 +22,8 @@ const BalanceInquiry = ({ selectedAccount, onBack, onReceipt }) => {
       try {
         console.log(`Fetching balance for RFID tag: ${selectedAccount}`);
         const response = await fetch(
-          `http://localhost:8000/balance/${selectedAccount}`
+          `http://localhost:8000/balance/${selectedAccount}`,
+          { headers: sessionHeaders() }
         );
         if (!response.ok) {
           throw new Error("Failed to fetch balance");
@@ -57,7 +59,7 @@ const BalanceInquiry = ({ selectedAccount, onBack, onReceipt }) => {
         // 🖨️ Send request to backend to print receipt
         const response = await fetch("http://localhost:8000/print/receipt", {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
+          headers: sessionHeaders({ "Content-Type": "application/json" }),
           body: JSON.stringify({
             rfid_tag: selectedAccount,
             name: name, // replace this with actual name if available
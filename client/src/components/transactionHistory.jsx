@@ -1,4 +1,5 @@
 import { useState, useEffect } from "react";
+import { sessionHeaders } from "../session";
 
 function TransactionHistory({ onBack, selectedAccount }) {
   const [transactions, setTransactions] = useState([]);
@@ -55,7 +56,7 @@ function TransactionHistory({ onBack, selectedAccount }) {
         setError(null);
 
         const startTime = Date.now();
-        const response = await fetch(apiUrl);
+        const response = await fetch(apiUrl, { headers: sessionHeaders() });
         const endTime = Date.now();
 
         console.log(`⏱️ Request took ${endTime - startTime}ms`);
@@ -168,7 +169,8 @@ function TransactionHistory({ onBack, selectedAccount }) {
           const fetchHistory = async () => {
             // Re-fetch logic here
             const response = await fetch(
-              `http://localhost:8000/transactions/${selectedAccount}`
+              `http://localhost:8000/transactions/${selectedAccount}`,
+              { headers: sessionHeaders() }
             );
             const data = await response.json();
             setTransactions(data);
@@ -2,6 +2,11 @@ import React, { useState, useEffect } from "react";
 import LoadingGif from "../assets/loading.gif";
 import { useNavigate } from "react-router-dom";
 import { useKeypad } from "../hooks.jsx/useKeypad";
+import { sessionHeaders } from "../session";
+
+// Short timeout, retried with the same Idempotency-Key (safe: see /withdraw)
+const WITHDRAW_TIMEOUT_MS = 4000;
+const WITHDRAW_ATTEMPTS = 3;
 
 const WithdrawalAmount = ({
   selectedAccount,
@@ -90,7 +95,8 @@ const WithdrawalAmount = ({
       try {
         console.log(`Fetching balance for RFID tag: ${selectedAccount}`);
         const response = await fetch(
-          `http://localhost:8000/balance/${selectedAccount}`
+          `http://localhost:8000/balance/${selectedAccount}`,
+          { headers: sessionHeaders() }
         );
         if (!response.ok) throw new Error("Failed to fetch balance");
 
@@ -156,10 +162,27 @@ const WithdrawalAmount = ({
     setMessage("Processing your withdrawal...");
 
     try {
-      const response = await fetch(
-        `http://localhost:8000/withdraw/${selectedAccount}/${amount}`,
-        { method: "POST" }
-      );
+      // One key per withdrawal: if a request times out we can resend it and
+      // the backend returns the first result instead of debiting again
+      const idempotencyKey =
+        crypto.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+      let response;
+      for (let attempt = 1; ; attempt++) {
+        try {
+          response = await fetch(
+            `http://localhost:8000/withdraw/${selectedAccount}/${amount}`,
+            {
+              method: "POST",
+              headers: sessionHeaders({ "Idempotency-Key": idempotencyKey }),
+              signal: AbortSignal.timeout(WITHDRAW_TIMEOUT_MS),
+            }
+          );
+          break;
+        } catch (error) {
+          if (attempt >= WITHDRAW_ATTEMPTS) throw error;
+          console.warn(`Withdrawal attempt ${attempt} failed, retrying:`, error);
+        }
+      }
 
       const data = await response.json();
       if (!response.ok) throw new Error(data.detail || "Withdrawal failed");
@@ -185,7 +208,7 @@ const WithdrawalAmount = ({
       try {
         const response = await fetch("http://localhost:8000/print/receipt", {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
+          headers: sessionHeaders({ "Content-Type": "application/json" }),
           body: JSON.stringify({ rfid_tag: selectedAccount }),
         });
 
@@ -1,4 +1,5 @@
 import { useEffect, useRef } from "react";
+import { withTerminal } from "../terminal";
 
 /**
  * A reusable hook to listen to the Physical Keypad.
@@ -18,28 +19,51 @@ export const useKeypad = (onKeyPress, isEnabled = true) => {
   useEffect(() => {
     if (!isEnabled) return;
 
-    // Connect to the Python Backend
-    const ws = new WebSocket("ws://192.168.43.28:8000/ws/keypad");
+    let ws;
+    let retryTimer;
+    let closedByUs = false;
+    let lastSeq = null; // seq of the last key handled on this screen
 
-    ws.onopen = () => {
-      console.log("?? Keypad Connected");
-    };
+    const connect = () => {
+      // Connect to the Python Backend. After a drop, pass the last seq we saw
+      // so the keys pressed while we were offline are replayed first
+      let url = withTerminal("ws://192.168.43.28:8000/ws/keypad");
+      if (lastSeq !== null) url += `&last_seq=${lastSeq}`;
+      ws = new WebSocket(url);
 
-    ws.onmessage = (event) => {
-      const key = event.data;
-      // Trigger the function passed by the component
-      if (callbackRef.current) {
-        callbackRef.current(key);
-      }
-    };
+      ws.onopen = () => {
+        console.log("?? Keypad Connected");
+      };
 
-    ws.onclose = () => {
-      console.log("?? Keypad Disconnected");
+      ws.onmessage = (event) => {
+        // Every frame is an array of key events, oldest first: a replay or a
+        // burst that piled up while the connection lagged
+        for (const msg of JSON.parse(event.data)) {
+          if (lastSeq !== null && msg.seq <= lastSeq) continue; // already handled
+          if (lastSeq !== null && msg.seq > lastSeq + 1) {
+            console.warn(`Missed keys ${lastSeq + 1}..${msg.seq - 1}`);
+          }
+          lastSeq = msg.seq;
+          // Trigger the function passed by the component
+          if (callbackRef.current) {
+            callbackRef.current(msg.key);
+          }
+        }
+      };
+
+      ws.onclose = () => {
+        console.log("?? Keypad Disconnected");
+        if (!closedByUs) retryTimer = setTimeout(connect, 1000);
+      };
     };
 
+    connect();
+
     // Cleanup: Close connection when the component unmounts or isEnabled becomes false
     return () => {
-      ws.close();
+      closedByUs = true;
+      clearTimeout(retryTimer);
+      ws?.close();
     };
   }, [isEnabled]); // Only re-run if isEnabled changes
 };
@@ -7,6 +7,8 @@ import gCash from "../assets/gcash.png";
 import atmIcon from "../assets/atm.png";
 import amex from "../assets/amex.jpg";
 import { useKeypad } from "../hooks.jsx/useKeypad";
+import { setSessionToken } from "../session";
+import { withTerminal } from "../terminal";
 
 function LandingPage() {
   const [time, setTime] = useState("");
@@ -67,28 +69,57 @@ function LandingPage() {
     }
   };
 
+  // 💳 Card events are pushed over a WebSocket instead of polling /rfid/latest
+  const phaseRef = useRef(phase);
   useEffect(() => {
-    const interval = setInterval(async () => {
-      if (phase !== "welcome") return;
-
-      try {
-        const res = await fetch("http://localhost:8000/rfid/latest");
-        const data = await res.json();
-
-        if (data.rfid_tag) {
-          console.log("Detected RFID:", data.rfid_tag);
-          setRfidTag(data.rfid_tag);
-          localStorage.setItem("rfidTag", data.rfid_tag); // ? Add this line
-          setPhase("pin");
-          setTimeout(() => inputsRef.current[0]?.focus(), 200);
+    phaseRef.current = phase;
+  }, [phase]);
+
+  useEffect(() => {
+    let ws;
+    let retryTimer;
+    let closedByUs = false;
+    let lastSeq = 0;
+
+    const onCard = (tag) => {
+      if (phaseRef.current !== "welcome" || !tag) return;
+      console.log("Detected RFID:", tag);
+      setRfidTag(tag);
+      localStorage.setItem("rfidTag", tag);
+      setSessionToken(null); // a new card starts a new session
+      setPhase("pin");
+      setTimeout(() => inputsRef.current[0]?.focus(), 200);
+    };
+
+    const connect = () => {
+      ws = new WebSocket(withTerminal("ws://localhost:8000/ws/card"));
+
+      ws.onmessage = (event) => {
+        const msg = JSON.parse(event.data);
+        if (msg.seq > lastSeq + 1 && msg.event !== "snapshot") {
+          console.warn(`Missed card events ${lastSeq + 1}..${msg.seq - 1}`);
         }
-      } catch (err) {
-        console.error(err);
-      }
-    }, 1000);
+        lastSeq = msg.seq;
 
-    return () => clearInterval(interval);
-  }, [phase]); // <-- include phase
+        // The snapshot on (re)connect tells us about a card tapped while offline
+        if (msg.event === "snapshot" || msg.event === "insert") {
+          onCard(msg.rfid_tag);
+        }
+      };
+
+      ws.onclose = () => {
+        if (!closedByUs) retryTimer = setTimeout(connect, 1000);
+      };
+    };
+
+    connect();
+
+    return () => {
+      closedByUs = true;
+      clearTimeout(retryTimer);
+      ws?.close();
+    };
+  }, []);
 
   // 🕒 live clock
   useEffect(() => {
@@ -164,6 +195,7 @@ function LandingPage() {
       }
 
       console.log("✅ PIN verified:", data);
+      setSessionToken(data.session_token);
 
       // 6️⃣ Navigate to next phase after a short delay
       setTimeout(onPinSuccess, 500);
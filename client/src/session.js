@@ -0,0 +1,11 @@
+// PIN session issued by /verify-pin. Sending it lets the backend skip
+// re-resolving the card on every call for the rest of the ATM session.
+export const setSessionToken = (token) => {
+  if (token) localStorage.setItem("sessionToken", token);
+  else localStorage.removeItem("sessionToken");
+};
+
+export const sessionHeaders = (extra = {}) => {
+  const token = localStorage.getItem("sessionToken");
+  return token ? { ...extra, "X-Session-Token": token } : extra;
+};
@@ -0,0 +1,8 @@
+// Which ATM this screen belongs to. One backend can drive several kiosks;
+// card and keypad events are only delivered to the matching terminal.
+// Set VITE_TERMINAL_ID at build time, or localStorage.terminalId per kiosk.
+export const TERMINAL_ID =
+  import.meta.env.VITE_TERMINAL_ID || localStorage.getItem("terminalId") || "default";
+
+export const withTerminal = (url) =>
+  `${url}${url.includes("?") ? "&" : "?"}terminal=${encodeURIComponent(TERMINAL_ID)}`;
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from database import get_connection
+
+# ==============================
+#   Account cache
+# ==============================
+# Read-through LRU of users rows keyed by rfid_tag. One ATM session asks for
+# the same account many times (tap, PIN, balance, receipt...), so after the
+# first lookup the rest are served from memory. The ledger updates the cached
+# balance after every commit, while it still holds the writer connection, so
+# the cache never shows a balance older than the database's.
+#
+# Entries also expire after CACHE_TTL so writes from other processes
+# (add_card.py, a second uvicorn worker) are picked up eventually.
+
+CACHE_SIZE = 1024
+CACHE_TTL = 10.0  # seconds
+
+Account = namedtuple("Account", "id name balance pin rfid_tag")
+
+
+def load_account(tag_id):
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT id, name, balance, pin FROM users WHERE rfid_tag = ?", (tag_id,)
+    ).fetchone()
+    conn.close()
+    return Account(*row, tag_id) if row else None
+
+
+class AccountCache:
+    def __init__(self, loader, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self._loader = loader
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()   # tag -> (Account, expires_at)
+        self._lock = threading.Lock()
+        self._version = 0               # bumped by every invalidate/update
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tag_id):
+        """Return the Account for tag_id, or None if no user has this tag."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(tag_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(tag_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            version = self._version
+
+        account = self._loader(tag_id)
+        if account is None:
+            return None
+
+        with self._lock:
+            # A mutation landed while we were reading: our row may predate it
+            if self._version == version:
+                self._store(tag_id, account, now)
+        return account
+
+    def update_balance(self, tag_id, new_balance):
+        """Apply a committed balance change; called by the ledger."""
+        with self._lock:
+            self._version += 1
+            entry = self._entries.get(tag_id)
+            if entry is not None:
+                self._store(tag_id, entry[0]._replace(balance=new_balance), time.monotonic())
+
+    def invalidate(self, tag_id=None):
+        """Drop one tag, or everything when tag_id is None."""
+        with self._lock:
+            self._version += 1
+            if tag_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(tag_id, None)
+
+    def _store(self, tag_id, account, now):
+        self._entries[tag_id] = (account, now + self._ttl)
+        self._entries.move_to_end(tag_id)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "ttl_seconds": self._ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+accounts = AccountCache(load_account)
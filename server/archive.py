@@ -0,0 +1,361 @@
+"""
+Move old ledger rows out of the hot transactions table.
+
+    python archive.py                       # rows older than ATM_ARCHIVE_AFTER_DAYS (180)
+    python archive.py --days 90 --db /srv/atm/database.db
+    python archive.py --enable-incremental-vacuum   # one-off, on a pre-existing database
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+import database
+from atm_logging import get_logger
+from metrics import Counter
+
+log = get_logger("atm.archive")
+
+# ==============================
+#   Ledger archive
+# ==============================
+# Rows older than the horizon are moved, oldest first, into an archive
+# database file next to the main one (database-archive.db, or
+# ATM_ARCHIVE_PATH), one table per month: transactions_2025_11, ... Each
+# table has the same columns and (user_id, timestamp, id) index as the hot
+# table, and rows keep their ids.
+#
+# Moves happen BATCH_ROWS at a time. Each batch is picked without holding
+# any lock, then copied into the archive in one short BEGIN IMMEDIATE on the
+# shared writer connection and deleted from the hot table in a second, so a
+# withdrawal waits for at most one batch's copy or delete.
+# After the move, freed pages are handed back to the filesystem with
+# incremental vacuum, a few pages per step.
+#
+# The archive is attached (as "archive") only to connections that need it:
+# history and export read it when a request reaches past what the hot table
+# holds, and daily_totals rebuilds from both.
+#
+# archived_users, in the main database, lists each user with archived rows
+# and the oldest and newest of their timestamps. It is updated in the same
+# transaction as the delete, so history can tell from the hot database alone
+# whether a user has anything in the archive and which months to look in.
+#
+# With WAL, a transaction that spans two database files is not atomic
+# across them, so a batch never writes both in one: the copy commits before
+# the delete starts. If the Pi loses power in between, the batch is left in
+# both files, never in neither; the next run finds those rows still in the
+# hot table, skips the copy (INSERT OR IGNORE on the id) and deletes them.
+
+SCHEMA = "archive"
+ARCHIVE_AFTER_DAYS = int(os.getenv("ATM_ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ATM_ARCHIVE_INTERVAL_HOURS", "0"))  # 0: run from cron instead
+BATCH_ROWS = 500
+BATCH_PAUSE = 0.05      # seconds between batches, so live postings get the writer
+VACUUM_PAGES = 256      # pages returned per incremental_vacuum step
+
+archived_rows = Counter("atm_archived_rows_total", "Ledger rows moved to the archive.")
+
+
+def archive_path():
+    return os.getenv("ATM_ARCHIVE_PATH") or f"{os.path.splitext(database.DB_NAME)[0]}-archive.db"
+
+
+def partition_for(timestamp):
+    """Archive table holding rows with this timestamp: transactions_YYYY_MM."""
+    return f"transactions_{timestamp[:4]}_{timestamp[5:7]}"
+
+
+def cutoff(days=None, now=None):
+    """Timestamp before which rows are archived, in CURRENT_TIMESTAMP's format (UTC)."""
+    now = now or datetime.now(timezone.utc)
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    return (now - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# -------------------- ATTACHING --------------------
+def is_attached(conn):
+    return any(row[1] == SCHEMA for row in conn.execute("PRAGMA database_list"))
+
+
+def attach(conn, create=False, readonly=False):
+    """
+    Attach the archive to conn if it isn't already. Returns False when there
+    is no archive yet (and create is False). Must not be called inside a
+    transaction.
+    """
+    if is_attached(conn):
+        return True
+    path = os.path.abspath(archive_path())
+    if not create and not os.path.exists(path):
+        return False
+    if readonly:
+        # Read-only connections are opened with uri=True
+        conn.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (f"file:{quote(path)}?mode=ro",))
+    else:
+        conn.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+        conn.execute(f"PRAGMA {SCHEMA}.journal_mode=WAL")
+    return True
+
+
+def detach(conn):
+    if is_attached(conn):
+        conn.execute(f"DETACH DATABASE {SCHEMA}")
+
+
+@contextmanager
+def attached_writer():
+    """Keep the archive attached to the pool's writer connection for a block."""
+    conn = database.get_write_connection()
+    try:
+        attach(conn, create=True)
+    finally:
+        conn.close()
+    try:
+        yield
+    finally:
+        conn = database.get_write_connection()
+        try:
+            detach(conn)
+        finally:
+            conn.close()
+
+
+def partitions(conn, newest_first=False):
+    """Month tables in the attached archive, oldest first (or newest first)."""
+    if not is_attached(conn):
+        return []
+    names = [
+        row[0] for row in conn.execute(
+            f"SELECT name FROM {SCHEMA}.sqlite_master "
+            "WHERE type = 'table' AND name LIKE 'transactions\\_%' ESCAPE '\\' ORDER BY name")
+    ]
+    return names[::-1] if newest_first else names
+
+
+def ledger_source(conn):
+    """
+    SQL for a subquery over every ledger row, hot and archived:
+    FROM {ledger_source(conn)} AS t. Attach the archive first.
+    """
+    tables = ["main.transactions"] + [f"{SCHEMA}.{name}" for name in partitions(conn)]
+    union = " UNION ALL ".join(
+        f"SELECT id, user_id, type, amount, timestamp FROM {table}" for table in tables)
+    return f"({union})"
+
+
+# -------------------- MOVING ROWS --------------------
+def _ensure_partition(conn, name):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {SCHEMA}.{name} ("
+        "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, type TEXT NOT NULL, "
+        "amount REAL NOT NULL, timestamp DATETIME)")
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {SCHEMA}.idx_{name}_user_ts "
+        f"ON {name} (user_id, timestamp, id)")
+
+
+def _next_batch(before, batch_rows):
+    # Read without a transaction: only this job deletes ledger rows, so the
+    # rows are still there when the move transaction starts
+    with database.read_connection() as conn:
+        return conn.execute(
+            "SELECT id, user_id, type, amount, timestamp FROM transactions "
+            "WHERE timestamp < ? ORDER BY id LIMIT ?",
+            (before, batch_rows),
+        ).fetchall()
+
+
+def _copy(conn, rows):
+    by_partition = {}
+    for row in rows:
+        by_partition.setdefault(partition_for(row[4]), []).append(row)
+    for name, batch in by_partition.items():
+        _ensure_partition(conn, name)
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {SCHEMA}.{name} (id, user_id, type, amount, timestamp) "
+            "VALUES (?, ?, ?, ?, ?)", batch)
+
+
+_SPAN_UPSERT = (
+    "INSERT INTO main.archived_users (user_id, oldest_timestamp, newest_timestamp) "
+    "VALUES (?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET "
+    "oldest_timestamp = min(oldest_timestamp, excluded.oldest_timestamp), "
+    "newest_timestamp = max(newest_timestamp, excluded.newest_timestamp)"
+)
+
+
+def _delete(conn, rows):
+    spans = {}
+    for _, user_id, _, _, timestamp in rows:
+        oldest, newest = spans.get(user_id, (timestamp, timestamp))
+        spans[user_id] = (min(oldest, timestamp), max(newest, timestamp))
+    conn.executemany(_SPAN_UPSERT, [(uid, *span) for uid, span in spans.items()])
+    conn.executemany("DELETE FROM main.transactions WHERE id = ?", [(row[0],) for row in rows])
+
+
+def _backfill_spans(conn):
+    """Fill archived_users from an archive written before it existed."""
+    names = partitions(conn)
+    if not names or conn.execute("SELECT 1 FROM main.archived_users LIMIT 1").fetchone():
+        return
+    union = " UNION ALL ".join(
+        f"SELECT user_id, MIN(timestamp) AS o, MAX(timestamp) AS n FROM {SCHEMA}.{name} GROUP BY user_id"
+        for name in names)
+    conn.execute(
+        "INSERT INTO main.archived_users (user_id, oldest_timestamp, newest_timestamp) "
+        f"SELECT user_id, MIN(o), MAX(n) FROM ({union}) GROUP BY user_id")
+
+
+def user_span(conn, user_id):
+    """(oldest, newest) timestamp of user_id's archived rows, or None if there are none."""
+    return conn.execute(
+        "SELECT oldest_timestamp, newest_timestamp FROM main.archived_users WHERE user_id = ?",
+        (user_id,),
+    ).fetchone()
+
+
+def _move(rows):
+    """Copy rows to the archive and commit, then delete them from the hot table."""
+    import ledger  # the move goes through the ledger's writer/retry path
+
+    ledger.run_in_transaction(lambda conn: _copy(conn, rows))
+    ledger.run_in_transaction(lambda conn: _delete(conn, rows))
+    return len(rows)
+
+
+def archive_old_rows(days=None, batch_rows=BATCH_ROWS, pause=BATCH_PAUSE, stop=None):
+    """
+    Move every row older than the horizon to the archive, batch by batch.
+    Returns the number of rows moved. stop (a threading.Event) ends it early.
+    """
+    import ledger
+
+    before = cutoff(days)
+    moved = 0
+    started = time.perf_counter()
+    with attached_writer():
+        ledger.run_in_transaction(_backfill_spans)
+        while not (stop and stop.is_set()):
+            rows = _next_batch(before, batch_rows)
+            if not rows:
+                break
+            moved += _move(rows)
+            archived_rows.inc(len(rows))
+            time.sleep(pause)
+    log.info("archived ledger rows", rows=moved, before=before,
+             seconds=round(time.perf_counter() - started, 2))
+    return moved
+
+
+# -------------------- VACUUM --------------------
+def incremental_vacuum(pages=VACUUM_PAGES, pause=BATCH_PAUSE, stop=None):
+    """
+    Return free pages to the filesystem a few at a time. Needs
+    auto_vacuum=INCREMENTAL (new databases have it; see
+    enable_incremental_vacuum). Returns the number of pages freed.
+    """
+    freed = 0
+    while not (stop and stop.is_set()):
+        conn = database.get_write_connection()
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                log.warning("auto_vacuum is not INCREMENTAL; run archive.py --enable-incremental-vacuum")
+                return freed
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            # sqlite3 steps a statement once, and each step of
+            # incremental_vacuum frees one page: run it once per page, in
+            # one transaction per step
+            conn.execute("BEGIN IMMEDIATE")
+            for _ in range(min(free, pages)):
+                conn.execute("PRAGMA incremental_vacuum(1)")
+            conn.commit()
+            left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            freed += free - left
+            if left >= free:
+                break  # no progress; don't spin
+        finally:
+            conn.close()
+        time.sleep(pause)
+    return freed
+
+
+def enable_incremental_vacuum():
+    """Switch an existing database to auto_vacuum=INCREMENTAL (rewrites the whole file)."""
+    conn = database.get_write_connection()
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def run(days=None, stop=None):
+    moved = archive_old_rows(days, stop=stop)
+    freed = incremental_vacuum(stop=stop) if moved else 0
+    return moved, freed
+
+
+# -------------------- BACKGROUND JOB --------------------
+class ArchiveJob:
+    """Runs run() every interval_hours on a background thread."""
+
+    def __init__(self, interval_hours=ARCHIVE_INTERVAL_HOURS, days=None):
+        self.interval = interval_hours * 3600
+        self.days = days
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="archive", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                run(self.days, stop=self._stop)
+            except Exception as e:
+                log.exception("archive run failed", error=e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="archive rows older than this many days")
+    parser.add_argument("--db", help="database file (default: ATM_DB_PATH or database.db)")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="convert an existing database so freed pages can be returned")
+    args = parser.parse_args()
+
+    if args.db:
+        database.configure(args.db)
+    database.init_db()
+    try:
+        if args.enable_incremental_vacuum:
+            enable_incremental_vacuum()
+            print("auto_vacuum set to INCREMENTAL")
+            return 0
+        moved, freed = run(args.days)
+        print(f"Moved {moved} row(s) older than {cutoff(args.days)} to {archive_path()}; "
+              f"freed {freed} page(s)")
+        return 0
+    finally:
+        database.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
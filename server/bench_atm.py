@@ -0,0 +1,260 @@
+"""
+Hardware-free load test for the ATM backend.
+
+Seeds a throwaway database with N users and M transactions, starts main.app
+with simulated hardware (ATM_HARDWARE=sim), and drives concurrent ATM
+sessions straight through the ASGI interface:
+
+    tap -> verify-pin -> balance -> withdraw -> history -> receipt
+
+Reports p50/p95/p99 latency and throughput per endpoint. --save writes the
+results as a baseline JSON (commit it next to this script); later runs with
+--baseline compare against it and exit non-zero on a p95 regression.
+
+    python bench_atm.py --users 500 --transactions 200000 --sessions 16 --rounds 20
+    python bench_atm.py --save bench_baseline.json
+    python bench_atm.py --baseline bench_baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+STEPS = ("tap", "verify_pin", "balance", "withdraw", "history", "receipt")
+
+
+# -------------------- MINIMAL ASGI CLIENT --------------------
+async def asgi_request(app, method, path, headers=None, body=b""):
+    """Send one HTTP request through an ASGI app. Returns (status, body bytes)."""
+    raw_path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": raw_path,
+        "raw_path": raw_path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    request_sent = False
+    response = {"status": None, "body": bytearray()}
+    done = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"].extend(message.get("body", b""))
+            if not message.get("more_body"):
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return response["status"], bytes(response["body"])
+
+
+class Lifespan:
+    """Runs the app's startup/shutdown handlers the way uvicorn would."""
+
+    def __init__(self, app):
+        self.app = app
+        self._inbox = asyncio.Queue()
+        self._outbox = asyncio.Queue()
+        self._task = None
+
+    async def __aenter__(self):
+        self._task = asyncio.ensure_future(
+            self.app({"type": "lifespan", "asgi": {"version": "3.0"}},
+                     self._inbox.get, self._outbox.put))
+        await self._inbox.put({"type": "lifespan.startup"})
+        message = await self._outbox.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"Startup failed: {message}")
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._inbox.put({"type": "lifespan.shutdown"})
+        await self._outbox.get()
+        await self._task
+
+
+# -------------------- SEEDING --------------------
+def seed(database, users, transactions):
+    conn = database.get_write_connection()
+    conn.executemany(
+        "INSERT INTO users (name, rfid_tag, balance, pin) VALUES (?, ?, ?, ?)",
+        [(f"Bench {i}", f"9{i:011d}", 1_000_000.0, f"{i % 10000:04d}") for i in range(users)],
+    )
+    rows = []
+    for n in range(transactions):
+        user_id = random.randint(1, users)
+        day = random.randint(0, 3 * 365)
+        rows.append((user_id, random.choice(("deposit", "withdraw", "fee")),
+                     round(random.uniform(20, 5000), 2),
+                     f"-{day} days"))
+        if len(rows) >= 50_000:
+            _insert_history(conn, rows)
+            rows = []
+    _insert_history(conn, rows)
+    conn.commit()
+    conn.close()
+
+
+def _insert_history(conn, rows):
+    conn.executemany(
+        "INSERT INTO transactions (user_id, type, amount, timestamp) "
+        "VALUES (?, ?, ?, datetime('now', ?))",
+        rows,
+    )
+
+
+# -------------------- LOAD --------------------
+async def run_session(app, user_index, samples):
+    tag = f"9{user_index:011d}"
+    pin = f"{user_index % 10000:04d}"
+
+    async def step(name, method, path, headers=None, body=b""):
+        start = time.perf_counter()
+        status, payload = await asgi_request(app, method, path, headers, body)
+        samples[name].append(time.perf_counter() - start)
+        if status >= 400:
+            samples["errors"].append(f"{name} {status} {payload[:120]!r}")
+        return payload
+
+    await step("tap", "GET", f"/rfid/{tag}")
+    token = json.loads(await step("verify_pin", "POST", f"/verify-pin/{tag}/{pin}")).get("session_token")
+    headers = {"X-Session-Token": token} if token else {}
+    await step("balance", "GET", f"/balance/{tag}", headers)
+    await step("withdraw", "POST", f"/withdraw/{tag}/100", headers)
+    await step("history", "GET", f"/transactions/{tag}", headers)
+    await step("receipt", "POST", "/print/receipt",
+               dict(headers, **{"Content-Type": "application/json"}),
+               json.dumps({"rfid_tag": tag}).encode())
+
+
+async def drive(app, users, sessions, rounds):
+    samples = {name: [] for name in STEPS}
+    samples["errors"] = []
+
+    async def worker(worker_id):
+        for _ in range(rounds):
+            await run_session(app, random.randrange(users), samples)
+
+    async with Lifespan(app):
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(sessions)))
+        elapsed = time.perf_counter() - started
+    return samples, elapsed
+
+
+def summarize(samples, elapsed):
+    results = {}
+    for name in STEPS:
+        values = sorted(samples[name])
+        if not values:
+            continue
+        q = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+        results[name] = {
+            "count": len(values),
+            "p50_ms": round(q[49] * 1000, 3),
+            "p95_ms": round(q[94] * 1000, 3),
+            "p99_ms": round(q[98] * 1000, 3),
+            "rps": round(len(values) / elapsed, 1),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        limit = before["p95_ms"] * (1 + tolerance)
+        if current["p95_ms"] > limit:
+            regressions.append(f"{name}: p95 {current['p95_ms']:.2f} ms > "
+                               f"{before['p95_ms']:.2f} ms baseline (+{tolerance:.0%} allowed)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--transactions", type=int, default=50_000)
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent ATM sessions")
+    parser.add_argument("--rounds", type=int, default=10, help="sessions per worker")
+    parser.add_argument("--save", metavar="PATH", nargs="?", const=DEFAULT_BASELINE,
+                        help="write results as a baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed p95 slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Configure before main is imported: it opens the DB and hardware at import
+        os.environ["ATM_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["ATM_HARDWARE"] = "sim"
+        os.environ.setdefault("ATM_LOG_LEVEL", "WARNING")
+
+        import database
+        import main as atm
+
+        seed(database, args.users, args.transactions)
+        samples, elapsed = asyncio.run(drive(atm.app, args.users, args.sessions, args.rounds))
+        database.get_pool().close_all()
+
+    results = summarize(samples, elapsed)
+    print(f"{args.sessions} concurrent sessions x {args.rounds} rounds, "
+          f"{args.users} users, {args.transactions} transactions, {elapsed:.2f}s")
+    print(f"{'endpoint':<12} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+    for name, r in results.items():
+        print(f"{name:<12} {r['count']:>6} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+              f"{r['p99_ms']:>9.2f} {r['rps']:>9.1f}")
+    if samples["errors"]:
+        print(f"\n{len(samples['errors'])} failed requests, first: {samples['errors'][0]}")
+
+    report = {
+        "params": {k: getattr(args, k) for k in ("users", "transactions", "sessions", "rounds")},
+        "endpoints": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\n✅ Within baseline tolerance")
+    return 1 if samples["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
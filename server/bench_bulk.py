@@ -0,0 +1,117 @@
+"""
+Bulk posting throughput against a throwaway database.
+
+Seeds --accounts users, writes a CSV of --rows postings (mostly deposits,
+some withdrawals, a few unknown tags and overdrafts that must fail), loads
+it with bulk.BulkLoader, and compares the rate with posting the first
+--single rows one ledger.deposit() at a time. Finally checks that every
+balance equals its starting balance plus what the loader reported posted.
+
+    python bench_bulk.py --accounts 10000 --rows 50000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import bulk
+import database
+import ledger
+
+START_BALANCE = 100.0
+
+
+def seed(accounts):
+    database.init_db()
+    conn = database.get_write_connection()
+    conn.executemany(
+        "INSERT INTO users (name, rfid_tag, balance, pin) VALUES (?, ?, ?, ?)",
+        [(f"Bulk {i}", f"BULK{i:08d}", START_BALANCE, "0000") for i in range(accounts)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def make_rows(accounts, rows, rng):
+    """CSV lines plus the net change per tag the loader should end up applying."""
+    lines = ["rfid_tag,type,amount"]
+    for _ in range(rows):
+        roll = rng.random()
+        if roll < 0.005:
+            lines.append(f"NOSUCHTAG{rng.randrange(10 ** 6)},deposit,10")
+        elif roll < 0.01:
+            lines.append(f"BULK{rng.randrange(accounts):08d},withdraw,1000000")  # overdraft
+        elif roll < 0.2:
+            lines.append(f"BULK{rng.randrange(accounts):08d},withdraw,{rng.randint(1, 20)}")
+        else:
+            lines.append(f"BULK{rng.randrange(accounts):08d},deposit,{rng.randint(1, 500)}")
+    return lines
+
+
+def expected_balances(lines):
+    """Replay the CSV the slow way: what each balance should be afterwards."""
+    balances, posted = {}, 0
+    for line in lines[1:]:
+        tag, kind, amount = line.split(",")
+        if tag.startswith("NOSUCHTAG"):
+            continue
+        balance = balances.get(tag, START_BALANCE)
+        amount = float(amount)
+        if kind == "withdraw":
+            if balance < amount:
+                continue
+            balance -= amount
+        else:
+            balance += amount
+        balances[tag] = balance
+        posted += 1
+    return balances, posted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--chunk-rows", type=int, default=bulk.CHUNK_ROWS)
+    parser.add_argument("--single", type=int, default=500,
+                        help="postings to time through ledger.deposit() for comparison")
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.configure(os.path.join(tmp, "bulk.db"))
+        seed(args.accounts)
+        lines = make_rows(args.accounts, args.rows, rng)
+        expected, expected_posted = expected_balances(lines)
+
+        loader = bulk.BulkLoader("csv", args.chunk_rows, max_failures=None)
+        loader.add(lines)
+        summary = loader.finish()
+
+        conn = database.get_write_connection()
+        conn.execute("INSERT INTO users (name, rfid_tag, balance, pin) VALUES ('One', 'ONE', 0, '0')")
+        conn.commit()
+        conn.close()
+        started = time.perf_counter()
+        for _ in range(args.single):
+            ledger.deposit("ONE", 1.0)
+        single_rate = args.single / (time.perf_counter() - started)
+
+        conn = database.get_connection()
+        actual = dict(conn.execute("SELECT rfid_tag, balance FROM users WHERE rfid_tag LIKE 'BULK%'"))
+        conn.close()
+        database.get_pool().close_all()
+
+    mismatched = sum(1 for tag, balance in expected.items() if abs(actual[tag] - balance) > 1e-6)
+    print(f"bulk:   {summary['posted']}/{summary['rows']} posted, {summary['failed']} failed, "
+          f"{summary['chunks']} chunks, {summary['seconds']} s = {summary['rows_per_second']} rows/s")
+    print(f"single: {single_rate:.0f} postings/s through ledger.deposit()")
+    print(f"check:  posted {summary['posted']} (expected {expected_posted}), "
+          f"{mismatched} balances differ from a row-by-row replay")
+    return 0 if summary["posted"] == expected_posted and not mismatched else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Balance latency while the printer is busy: shared threadpool vs dedicated pools.
+
+Starts main.app with simulated hardware (the fake printer takes as long as
+9600 baud would) and keeps --printers clients printing receipts the old
+way, a sync handler calling print_balance_receipt on Starlette's default
+threadpool. Alongside them --clients balance clients poll:
+
+  before  a sync balance handler, like the ones main.py used to have, which
+          needs a default-threadpool thread just like the prints do
+  after   GET /balance/{tag}, async, with the lookup on executors.db_readers
+
+--threadpool caps Starlette's default threadpool (40 threads by default).
+
+    python bench_executors.py --printers 40 --clients 8 --seconds 5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from bench_atm import Lifespan, asgi_request, seed
+
+
+def add_legacy_routes(atm):
+    """The blocking print path and a sync balance handler, as they were before."""
+    import printer_utils
+
+    @atm.app.post("/bench/print-blocking")
+    def print_blocking():
+        printer_utils.print_balance_receipt("Bench", 1.0)
+        return {"status": "printed"}
+
+    @atm.app.get("/bench/balance-sync/{tag_id}")
+    def balance_sync(tag_id: str):
+        user = atm.accounts.get(tag_id)
+        return {"rfid_tag": tag_id, "balance": user.balance}
+
+
+async def scenario(app, path, printers, clients, users, seconds):
+    stop = time.perf_counter() + seconds
+    latencies, printed = [], 0
+
+    async def print_loop():
+        nonlocal printed
+        while time.perf_counter() < stop:
+            await asgi_request(app, "POST", "/bench/print-blocking")
+            printed += 1
+
+    async def balance_loop(rng):
+        while time.perf_counter() < stop:
+            tag = f"9{rng.randrange(users):011d}"
+            started = time.perf_counter()
+            status, _ = await asgi_request(app, "GET", path.format(tag=tag))
+            if status != 200:
+                raise RuntimeError(f"{path} returned {status}")
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.005)
+
+    await asyncio.gather(*(print_loop() for _ in range(printers)),
+                         *(balance_loop(random.Random(i)) for i in range(clients)))
+    return latencies, printed
+
+
+async def run(atm, args):
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = args.threadpool
+    async with Lifespan(atm.app):
+        results = {}
+        for label, path in (("before: sync handler", "/bench/balance-sync/{tag}"),
+                            ("after: async + db_readers", "/balance/{tag}")):
+            atm.accounts.invalidate()
+            results[label] = await scenario(atm.app, path, args.printers, args.clients,
+                                            args.users, args.seconds)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--printers", type=int, default=40, help="concurrent blocking print clients")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent balance clients")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=5.0, help="per scenario")
+    parser.add_argument("--threadpool", type=int, default=40, help="Starlette default threadpool size")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["ATM_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["ATM_HARDWARE"] = "fake"
+        os.environ.setdefault("ATM_LOG_LEVEL", "WARNING")
+
+        import database
+        import main as atm
+
+        seed(database, args.users, 0)
+        add_legacy_routes(atm)
+        # print_balance_receipt reports on stdout; keep it out of the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(run(atm, args))
+        database.get_pool().close_all()
+
+    print(f"{args.printers} blocking print clients, {args.clients} balance clients, "
+          f"{args.seconds:g} s each, default threadpool {args.threadpool}")
+    print(f"{'':<27} {'requests':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'prints':>7}")
+    for label, (latencies, printed) in results.items():
+        q = statistics.quantiles(latencies, n=100)
+        print(f"{label:<27} {len(latencies):>8} {q[49] * 1000:>8.2f} {q[94] * 1000:>8.2f} "
+              f"{q[98] * 1000:>8.2f} {max(latencies) * 1000:>8.2f} {printed:>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Electronic journal: append rate, lookup latency as the journal grows, and
+the reprint/search endpoints end to end.
+
+Fills a throwaway journal with --records receipts for --users users (small
+segments, so it rotates a lot), timing get(seq), a user's newest page and a
+one-hour time window at each tenth of the way. Lookups should stay flat
+while the journal grows, and so should the process's anonymous memory (RSS
+not backed by a file; Linux only): the index is read through mmap and
+records are read one at a time.
+
+Then starts main.app on simulated hardware, runs a card session and checks
+that the withdrawal's receipt_seq can be fetched, searched for and
+reprinted without a single SQLite statement.
+
+    python bench_journal.py --records 200000 --users 2000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from bench_atm import Lifespan, asgi_request, seed
+
+SAMPLES = 2000
+
+
+def _receipt(rng, name):
+    from printer_utils import render_withdrawal_receipt
+    amount = rng.randrange(1, 100) * 100.0
+    return render_withdrawal_receipt(name, amount, 18.0, rng.uniform(0, 1e6)).decode("utf-8")
+
+
+def _percentiles(latencies):
+    q = statistics.quantiles(latencies, n=100)
+    return q[49] * 1e6, q[98] * 1e6
+
+
+def _anon_rss():
+    """Resident memory not backed by a file, in bytes (0 where /proc has no RssAnon)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _epoch(record):
+    return datetime.strptime(record["time"], "%Y-%m-%d %H:%M:%S.%f").replace(
+        tzinfo=timezone.utc).timestamp()
+
+
+def _time_lookups(ej, rng, users):
+    """p50/p99 microseconds for get, a user's newest page and a 1 h window."""
+    last = ej.stats()["last_seq"]
+    first_ts, last_ts = _epoch(ej.get(1)), _epoch(ej.get(last))
+    timings = {"get": [], "user page": [], "time window": []}
+    for _ in range(SAMPLES):
+        seq = rng.randint(1, last)
+        started = time.perf_counter()
+        record = ej.get(seq)
+        timings["get"].append(time.perf_counter() - started)
+        assert record["seq"] == seq
+
+        started = time.perf_counter()
+        ej.search(user_id=rng.randint(1, users), limit=10)
+        timings["user page"].append(time.perf_counter() - started)
+
+        since = rng.uniform(first_ts, last_ts)
+        started = time.perf_counter()
+        ej.search(since=since, until=since + 3600, limit=10)
+        timings["time window"].append(time.perf_counter() - started)
+    return {name: _percentiles(values) for name, values in timings.items()}
+
+
+def fill_and_measure(directory, records, users, segment_mb):
+    import journal
+
+    ej = journal.Journal(directory, segment_bytes=int(segment_mb * 1024 * 1024), sync=False)
+    rng = random.Random(7)
+    names = [f"Bench {i}" for i in range(users + 1)]
+    checkpoints = {records * k // 10 for k in range(1, 11)}
+
+    ej.open()
+    baseline = _anon_rss()
+    rows, started = [], time.perf_counter()
+    for n in range(1, records + 1):
+        user_id = rng.randint(1, users)
+        ej.append("withdraw", user_id, rfid_tag=f"9{user_id:011d}", receipt=_receipt(rng, names[user_id]))
+        if n in checkpoints:
+            elapsed = time.perf_counter() - started
+            lookups = _time_lookups(ej, rng, users)
+            stats = ej.stats()
+            rows.append((n, stats["segments"], stats["bytes"], n / elapsed,
+                         _anon_rss() - baseline, lookups))
+            started = time.perf_counter() - elapsed
+
+    # A short run with fdatasync per record, the default on the kiosk
+    synced = journal.Journal(os.path.join(directory, "synced"), sync=True)
+    count, started = 500, time.perf_counter()
+    for _ in range(count):
+        synced.append("withdraw", 1, receipt=_receipt(rng, "Bench"))
+    sync_rate = count / (time.perf_counter() - started)
+    # ... and what JournalWriter does under load: many records per sync
+    started = time.perf_counter()
+    for _ in range(count // 16):
+        synced.append_many([("withdraw", 1, {"receipt": _receipt(rng, "Bench")})] * 16)
+    group_rate = count // 16 * 16 / (time.perf_counter() - started)
+    synced.close()
+    verified = ej.verify()
+    ej.close()
+    return rows, (sync_rate, group_rate), verified
+
+
+def _statements():
+    import metrics
+    return sum(float(v) for v in re.findall(
+        r"^atm_db_statement_seconds_count\{[^}]*\} (\S+)$", metrics.render_all(), re.M))
+
+
+async def api_check(atm):
+    tag, pin = "900000000001", "0001"
+    async with Lifespan(atm.app):
+        await asgi_request(atm.app, "POST", f"/rfid/insert/{tag}")
+        await asgi_request(atm.app, "GET", f"/rfid/{tag}")
+        _, body = await asgi_request(atm.app, "POST", f"/verify-pin/{tag}/{pin}")
+        headers = {"X-Session-Token": json.loads(body)["session_token"]}
+        _, body = await asgi_request(atm.app, "POST", f"/withdraw/{tag}/250", headers)
+        receipt_seq = json.loads(body)["receipt_seq"]
+        await asgi_request(atm.app, "POST", "/rfid/remove")
+
+        before = _statements()
+        status, body = await asgi_request(atm.app, "GET", f"/journal/{receipt_seq}", headers)
+        assert status == 200, body
+        record = json.loads(body)
+        status, body = await asgi_request(atm.app, "POST", f"/journal/{receipt_seq}/reprint", headers)
+        assert status == 200, body
+        reprint = json.loads(body)
+        status, body = await asgi_request(atm.app, "GET", "/journal?user_id=2&limit=10")
+        assert status == 200, body
+        kinds = [r["kind"] for r in json.loads(body)]
+        statements = _statements() - before
+        for _ in range(50):
+            status, body = await asgi_request(atm.app, "GET", f"/print/jobs/{reprint['job_id']}")
+            if json.loads(body)["status"] in ("done", "failed"):
+                break
+            await asyncio.sleep(0.1)
+        job = json.loads(body)
+    return receipt_seq, record, reprint, kinds, statements, job
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--segment-mb", type=float, default=4.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["ATM_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["ATM_JOURNAL_DIR"] = os.path.join(tmp, "journal")
+        os.environ["ATM_HARDWARE"] = "fake"
+        os.environ.setdefault("ATM_LOG_LEVEL", "WARNING")
+
+        rows, sync_rate, verified = fill_and_measure(
+            os.path.join(tmp, "filled"), args.records, args.users, args.segment_mb)
+
+        import database
+        import main as atm
+        seed(database, 10, 0)
+        # print_balance_receipt and friends report on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            receipt_seq, record, reprint, kinds, statements, job = asyncio.run(api_check(atm))
+        database.get_pool().close_all()
+
+    print(f"{'records':>9} {'segments':>8} {'MB':>7} {'appends/s':>10} {'anon KB':>10}"
+          f" {'get p50/p99 us':>15} {'user p50/p99 us':>16} {'1h p50/p99 us':>15}")
+    for n, segments, size, rate, heap, lookups in rows:
+        cells = " ".join(f"{p50:>7.1f}/{p99:<7.1f}" for p50, p99 in lookups.values())
+        print(f"{n:>9} {segments:>8} {size / 1e6:>7.1f} {rate:>10.0f} {heap / 1024:>10.1f}  {cells}")
+    print(f"appends/s with fdatasync: {sync_rate[0]:.0f} one per sync, "
+          f"{sync_rate[1]:.0f} sixteen per sync (group commit)")
+    print(f"verified {verified} record(s)")
+    print()
+    print(f"withdraw -> receipt_seq {receipt_seq} ({record['kind']}, user {record['user_id']})")
+    print(f"reprint  -> job {reprint['job_id']} {job['status']}, {job['bytes']} bytes, "
+          f"journalled as {reprint['reprint_seq']}")
+    print(f"search   -> {kinds}")
+    print(f"SQLite statements during get/reprint/search: {statements:.0f}")
+    return 0 if statements == 0 and job["status"] == "done" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
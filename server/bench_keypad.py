@@ -0,0 +1,106 @@
+"""
+Compare keypad scanning modes on the simulated GPIO backend.
+
+For each mode, a scanner thread runs the same loop KeypadManager uses. We
+measure its CPU time while the keypad sits idle, then the delay between a
+simulated key press (held for HOLD_SECONDS) and the key reaching the consumer.
+
+Exits non-zero if a mode misses a press or edge mode reads pins while idle.
+
+    python bench_keypad.py --idle 2 --presses 50
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+
+from keypad_driver import Keypad
+from simulators import FakeGPIO
+
+HOLD_SECONDS = 0.08
+
+
+def _bench(mode, idle_seconds, presses):
+    gpio = FakeGPIO()
+    kp = Keypad(gpio=gpio, mode=mode)
+    received = []
+    cpu = {}
+    running = True
+    idle_done = threading.Event()
+
+    def scanner():
+        start_cpu = time.thread_time()
+        while running:
+            key = kp.read_key(timeout=0.5)
+            if key:
+                received.append(time.perf_counter())
+            if not idle_done.is_set() and "idle" not in cpu and time.monotonic() >= idle_until:
+                cpu["idle"] = time.thread_time() - start_cpu
+                idle_done.set()
+
+    idle_until = time.monotonic() + idle_seconds
+    thread = threading.Thread(target=scanner, daemon=True)
+    thread.start()
+    idle_done.wait()
+    idle_io = gpio.input_calls
+
+    latencies = []
+    for i in range(presses):
+        row_num, col_num = divmod(i % 16, 4)
+        row, col = kp.ROW_PINS[row_num], kp.COL_PINS[col_num]
+        before = len(received)
+        pressed_at = time.perf_counter()
+        gpio.press(row, col)
+        # A human press lasts tens of milliseconds; polling only reports on release
+        time.sleep(HOLD_SECONDS)
+        gpio.release(row, col)
+        while len(received) == before and time.perf_counter() - pressed_at < 1:
+            time.sleep(0.0005)
+        if len(received) > before:
+            latencies.append((received[-1] - pressed_at) * 1000)
+        time.sleep(kp.debounce + 0.02)
+
+    running = False
+    thread.join()
+    kp.cleanup()
+    return {
+        "mode": kp.mode,
+        "idle_cpu_pct": 100 * cpu["idle"] / idle_seconds,
+        "idle_pin_reads": idle_io,
+        "detected": len(latencies),
+        "p50_ms": statistics.median(latencies) if latencies else float("nan"),
+        "max_ms": max(latencies) if latencies else float("nan"),
+    }
+
+
+def problems(result, presses):
+    """What's wrong with one mode's result (empty if nothing)."""
+    found = []
+    if result["detected"] < presses:
+        found.append(f"{result['mode']}: detected {result['detected']} of {presses} presses")
+    if result["mode"] == "edge" and result["idle_pin_reads"] > 0:
+        found.append(f"edge: {result['idle_pin_reads']} pin reads while idle")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--idle", type=float, default=2.0, help="idle seconds to sample CPU")
+    parser.add_argument("--presses", type=int, default=32)
+    args = parser.parse_args()
+
+    print(f"{'mode':<6} {'idle CPU':>9} {'pin reads':>10} {'detected':>9} {'p50 ms':>8} {'max ms':>8}")
+    failures = []
+    for mode in ("poll", "edge"):
+        r = _bench(mode, args.idle, args.presses)
+        print(f"{r['mode']:<6} {r['idle_cpu_pct']:>8.1f}% {r['idle_pin_reads']:>10} "
+              f"{r['detected']:>4}/{args.presses:<4} {r['p50_ms']:>8.2f} {r['max_ms']:>8.2f}")
+        failures += problems(r, args.presses)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Per-terminal event latency as one backend serves more and more kiosks.
+
+Starts main.app with simulated hardware, and for each terminal count opens a
+keypad and a card WebSocket per terminal. Every round, each terminal gets a
+key press (POST /keypad/{key}) and a card insert (POST /rfid/insert) at the
+same moment; the time from the POST to the event arriving on that
+terminal's socket is the latency. A socket receiving another terminal's
+event counts as a leak.
+
+Afterwards a keypad client drops, keys are pressed while it is away, and it
+reconnects with ?last_seq=: it should get exactly the missed keys, in order.
+
+    python bench_terminals.py --terminals 1 8 32 64 --rounds 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from bench_atm import Lifespan, asgi_request
+
+
+class AsgiWebSocket:
+    """Just enough of a WebSocket client to talk to an ASGI app in-process."""
+
+    def __init__(self, app, path):
+        self.app = app
+        self.path, _, self.query = path.partition("?")
+        self._inbox = asyncio.Queue()
+        self._outbox = asyncio.Queue()
+        self._task = None
+
+    async def connect(self):
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": self.path,
+            "raw_path": self.path.encode(),
+            "query_string": self.query.encode(),
+            "root_path": "",
+            "headers": [],
+            "client": ("127.0.0.1", 50000),
+            "server": ("bench", 80),
+            "subprotocols": [],
+        }
+        self._task = asyncio.ensure_future(self.app(scope, self._inbox.get, self._server_send))
+        await self._inbox.put({"type": "websocket.connect"})
+        message = await self._outbox.get()
+        if message["type"] != "websocket.accept":
+            raise RuntimeError(f"WebSocket rejected: {message}")
+        return self
+
+    async def _server_send(self, message):
+        await self._outbox.put(message)
+
+    async def receive_text(self):
+        message = await self._outbox.get()
+        if message["type"] == "websocket.close":
+            raise ConnectionError("closed by server")
+        return message.get("text")
+
+    async def close(self):
+        await self._inbox.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self._task, 5)
+
+
+async def run_level(app, count, rounds):
+    ids = [f"bench-{count}-{i}" for i in range(count)]
+    keypads = [await AsgiWebSocket(app, f"/ws/keypad?terminal={t}").connect() for t in ids]
+    cards = [await AsgiWebSocket(app, f"/ws/card?terminal={t}").connect() for t in ids]
+    for ws in cards:
+        await ws.receive_text()  # the snapshot
+
+    key_latency, card_latency = [], []
+    leaks = 0
+
+    async def one(i, n):
+        nonlocal leaks
+        terminal = ids[i]
+        key = "0123456789"[(i + n) % 10]
+        tag = f"{i:06d}{n:06d}"
+
+        started = time.perf_counter()
+        await asgi_request(app, "POST", f"/keypad/{key}?terminal={terminal}")
+        got = json.loads(await asyncio.wait_for(keypads[i].receive_text(), 5))
+        key_latency.append(time.perf_counter() - started)
+        leaks += [e["key"] for e in got] != [key]
+
+        started = time.perf_counter()
+        await asgi_request(app, "POST", f"/rfid/insert/{tag}?terminal={terminal}")
+        event = json.loads(await asyncio.wait_for(cards[i].receive_text(), 5))
+        card_latency.append(time.perf_counter() - started)
+        leaks += event["rfid_tag"] != tag
+
+    started = time.perf_counter()
+    for n in range(rounds):
+        await asyncio.gather(*(one(i, n) for i in range(count)))
+    elapsed = time.perf_counter() - started
+
+    for ws in keypads + cards:
+        await ws.close()
+    return key_latency, card_latency, leaks, elapsed
+
+
+async def check_replay(app, missed=20):
+    """Reconnect after missing keys; returns (replayed keys, pressed keys)."""
+    hub = "bench-replay"
+    ws = await AsgiWebSocket(app, f"/ws/keypad?terminal={hub}").connect()
+    await asgi_request(app, "POST", f"/keypad/1?terminal={hub}")
+    last_seq = json.loads(await asyncio.wait_for(ws.receive_text(), 5))[-1]["seq"]
+    await ws.close()
+
+    pressed = ["0123456789"[i % 10] for i in range(missed)]
+    for key in pressed:
+        await asgi_request(app, "POST", f"/keypad/{key}?terminal={hub}")
+
+    ws = await AsgiWebSocket(app, f"/ws/keypad?terminal={hub}&last_seq={last_seq}").connect()
+    replayed = [e["key"] for e in json.loads(await asyncio.wait_for(ws.receive_text(), 5))]
+    await ws.close()
+    return replayed, pressed
+
+
+def percentiles(values):
+    q = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+    return q[49] * 1000, q[94] * 1000, q[98] * 1000
+
+
+async def run(app, levels, rounds):
+    async with Lifespan(app):
+        results = []
+        for count in levels:
+            results.append((count,) + await run_level(app, count, rounds))
+        return results, await check_replay(app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--terminals", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Configure before main is imported: it opens the DB at import
+        os.environ["ATM_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["ATM_HARDWARE"] = "fake"
+        os.environ.setdefault("ATM_LOG_LEVEL", "WARNING")
+
+        import database
+        import main as atm
+
+        results, (replayed, pressed) = asyncio.run(run(atm.app, args.terminals, args.rounds))
+        database.get_pool().close_all()
+
+    print(f"{args.rounds} rounds per level; latency = POST to event on the terminal's socket")
+    print(f"{'terminals':>9} {'key p50':>9} {'key p95':>9} {'key p99':>9} "
+          f"{'card p50':>9} {'card p95':>9} {'card p99':>9} {'events/s':>9} {'leaks':>6}")
+    leaked = 0
+    for count, keys, cards, leaks, elapsed in results:
+        k, c = percentiles(keys), percentiles(cards)
+        print(f"{count:>9} {k[0]:>9.2f} {k[1]:>9.2f} {k[2]:>9.2f} "
+              f"{c[0]:>9.2f} {c[1]:>9.2f} {c[2]:>9.2f} "
+              f"{(len(keys) + len(cards)) / elapsed:>9.0f} {leaks:>6}")
+        leaked += leaks
+    print(f"replay after reconnect: {len(replayed)}/{len(pressed)} missed keys, "
+          f"{'in order' if replayed == pressed else 'MISMATCH'}")
+    return 1 if leaked or replayed != pressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
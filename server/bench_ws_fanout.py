@@ -0,0 +1,182 @@
+"""
+Keypad fan-out with stalled clients.
+
+One terminal gets --healthy well-behaved keypad sockets plus --stalled
+sockets that accept and then never read again (their sends block forever)
+and --lagging sockets that take --lag-ms per frame. Keys are pressed from a
+background thread, the way the keypad scanner does it, and the healthy
+clients' press-to-receive latency is measured with and without the bad
+clients attached.
+
+Healthy latency should not move; stalled clients should be disconnected
+after the send timeout; lagging clients should get every key, with bursts
+coalesced into fewer frames.
+
+    python bench_ws_fanout.py --healthy 8 --stalled 8 --lagging 2 --keys 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from bench_atm import Lifespan
+from bench_terminals import AsgiWebSocket
+
+TERMINAL = "fanout"
+
+
+class StalledWebSocket(AsgiWebSocket):
+    """Accepts, then stops reading: every later send from the server blocks."""
+
+    def __init__(self, app, path):
+        super().__init__(app, path)
+        self._stalled = False
+
+    async def connect(self):
+        await super().connect()
+        self._stalled = True
+        return self
+
+    async def _server_send(self, message):
+        if self._stalled:
+            await asyncio.Event().wait()  # never set
+        await super()._server_send(message)
+
+
+class LaggingWebSocket(AsgiWebSocket):
+    """Reads, but each frame the server sends takes `lag` seconds to go out."""
+
+    def __init__(self, app, path, lag):
+        super().__init__(app, path)
+        self.lag = lag
+
+    async def _server_send(self, message):
+        if message["type"] == "websocket.send":
+            await asyncio.sleep(self.lag)
+        await super()._server_send(message)
+
+
+async def collect(ws, received, stop):
+    """Record (arrival time, frame) for everything a client receives."""
+    while not stop.is_set():
+        try:
+            text = await asyncio.wait_for(ws.receive_text(), 0.2)
+        except asyncio.TimeoutError:
+            continue
+        except ConnectionError:
+            return
+        received.append((time.perf_counter(), json.loads(text)))
+
+
+def press_keys(hub, count, interval, pressed):
+    for i in range(count):
+        pressed.append(time.perf_counter())
+        hub.press("0123456789"[i % 10])
+        time.sleep(interval)
+
+
+async def scenario(app, hub, healthy, stalled, lagging, keys, interval, lag):
+    stop = asyncio.Event()
+    path = f"/ws/keypad?terminal={TERMINAL}"
+    good = [await AsgiWebSocket(app, path).connect() for _ in range(healthy)]
+    slow = [await LaggingWebSocket(app, path, lag).connect() for _ in range(lagging)]
+    stuck = [await StalledWebSocket(app, path).connect() for _ in range(stalled)]
+    await asyncio.sleep(0.05)
+
+    good_frames = [[] for _ in good]
+    slow_frames = [[] for _ in slow]
+    readers = [asyncio.ensure_future(collect(ws, r, stop)) for ws, r in zip(good, good_frames)]
+    readers += [asyncio.ensure_future(collect(ws, r, stop)) for ws, r in zip(slow, slow_frames)]
+
+    pressed = []
+    producer = threading.Thread(target=press_keys, args=(hub, keys, interval, pressed))
+    producer.start()
+    while producer.is_alive():
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(1.0)  # let the laggards catch up
+    subscribers_left = hub.subscriber_count()
+    stop.set()
+    await asyncio.gather(*readers)
+    for ws in good + slow:
+        await ws.close()
+    for ws in stuck:
+        ws._task.cancel()
+
+    latencies = []
+    for frames in good_frames:
+        i = 0
+        for arrived, events in frames:
+            for _ in events:
+                latencies.append(arrived - pressed[i])
+                i += 1
+    slow_keys = [sum(len(events) for _, events in frames) for frames in slow_frames]
+    slow_count = [len(frames) for frames in slow_frames]
+    return {
+        "latencies": latencies,
+        "expected": keys * healthy,
+        "slow_keys": slow_keys,
+        "slow_frames": slow_count,
+        "stalled": stalled,
+        "stalled_left": subscribers_left - healthy - lagging,
+    }
+
+
+def report(label, result, keys):
+    values = result["latencies"]
+    q = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+    print(f"{label:<28} healthy keys {len(values)}/{result['expected']}  "
+          f"p50 {q[49] * 1000:6.2f} ms  p99 {q[98] * 1000:6.2f} ms  max {max(values) * 1000:6.2f} ms")
+    for got, frames in zip(result["slow_keys"], result["slow_frames"]):
+        print(f"{'':<28} lagging client: {got}/{keys} keys in {frames} frames")
+    if result["stalled"]:
+        print(f"{'':<28} stalled clients disconnected: "
+              f"{result['stalled'] - result['stalled_left']}/{result['stalled']}")
+
+
+async def run(atm, args):
+    async with Lifespan(atm.app):
+        hub = atm.terminals.get(TERMINAL).keys
+        baseline = await scenario(atm.app, hub, args.healthy, 0, 0,
+                                  args.keys, args.interval_ms / 1000, 0)
+        loaded = await scenario(atm.app, hub, args.healthy, args.stalled, args.lagging,
+                                args.keys, args.interval_ms / 1000, args.lag_ms / 1000)
+        return baseline, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--healthy", type=int, default=8)
+    parser.add_argument("--stalled", type=int, default=8)
+    parser.add_argument("--lagging", type=int, default=2)
+    parser.add_argument("--keys", type=int, default=300)
+    parser.add_argument("--interval-ms", type=float, default=5.0, help="time between key presses")
+    parser.add_argument("--lag-ms", type=float, default=40.0, help="per-frame delay of lagging clients")
+    parser.add_argument("--send-timeout", type=float, default=0.5,
+                        help="seconds before a stalled send disconnects the client")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["ATM_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["ATM_HARDWARE"] = "null"
+        os.environ.setdefault("ATM_LOG_LEVEL", "ERROR")
+
+        import database
+        import main as atm
+
+        atm.WS_SEND_TIMEOUT = args.send_timeout
+        baseline, loaded = asyncio.run(run(atm, args))
+        database.get_pool().close_all()
+
+    report("no bad clients", baseline, args.keys)
+    report(f"{args.stalled} stalled + {args.lagging} lagging", loaded, args.keys)
+    complete = all(r["latencies"] and len(r["latencies"]) == r["expected"] for r in (baseline, loaded))
+    return 0 if complete and not loaded["stalled_left"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
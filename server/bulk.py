@@ -0,0 +1,223 @@
+"""
+Bulk posting: load a file of deposits/withdrawals straight into the ledger.
+
+    python bulk.py payroll.csv
+    python bulk.py settlement.ndjson --db /srv/atm/database.db --failures failed.csv
+
+CSV files need a header naming the rfid_tag, type and amount columns (any
+order, other columns ignored); NDJSON files have one
+{"rfid_tag": ..., "type": ..., "amount": ...} object per line. type is
+deposit or withdraw.
+"""
+import argparse
+import codecs
+import csv
+import json
+import os
+import sys
+import time
+
+import ledger
+
+# ==============================
+#   Bulk posting
+# ==============================
+# Rows are parsed as they stream in and handed to ledger.post_bulk
+# CHUNK_ROWS at a time: one transaction, one tag lookup per RESOLVE_BATCH
+# tags and two executemany calls per chunk, instead of a transaction per
+# posting. A row that can't be posted is reported with its line number and
+# the rest of the file carries on. Memory is bounded by one chunk, however
+# big the file.
+
+CHUNK_ROWS = 5000
+MAX_REPORTED_FAILURES = 1000    # failures listed in an API response; the rest are counted
+FORMATS = ("csv", "ndjson")
+FIELDS = ("rfid_tag", "type", "amount")
+
+
+class BulkFormatError(ValueError):
+    """The file as a whole can't be read (bad CSV header, unknown format)."""
+
+
+class BulkLoader:
+    """
+    Feed lines in with add(); full chunks are posted as they fill up, and
+    finish() posts the remainder and returns the summary.
+
+    Not thread-safe: one loader per upload.
+    """
+
+    def __init__(self, fmt, chunk_rows=CHUNK_ROWS, max_failures=MAX_REPORTED_FAILURES):
+        if fmt not in FORMATS:
+            raise BulkFormatError(f"Unknown bulk format: {fmt!r}")
+        self.fmt = fmt
+        self.chunk_rows = chunk_rows
+        self.max_failures = max_failures
+        self._columns = None if fmt == "csv" else FIELDS
+        self._pending = []
+        self.line = 0
+        self.rows = 0
+        self.posted = 0
+        self.failed = 0
+        self.chunks = 0
+        self.failures = []
+        self._started = time.perf_counter()
+
+    # ---------- input ----------
+    def add(self, lines):
+        for text in lines:
+            self.line += 1
+            text = text.strip()
+            if not text:
+                continue
+            if self._columns is None:
+                self._columns = self._read_header(text)
+                continue
+            self.rows += 1
+            try:
+                tag, kind, amount = self._parse(text)
+            except ValueError as e:
+                self._fail(self.line, None, str(e))
+                continue
+            self._pending.append((self.line, tag, kind, amount))
+            if len(self._pending) >= self.chunk_rows:
+                self._flush()
+
+    def finish(self):
+        if self._pending:
+            self._flush()
+        if self._columns is None:
+            raise BulkFormatError("CSV file is empty; expected a header row")
+        return self.summary()
+
+    def _read_header(self, text):
+        header = [name.strip().lower() for name in next(csv.reader([text]))]
+        missing = [name for name in FIELDS if name not in header]
+        if missing:
+            raise BulkFormatError(f"CSV header is missing columns: {', '.join(missing)}")
+        return tuple(header.index(name) for name in FIELDS)
+
+    def _parse(self, text):
+        if self.fmt == "csv":
+            cells = next(csv.reader([text]))
+            try:
+                tag, kind, amount = (cells[i].strip() for i in self._columns)
+            except IndexError:
+                raise ValueError("Row has too few columns")
+        else:
+            try:
+                obj = json.loads(text)
+                tag, kind, amount = (obj[name] for name in FIELDS)
+            except (ValueError, TypeError, KeyError) as e:
+                raise ValueError(f"Invalid NDJSON row: {e}")
+            tag, kind = str(tag), str(kind)
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid amount: {amount!r}")
+        if not tag:
+            raise ValueError("Missing rfid_tag")
+        return tag, kind.lower(), amount
+
+    # ---------- posting ----------
+    def _flush(self):
+        chunk, self._pending = self._pending, []
+        self.chunks += 1
+        try:
+            result = ledger.post_bulk(chunk)
+        except ledger.LedgerBusy as e:
+            # The whole chunk was rolled back; report every row in it
+            for line, tag, _, _ in chunk:
+                self._fail(line, tag, str(e))
+            return
+        self.posted += result["posted"]
+        tags = {line: tag for line, tag, _, _ in chunk} if result["failures"] else {}
+        for line, message in result["failures"]:
+            self._fail(line, tags[line], message)
+
+    def _fail(self, line, tag, message):
+        self.failed += 1
+        if self.max_failures is None or len(self.failures) < self.max_failures:
+            self.failures.append({"line": line, "rfid_tag": tag, "error": message})
+
+    def summary(self):
+        elapsed = time.perf_counter() - self._started
+        return {
+            "rows": self.rows,
+            "posted": self.posted,
+            "failed": self.failed,
+            "chunks": self.chunks,
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows / elapsed) if elapsed else 0,
+            "failures": sorted(self.failures, key=lambda f: f["line"]),
+            "failures_truncated": self.failed > len(self.failures),
+        }
+
+
+class LineSplitter:
+    """Turn an uploaded byte stream into text lines as chunks arrive."""
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._tail = ""
+
+    def feed(self, data):
+        text = self._tail + self._decoder.decode(data)
+        lines = text.split("\n")
+        self._tail = lines.pop()
+        return lines
+
+    def end(self):
+        rest = self._tail + self._decoder.decode(b"", final=True)
+        self._tail = ""
+        return [rest] if rest else []
+
+
+def format_for(path):
+    return "ndjson" if os.path.splitext(path)[1].lower() in (".ndjson", ".jsonl") else "csv"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("file", help="CSV or NDJSON postings; - reads stdin")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    parser.add_argument("--db", help="database file (default: ATM_DB_PATH or database.db)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--failures", help="write every failed row to this CSV file")
+    args = parser.parse_args()
+
+    import database
+    if args.db:
+        database.configure(args.db)
+    database.init_db()
+
+    fmt = args.format or ("csv" if args.file == "-" else format_for(args.file))
+    loader = BulkLoader(fmt, args.chunk_rows, max_failures=None)
+    source = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8-sig", newline="")
+    try:
+        loader.add(source)
+        summary = loader.finish()
+    except BulkFormatError as e:
+        parser.error(str(e))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        database.get_pool().close_all()
+
+    print(f"{summary['posted']}/{summary['rows']} postings applied in {summary['chunks']} "
+          f"chunks, {summary['seconds']} s ({summary['rows_per_second']} rows/s)")
+    if args.failures:
+        with open(args.failures, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=("line", "rfid_tag", "error"))
+            writer.writeheader()
+            writer.writerows(summary["failures"])
+    for failure in summary["failures"][:20]:
+        print(f"  line {failure['line']}: {failure['rfid_tag'] or '-'}: {failure['error']}",
+              file=sys.stderr)
+    if summary["failed"] > 20:
+        print(f"  ... {summary['failed'] - 20} more", file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
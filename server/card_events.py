@@ -0,0 +1,175 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+# ==============================
+#   Card / key state + event push
+# ==============================
+# Holds which card is in the reader and pushes insert/remove/recognized
+# events to every subscribed WebSocket. Each event carries a sequence number
+# that only ever goes up, so a client that reconnects can compare it with the
+# last one it saw and tell whether it missed something. Key presses go out
+# the same way through a KeyEventHub. Each terminal has one of each
+# (terminals.py).
+#
+# Publishing never waits on a client. Every subscriber has its own bounded
+# Subscription that the hub appends to on the event loop; the socket's writer
+# task drains whatever has piled up in one go, so a burst that arrived while
+# a client was busy goes out together. A client that lets its queue fill up
+# is handled by the hub's overflow policy:
+#   "drop"  - discard the event; the client sees the seq gap and resyncs
+#   "close" - stop feeding it; the writer closes the socket and the client
+#             reconnects (for keys, where silently losing a digit is worse)
+
+SUBSCRIBER_QUEUE_SIZE = 64
+KEY_HISTORY_SIZE = 256      # recent key events kept for clients that reconnect
+
+
+class Subscription:
+    """One subscriber's bounded queue. Only touched on the event loop."""
+
+    def __init__(self, maxsize=SUBSCRIBER_QUEUE_SIZE, overflow="drop"):
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.overflowed = False     # "close" policy tripped; writer should hang up
+        self._events = deque()
+        self._ready = asyncio.Event()
+        self._tripped = asyncio.Event()
+
+    def offer(self, event):
+        """Non-blocking enqueue. Returns False if the event was not queued."""
+        if self.overflowed:
+            return False
+        if len(self._events) >= self.maxsize:
+            self.dropped += 1
+            if self.overflow == "close":
+                self.overflowed = True
+                self._ready.set()
+                self._tripped.set()
+            return False
+        self._events.append(event)
+        self._ready.set()
+        return True
+
+    async def next_batch(self):
+        """Wait for events, then take everything queued so far (oldest first)."""
+        await self._ready.wait()
+        self._ready.clear()
+        batch = list(self._events)
+        self._events.clear()
+        return batch
+
+    async def wait_overflowed(self):
+        """Return once the "close" policy has tripped (a send may still be stuck)."""
+        await self._tripped.wait()
+
+    def __len__(self):
+        return len(self._events)
+
+
+class EventHub:
+    """Fans events out to Subscriptions; publish from any thread."""
+
+    overflow = "drop"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.seq = 0
+        self.loop = None        # event loop the subscriptions belong to
+
+    def _send(self, subscribers, event):
+        loop = self.loop
+        if subscribers and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._deliver, subscribers, event)
+        return event
+
+    @staticmethod
+    def _deliver(subscribers, event):
+        for sub in subscribers:
+            sub.offer(event)
+
+    # ---------- subscribers (event loop) ----------
+    def subscribe(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        sub = Subscription(maxsize, self.overflow)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+class CardEventHub(EventHub):
+    def __init__(self):
+        super().__init__()
+        self.current = None     # rfid tag of the inserted card, None = no card
+
+    # ---------- state changes (any thread) ----------
+    def insert(self, tag_id):
+        return self._publish("insert", tag_id)
+
+    def remove(self):
+        return self._publish("remove", None)
+
+    def recognized(self, tag_id, name):
+        return self._publish("recognized", tag_id, name=name)
+
+    def snapshot(self):
+        with self._lock:
+            return {"event": "snapshot", "seq": self.seq, "rfid_tag": self.current}
+
+    def _publish(self, kind, tag_id, **extra):
+        with self._lock:
+            self.seq += 1
+            if kind == "insert":
+                self.current = tag_id
+            elif kind == "remove":
+                tag_id, self.current = self.current, None
+            event = {"event": kind, "seq": self.seq, "rfid_tag": tag_id, "ts": time.time()}
+            event.update(extra)
+            subscribers = list(self._subscribers)
+        return self._send(subscribers, event)
+
+
+class KeyEventHub(EventHub):
+    """
+    Key presses, plus a fixed ring of the last KEY_HISTORY_SIZE of them so a
+    client that drops off (flaky kiosk Wi-Fi) can reconnect with the last seq
+    it saw and get the keys it missed. The ring is allocated once; event seq
+    N lives in slot N % size, so memory never grows.
+    """
+
+    overflow = "close"
+
+    def __init__(self, history_size=KEY_HISTORY_SIZE):
+        super().__init__()
+        self._ring = [None] * history_size
+
+    def press(self, key):
+        with self._lock:
+            self.seq += 1
+            event = {"event": "key", "seq": self.seq, "key": key, "ts": time.time()}
+            self._ring[self.seq % len(self._ring)] = event
+            subscribers = list(self._subscribers)
+        return self._send(subscribers, event)
+
+    def replay(self, after_seq):
+        """
+        Return (events after after_seq still in the ring, oldest first, and the
+        current seq). Events that have already been overwritten are skipped;
+        the client sees the jump in seq.
+        """
+        with self._lock:
+            newest = self.seq
+            oldest = max(1, newest - len(self._ring) + 1)
+            start = max(after_seq + 1, oldest)
+            events = [self._ring[seq % len(self._ring)] for seq in range(start, newest + 1)]
+        return events, newest
@@ -0,0 +1,163 @@
+"""
+Per-user daily totals: kept up to date by the ledger, rebuilt from it on demand.
+
+    python daily_totals.py --rebuild                # every user, every day
+    python daily_totals.py --rebuild --user 42      # one user
+    python daily_totals.py --check                  # report drift, change nothing
+"""
+import argparse
+import sys
+from datetime import datetime, timezone
+
+# ==============================
+#   Daily totals
+# ==============================
+# One daily_totals row per user per day holds the count and sum of that
+# day's deposits, withdrawals and fees. The ledger adds to it in the same
+# transaction that inserts the transactions rows, so it is always exactly
+# what a GROUP BY over the ledger would say, and a daily limit check reads
+# one row by primary key however long the history gets.
+#
+# Days are UTC dates. A posting reads the clock once (posting_time()),
+# stamps its transactions rows with that timestamp and records them under
+# its date, so a posting made on the stroke of midnight counts on the same
+# day here as date(transactions.timestamp) says.
+
+KINDS = ("deposit", "withdraw", "fee")
+COLUMNS = tuple(f"{kind}_{field}" for kind in KINDS for field in ("count", "amount"))
+
+_UPSERT = (
+    f"INSERT INTO daily_totals (user_id, day, {', '.join(COLUMNS)}) "
+    f"VALUES (?, ?, {', '.join('?' * len(COLUMNS))}) "
+    f"ON CONFLICT (user_id, day) DO UPDATE SET "
+    + ", ".join(f"{c} = {c} + excluded.{c}" for c in COLUMNS)
+)
+
+_AGGREGATE = (
+    "SELECT user_id, date(timestamp), "
+    + ", ".join(
+        f"SUM(type = '{kind}'), TOTAL(CASE WHEN type = '{kind}' THEN amount END)"
+        for kind in KINDS
+    )
+    + " FROM {source} {where} GROUP BY user_id, date(timestamp)"
+)
+
+
+def posting_time():
+    """The current UTC time in CURRENT_TIMESTAMP's layout, for one posting's rows."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _row(user_id, posted_at, postings):
+    """Upsert parameters for [(kind, amount), ...] posted for one user at posted_at."""
+    values = dict.fromkeys(COLUMNS, 0)
+    for kind, amount in postings:
+        values[f"{kind}_count"] += 1
+        values[f"{kind}_amount"] += amount
+    return (user_id, posted_at[:10], *(values[c] for c in COLUMNS))
+
+
+def record(conn, user_id, postings, posted_at):
+    """
+    Add [(kind, amount), ...] to user_id's row for posted_at's day. Call
+    inside the posting transaction, with the timestamp its rows were given.
+    """
+    conn.execute(_UPSERT, _row(user_id, posted_at, postings))
+
+
+def record_many(conn, postings_by_user, posted_at):
+    """record() for many users at once: {user_id: [(kind, amount), ...]}."""
+    conn.executemany(_UPSERT, [_row(uid, posted_at, p) for uid, p in postings_by_user.items()])
+
+
+def today(conn, user_id, posted_at=None):
+    """
+    {column: value} of user_id's totals for today, or for posted_at's day
+    (zeros if nothing was posted).
+    """
+    day = (posted_at or posting_time())[:10]
+    row = conn.execute(
+        f"SELECT {', '.join(COLUMNS)} FROM daily_totals WHERE user_id = ? AND day = ?",
+        (user_id, day),
+    ).fetchone()
+    return dict(zip(COLUMNS, row or (0,) * len(COLUMNS)))
+
+
+def rebuild(conn, user_id=None, source="transactions"):
+    """
+    Recompute daily_totals from the ledger (all users, or one). source is
+    the table or subquery to read, e.g. archive.ledger_source(conn) to
+    include archived rows. Runs in the caller's transaction; returns the
+    number of rows written.
+    """
+    where, params = ("WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+    conn.execute(f"DELETE FROM daily_totals {where}", params)
+    cur = conn.execute(
+        f"INSERT INTO daily_totals (user_id, day, {', '.join(COLUMNS)}) "
+        + _AGGREGATE.format(source=source, where=where),
+        params,
+    )
+    return cur.rowcount
+
+
+def drift(conn, user_id=None, source="transactions"):
+    """(user_id, day) pairs whose stored totals differ from the ledger's."""
+    where, params = ("WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+    expected = {
+        (r[0], r[1]): r[2:]
+        for r in conn.execute(_AGGREGATE.format(source=source, where=where), params)
+    }
+    stored = {
+        (r[0], r[1]): r[2:]
+        for r in conn.execute(
+            f"SELECT user_id, day, {', '.join(COLUMNS)} FROM daily_totals {where}", params)
+    }
+    return sorted(
+        key for key in expected.keys() | stored.keys()
+        if not _same(expected.get(key), stored.get(key))
+    )
+
+
+def _same(a, b):
+    if a is None or b is None:
+        return False
+    return all(abs(x - y) < 1e-6 for x, y in zip(a, b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--rebuild", action="store_true", help="recompute from the ledger")
+    action.add_argument("--check", action="store_true", help="list days that don't match the ledger")
+    parser.add_argument("--user", type=int, help="only this user id")
+    parser.add_argument("--db", help="database file (default: ATM_DB_PATH or database.db)")
+    args = parser.parse_args()
+
+    import archive
+    import database
+    import ledger
+    if args.db:
+        database.configure(args.db)
+    database.init_db()
+
+    # Totals cover archived rows too, so read the hot table and the archive
+    try:
+        if args.check:
+            with database.read_connection() as conn:
+                archive.attach(conn)
+                bad = drift(conn, args.user, archive.ledger_source(conn))
+            for user_id, day in bad:
+                print(f"user {user_id} {day}: totals don't match the ledger")
+            print(f"{len(bad)} day(s) out of step")
+            return 1 if bad else 0
+        with archive.attached_writer():
+            rows = ledger.run_in_transaction(
+                lambda conn: rebuild(conn, args.user, archive.ledger_source(conn)))
+        print(f"Rebuilt {rows} daily total row(s)")
+        return 0
+    finally:
+        database.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
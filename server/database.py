@@ -1,12 +1,322 @@
+import os
 import sqlite3
+import threading
+import queue
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from atm_logging import get_logger
+from metrics import db_acquire_seconds, db_statement_seconds
+
+log = get_logger("atm.db")
+
+DB_NAME = os.getenv("ATM_DB_PATH", "database.db")
+
+# -------------------- CONNECTION POOL SETTINGS --------------------
+POOL_SIZE = 8               # max idle reader connections kept open
+BUSY_TIMEOUT_MS = 5000      # how long a statement waits on a lock before SQLITE_BUSY
+STATEMENT_CACHE_SIZE = 256  # prepared statements cached per connection
+
+
+def _open_connection(db_name):
+    """Open a connection with the pragmas every pooled connection shares."""
+    conn = sqlite3.connect(
+        db_name,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,  # connections move between request threads
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    # Lets archive.py hand freed pages back after moving old rows out. Only
+    # takes effect while the file is still empty (so it must come before
+    # journal_mode); existing databases are converted with
+    # archive.py --enable-incremental-vacuum
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL lets readers keep reading while a writer commits
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def _statement_op(sql):
+    """SELECT / INSERT / UPDATE / BEGIN ... as a metrics label."""
+    return sql.lstrip().split(None, 1)[0].upper()
+
+
+class PooledConnection:
+    """
+    Wraps a sqlite3 connection so that close() hands it back to the pool
+    instead of tearing it down. Everything else is passed straight through,
+    so existing `conn.cursor() ... conn.close()` code keeps working.
+    """
+
+    def __init__(self, conn, release):
+        self._conn = conn
+        self._release = release
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed connection.")
+        return getattr(self._conn, name)
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return self._conn.execute(sql, parameters)
+        finally:
+            db_statement_seconds.observe(time.perf_counter() - start, op=_statement_op(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return self._conn.executemany(sql, seq_of_parameters)
+        finally:
+            db_statement_seconds.observe(time.perf_counter() - start, op=_statement_op(sql))
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        if conn.in_transaction:
+            # Never return a connection with a half-done transaction
+            conn.rollback()
+        self._release(conn)
+
+    def __del__(self):
+        # Connection dropped without close() (e.g. an exception path)
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of reader connections plus one serialized writer connection.
+
+    Readers never wait on the writer lock, and with WAL they never wait on a
+    commit either. Writers share a single connection guarded by a lock, so
+    mutations from this process are applied one at a time instead of
+    fighting each other for the database lock.
+    """
+
+    def __init__(self, db_name, size=POOL_SIZE):
+        self.db_name = db_name
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._open_count = 0
+        self._count_lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self._closed = False
+
+    # ---------- readers ----------
+    def acquire(self, timeout=None):
+        """Borrow a reader connection, opening a new one if the pool is not full."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._count_lock:
+                if self._open_count < self.size:
+                    # Count the slot only once the connection exists, so a
+                    # failed open (locked file, full disk) doesn't leak it
+                    conn = _open_connection(self.db_name)
+                    self._open_count += 1
+            if conn is None:
+                conn = self._idle.get(timeout=timeout)
+        return PooledConnection(conn, self._release)
+
+    def _release(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+            with self._count_lock:
+                self._open_count -= 1
+
+    # ---------- writer ----------
+    def acquire_writer(self, timeout=-1):
+        """Take the single writer connection. close() on the result releases it."""
+        if not self._write_lock.acquire(timeout=timeout):
+            raise sqlite3.OperationalError("Timed out waiting for the writer connection")
+        if self._writer is None:
+            try:
+                self._writer = _open_connection(self.db_name)
+            except Exception:
+                self._write_lock.release()
+                raise
+        return PooledConnection(self._writer, self._release_writer)
+
+    def _release_writer(self, conn):
+        self._write_lock.release()
+
+    # ---------- shutdown ----------
+    def close_all(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_NAME, POOL_SIZE)
+    return _pool
+
+
+def configure(db_name=None, pool_size=None):
+    """Point the pool at another database file (scripts, benchmarks)."""
+    global _pool, DB_NAME, POOL_SIZE
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
+        if db_name is not None:
+            DB_NAME = db_name
+        if pool_size is not None:
+            POOL_SIZE = pool_size
 
-DB_NAME = "database.db"
 
 def get_connection():
-    return sqlite3.connect(DB_NAME)
+    """Borrow a pooled reader connection. Call close() to return it."""
+    start = time.perf_counter()
+    conn = get_pool().acquire()
+    db_acquire_seconds.observe(time.perf_counter() - start, kind="read")
+    return conn
 
-def init_db():
+
+def get_write_connection():
+    """Borrow the serialized writer connection. Call close() to release it."""
+    start = time.perf_counter()
+    conn = get_pool().acquire_writer()
+    db_acquire_seconds.observe(time.perf_counter() - start, kind="write")
+    return conn
+
+
+@contextmanager
+def read_connection():
     conn = get_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def open_readonly_connection():
+    """
+    A private read-only connection for long scans (exports, reports).
+
+    It is opened outside the pool so a slow client can't starve request
+    handlers of readers, and with mode=ro so it can never take the write
+    lock. Under WAL its snapshot doesn't block withdraw/deposit commits.
+    """
+    path = os.path.abspath(DB_NAME)
+    conn = sqlite3.connect(
+        f"file:{quote(path)}?mode=ro",
+        uri=True,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,  # streamed responses iterate on a worker thread
+    )
+    conn.execute("PRAGMA query_only=ON")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+@contextmanager
+def write_connection():
+    """Writer connection that commits on success and rolls back on error."""
+    conn = get_write_connection()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+# -------------------- SCHEMA MIGRATIONS --------------------
+# Applied in order by init_db; PRAGMA user_version records how many have run.
+# Only ever append to this list.
+MIGRATIONS = [
+    # 1: history seeks by user and walks newest-first without a sort
+    "CREATE INDEX IF NOT EXISTS idx_transactions_user_ts "
+    "ON transactions (user_id, timestamp, id)",
+    # 2: results of postings made with an Idempotency-Key (see idempotency.py)
+    "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+    "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, "
+    "response TEXT NOT NULL, created_at REAL NOT NULL)",
+    # 3: pruning expired keys
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created "
+    "ON idempotency_keys (created_at)",
+    # 4: per-user, per-day totals for limit checks (see daily_totals.py)
+    "CREATE TABLE IF NOT EXISTS daily_totals ("
+    "user_id INTEGER NOT NULL, day TEXT NOT NULL, "
+    "deposit_count INTEGER NOT NULL DEFAULT 0, deposit_amount REAL NOT NULL DEFAULT 0, "
+    "withdraw_count INTEGER NOT NULL DEFAULT 0, withdraw_amount REAL NOT NULL DEFAULT 0, "
+    "fee_count INTEGER NOT NULL DEFAULT 0, fee_amount REAL NOT NULL DEFAULT 0, "
+    "PRIMARY KEY (user_id, day)) WITHOUT ROWID",
+    # 5: backfill them from the existing ledger
+    "INSERT OR REPLACE INTO daily_totals SELECT user_id, date(timestamp), "
+    "SUM(type = 'deposit'), TOTAL(CASE WHEN type = 'deposit' THEN amount END), "
+    "SUM(type = 'withdraw'), TOTAL(CASE WHEN type = 'withdraw' THEN amount END), "
+    "SUM(type = 'fee'), TOTAL(CASE WHEN type = 'fee' THEN amount END) "
+    "FROM transactions GROUP BY user_id, date(timestamp)",
+    # 6: which users have rows in the archive, and their span (see archive.py)
+    "CREATE TABLE IF NOT EXISTS archived_users ("
+    "user_id INTEGER PRIMARY KEY, oldest_timestamp TEXT NOT NULL, "
+    "newest_timestamp TEXT NOT NULL)",
+]
+
+
+def _run_migrations(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, sql in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute(sql)
+        conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+        log.info("applied schema migration", version=number)
+
+
+# Columns the API reads; checked once at startup instead of on every request
+EXPECTED_COLUMNS = {
+    "users": {"id", "name", "rfid_tag", "balance", "pin"},
+    "transactions": {"id", "user_id", "type", "amount", "timestamp"},
+}
+
+
+def verify_schema(conn):
+    """Raise RuntimeError if a table or column the API depends on is missing."""
+    for table, expected in EXPECTED_COLUMNS.items():
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if not columns:
+            raise RuntimeError(f"Table '{table}' does not exist in {DB_NAME}")
+        missing = expected - columns
+        if missing:
+            raise RuntimeError(f"Table '{table}' is missing columns: {sorted(missing)}")
+
+
+def init_db():
+    conn = get_write_connection()
     cursor = conn.cursor()
 
     # Create users table with PIN
@@ -35,4 +345,6 @@ def init_db():
     #pucha
 
     conn.commit()
+    _run_migrations(conn)
+    verify_schema(conn)
     conn.close()
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import POOL_SIZE
+from metrics import Gauge, Histogram
+
+# ==============================
+#   Worker pools
+# ==============================
+# Request handlers are async and hand blocking work to a pool sized for it,
+# instead of all sharing Starlette's default threadpool, where a burst of
+# slow calls (a printer, a big export) could hold every thread and leave
+# balance and PIN requests waiting for one:
+#
+#   db_readers  - DB_READERS threads for lookups, one per pooled reader
+#                 connection, so a reader thread never waits for a connection
+#   db_writer   - one thread for every ledger mutation; postings queue here
+#                 in order instead of contending for the writer lock
+#   hardware    - blocking device I/O (opening the printer, the RFID reader)
+#
+# Each pool reports how many calls are queued and running, and how long
+# calls waited for a thread.
+
+DB_READERS = int(os.getenv("ATM_DB_READERS", POOL_SIZE))
+HARDWARE_WORKERS = int(os.getenv("ATM_HARDWARE_WORKERS", "2"))
+
+queue_wait_seconds = Histogram(
+    "atm_executor_queue_wait_seconds", "Time a call waited for a worker thread, by pool.")
+
+
+class WorkPool:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on this pool and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._tracked(fn, args, kwargs))
+
+    def submit(self, fn, *args, **kwargs):
+        """Fire-and-forget from sync code (startup, background threads)."""
+        return self._executor.submit(self._tracked(fn, args, kwargs))
+
+    def _tracked(self, fn, args, kwargs):
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+
+        def call():
+            queue_wait_seconds.observe(time.perf_counter() - submitted, pool=self.name)
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+        return call
+
+    def depth(self):
+        with self._lock:
+            return {"queued": self._queued, "active": self._active, "workers": self.workers}
+
+
+db_readers = WorkPool("db-read", DB_READERS)
+db_writer = WorkPool("db-write", 1)
+hardware = WorkPool("hardware", HARDWARE_WORKERS)
+POOLS = (db_readers, db_writer, hardware)
+
+
+def _depths(field):
+    return lambda: {(("pool", p.name),): p.depth()[field] for p in POOLS}
+
+
+Gauge("atm_executor_queue_depth", "Calls waiting for a worker thread, by pool.", _depths("queued"))
+Gauge("atm_executor_active", "Calls running on a worker thread, by pool.", _depths("active"))
+
+
+def status():
+    return {pool.name: pool.depth() for pool in POOLS}
@@ -0,0 +1,265 @@
+import os
+import threading
+import time
+
+from atm_logging import get_logger
+
+# ==============================
+#   Hardware driver registry
+# ==============================
+# The keypad, printer and card reader are opened lazily: importing main.py
+# touches no device, so uvicorn is serving straight away whatever state the
+# hardware is in. Each device is opened on first use or by warm_up() on a
+# background thread at startup.
+#
+# Every device has three backends:
+#   real - the Pi's GPIO keypad, USB thermal printer and MFRC522
+#   fake - the in-memory simulators (simulators.py)
+#   null - accepts everything and does nothing; no keys, no cards
+#
+# ATM_HARDWARE picks the backend for all three (default real; "sim" is an
+# alias for fake) and ATM_KEYPAD_DRIVER / ATM_PRINTER_DRIVER /
+# ATM_RFID_DRIVER override it per device.
+#
+# Reconnection lives here rather than in each caller: a caller that hits an
+# I/O error calls reset(), and the next get() reopens the device, backing
+# off between failed attempts so a missing printer isn't probed in a loop.
+
+log = get_logger("atm.hardware")
+
+BACKENDS = ("real", "fake", "null")
+RETRY_BASE = 1.0    # seconds before the first reopen attempt after a failure
+RETRY_CAP = 30.0    # the delay doubles after every failure up to this
+
+
+class DriverUnavailable(Exception):
+    """The device could not be opened (or is backing off after a failure)."""
+
+
+class Driver:
+    """
+    One lazily opened device handle.
+
+    get() returns the open handle, opening it first if needed, and raises
+    DriverUnavailable while the device is missing. reset() drops a handle
+    that has failed so the next get() reopens it.
+    """
+
+    def __init__(self, name, backend, factory, closer=None):
+        self.name = name
+        self.backend = backend
+        self._factory = factory
+        self._closer = closer or _close_handle
+        self._handle = None
+        self._lock = threading.Lock()
+        self._error = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self.opened_at = None
+
+    def get(self):
+        handle = self._handle
+        if handle is not None and getattr(handle, "is_open", True):
+            return handle
+        with self._lock:
+            if self._handle is not None and getattr(self._handle, "is_open", True):
+                return self._handle
+            self._discard()
+            if time.monotonic() < self._retry_at:
+                raise DriverUnavailable(f"{self.name} unavailable: {self._error}")
+            started = time.perf_counter()
+            try:
+                self._handle = self._factory()
+            except Exception as e:
+                self._failed(e)
+                raise DriverUnavailable(f"{self.name} unavailable: {e}") from e
+            self._error = None
+            self._failures = 0
+            self.opened_at = time.time()
+            log.info("driver opened", driver=self.name, backend=self.backend,
+                     ms=(time.perf_counter() - started) * 1000)
+            return self._handle
+
+    def reset(self, error=None):
+        """Forget a handle that failed; the next get() reopens the device."""
+        with self._lock:
+            if self._handle is None:
+                return
+            self._discard()
+            if error is not None:
+                self._failed(error)
+
+    def close(self):
+        with self._lock:
+            self._discard()
+
+    def status(self):
+        if self._handle is not None:
+            state = "ready"
+        elif self._error is not None:
+            state = "unavailable"
+        else:
+            state = "closed"
+        return {"backend": self.backend, "state": state,
+                "error": None if self._error is None else str(self._error)}
+
+    def _failed(self, error):
+        self._error = error
+        self._failures += 1
+        delay = min(RETRY_BASE * 2 ** (self._failures - 1), RETRY_CAP)
+        self._retry_at = time.monotonic() + delay
+        log.warning("driver failed", driver=self.name, backend=self.backend,
+                    error=error, retry_in=delay)
+
+    def _discard(self):
+        handle, self._handle = self._handle, None
+        if handle is not None:
+            try:
+                self._closer(handle)
+            except Exception as e:
+                log.debug("driver close failed", driver=self.name, error=e)
+
+
+def _close_handle(handle):
+    close = getattr(handle, "close", None)
+    if close:
+        close()
+
+
+class DriverRegistry:
+    def __init__(self):
+        self._drivers = {}
+
+    def register(self, driver):
+        self._drivers[driver.name] = driver
+        return driver
+
+    def __getitem__(self, name):
+        return self._drivers[name]
+
+    def warm_up(self, pool=None):
+        """
+        Open every device in the background and return immediately: on
+        pool (an executors.WorkPool) if given, else one thread per device.
+        """
+        for driver in self._drivers.values():
+            if pool is not None:
+                pool.submit(_try_open, driver)
+            else:
+                threading.Thread(target=_try_open, args=(driver,),
+                                 name=f"open-{driver.name}", daemon=True).start()
+
+    def close_all(self):
+        for driver in self._drivers.values():
+            driver.close()
+
+    def status(self):
+        return {name: driver.status() for name, driver in self._drivers.items()}
+
+
+def _try_open(driver):
+    try:
+        driver.get()
+    except DriverUnavailable:
+        pass  # already logged; the first real use retries
+
+
+# -------------------- NULL BACKENDS --------------------
+class NullKeypad:
+    mode = "null"
+
+    def read_key(self, timeout=0):
+        if timeout:
+            time.sleep(timeout)  # callers loop on read_key; don't let them spin
+        return None
+
+    def cleanup(self):
+        pass
+
+
+class NullPrinter:
+    is_open = True
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullReader:
+    def read_id_no_block(self):
+        return None
+
+
+# -------------------- BACKENDS PER DEVICE --------------------
+def _keypad_real():
+    from keypad_driver import Keypad
+    return Keypad(mode=os.getenv("ATM_KEYPAD_MODE", "edge"))
+
+
+def _keypad_fake():
+    from keypad_driver import Keypad
+    from simulators import FakeGPIO
+    return Keypad(gpio=FakeGPIO(), mode=os.getenv("ATM_KEYPAD_MODE", "edge"))
+
+
+def _printer_real():
+    from printer_utils import open_printer
+    return open_printer()
+
+
+def _printer_fake():
+    from simulators import FakeSerial
+    return FakeSerial(simulate_baud=True)
+
+
+def _rfid_real():
+    from rfid_service import open_reader
+    return open_reader()
+
+
+def _rfid_real_close(reader):
+    import RPi.GPIO as GPIO  # SimpleMFRC522 claims its reset pin through RPi.GPIO
+    GPIO.cleanup()
+
+
+def _rfid_fake():
+    from simulators import FakeMFRC522
+    return FakeMFRC522()
+
+
+FACTORIES = {
+    "keypad": {"real": _keypad_real, "fake": _keypad_fake, "null": NullKeypad},
+    "printer": {"real": _printer_real, "fake": _printer_fake, "null": NullPrinter},
+    "rfid": {"real": _rfid_real, "fake": _rfid_fake, "null": NullReader},
+}
+CLOSERS = {
+    ("keypad", "real"): lambda keypad: keypad.cleanup(),
+    ("keypad", "fake"): lambda keypad: keypad.cleanup(),
+    ("rfid", "real"): _rfid_real_close,
+}
+
+
+def backend_for(device, environ=os.environ):
+    """Backend name for a device from ATM_<DEVICE>_DRIVER or ATM_HARDWARE."""
+    choice = environ.get(f"ATM_{device.upper()}_DRIVER") or environ.get("ATM_HARDWARE", "real")
+    choice = "fake" if choice == "sim" else choice
+    if choice not in BACKENDS:
+        raise ValueError(f"Unknown {device} driver {choice!r}; expected one of {BACKENDS}")
+    return choice
+
+
+def build_registry(environ=os.environ):
+    registry = DriverRegistry()
+    for device, backends in FACTORIES.items():
+        backend = backend_for(device, environ)
+        registry.register(Driver(device, backend, backends[backend],
+                                 CLOSERS.get((device, backend))))
+    return registry
+
+
+drivers = build_registry()
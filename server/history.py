@@ -0,0 +1,171 @@
+import base64
+
+import archive
+
+# ==============================
+#   Transaction history paging
+# ==============================
+# Pages are keyset-paginated on (timestamp, id), newest first. The cursor is
+# the position of the last row returned, so fetching the next page is an
+# index seek on idx_transactions_user_ts no matter how deep the client is.
+#
+# Archived rows are all older than the hot table's, so once a page runs off
+# the end of the hot table it carries on into the archive's month tables,
+# newest first, with the same seek. Cursors work the same either side. Only
+# users listed in archived_users go there, and only to the months between
+# their oldest and newest archived rows.
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+_PAGE_SQL = """
+    SELECT id, type, amount, timestamp, user_id
+    FROM transactions
+    WHERE user_id = ?
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+"""
+
+_PAGE_AFTER_SQL = """
+    SELECT id, type, amount, timestamp, user_id
+    FROM transactions
+    WHERE user_id = ? AND (timestamp, id) < (?, ?)
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+"""
+
+
+# Production path: resolve tag -> user and fetch the page in one statement.
+# The LEFT JOIN keeps the user row when the page is empty, so "no such card"
+# (zero rows) and "no history yet" (one row with NULL columns) stay distinct.
+_TAG_PAGE_SQL = """
+    SELECT t.id, t.type, t.amount, t.timestamp, u.id
+    FROM users u
+    LEFT JOIN transactions t ON t.user_id = u.id
+    WHERE u.rfid_tag = ?
+    ORDER BY t.timestamp DESC, t.id DESC
+    LIMIT ?
+"""
+
+_TAG_PAGE_AFTER_SQL = """
+    SELECT t.id, t.type, t.amount, t.timestamp, u.id
+    FROM users u
+    LEFT JOIN transactions t ON t.user_id = u.id AND (t.timestamp, t.id) < (?, ?)
+    WHERE u.rfid_tag = ?
+    ORDER BY t.timestamp DESC, t.id DESC
+    LIMIT ?
+"""
+
+
+def encode_cursor(timestamp, txn_id):
+    raw = f"{timestamp}|{txn_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) for a cursor. Raises ValueError if it is malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, txn_id = base64.urlsafe_b64decode(padded).decode("utf-8").rsplit("|", 1)
+        return timestamp, int(txn_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def row_to_dict(row):
+    return {
+        "id": row[0],
+        "type": row[1],
+        "amount": float(row[2]) if row[2] is not None else 0.0,
+        "timestamp": row[3],
+        "user_id": row[4],
+    }
+
+
+def fetch_page(conn, user_id, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of a user's history, newest first.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    # Ask for one extra row to learn whether another page exists
+    position = None
+    if after:
+        position = decode_cursor(after)
+        rows = conn.execute(_PAGE_AFTER_SQL, (user_id, *position, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(_PAGE_SQL, (user_id, limit + 1)).fetchall()
+    return _split_page(_with_archive(conn, user_id, rows, position, limit), limit)
+
+
+def fetch_page_by_tag(conn, tag_id, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Like fetch_page, but starting from the RFID tag in a single statement.
+
+    Returns (rows, next_cursor), or None if no user has this tag.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    position = None
+    if after:
+        position = decode_cursor(after)
+        rows = conn.execute(
+            _TAG_PAGE_AFTER_SQL, (*position, tag_id, limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(_TAG_PAGE_SQL, (tag_id, limit + 1)).fetchall()
+
+    if not rows:
+        return None
+    user_id = rows[0][4]
+    if rows[0][0] is None:
+        rows = []
+    return _split_page(_with_archive(conn, user_id, rows, position, limit), limit)
+
+
+def _with_archive(conn, user_id, rows, position, limit):
+    """Top a page that ran off the end of the hot table up from the archive."""
+    if len(rows) > limit:
+        return rows
+    if rows:
+        position = (rows[-1][3], rows[-1][0])
+    return rows + _archived_rows(conn, user_id, position, limit + 1 - len(rows))
+
+
+def _archived_rows(conn, user_id, position, count):
+    # archived_users says, without attaching, whether there is anything to
+    # find and which months it is in
+    span = archive.user_span(conn, user_id)
+    if span is None or not archive.attach(conn):
+        return []
+    oldest = archive.partition_for(span[0])
+    newest = archive.partition_for(span[1])
+    if position:
+        newest = min(newest, archive.partition_for(position[0]))
+    found = []
+    for name in archive.partitions(conn, newest_first=True):
+        if name > newest:
+            continue  # newer than the cursor or than anything of this user's
+        if name < oldest:
+            break
+        sql = (f"SELECT id, type, amount, timestamp, user_id FROM {archive.SCHEMA}.{name} "
+               "WHERE user_id = ?")
+        params = [user_id]
+        if position:
+            sql += " AND (timestamp, id) < (?, ?)"
+            params.extend(position)
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        params.append(count - len(found))
+        found += conn.execute(sql, params).fetchall()
+        if len(found) >= count:
+            break
+    return found
+
+
+def _split_page(rows, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[3], last[0])
+    return rows, next_cursor
@@ -0,0 +1,111 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# ==============================
+#   Idempotency keys
+# ==============================
+# A kiosk that times out on POST /withdraw can't tell whether the posting
+# happened. With an Idempotency-Key header it can simply retry: the first
+# request that commits stores its result under the key, in the same
+# transaction as the posting, and every retry gets that result back without
+# touching the ledger.
+#
+# Keys live in the idempotency_keys table for KEY_TTL, so a retry after a
+# backend restart is still caught. Recently used keys are also kept in an
+# in-memory LRU, so the common case (a retry a few seconds later) is
+# answered without a database round trip.
+#
+# Only committed postings are recorded. A request that failed (insufficient
+# funds, unknown card) left nothing behind, so retrying it runs it again.
+#
+# The receipt is journalled after the posting commits, so its receipt_seq
+# is added to the stored result afterwards (attach_receipt): a retry that
+# replays the result can still reprint the receipt it paid for.
+
+KEY_TTL = 24 * 3600.0   # seconds a persisted key is honoured
+CACHE_SIZE = 1024       # keys kept in memory
+CACHE_TTL = 600.0       # seconds a key stays in memory
+MAX_KEY_LENGTH = 255
+PRUNE_EVERY = 500       # saves between deletes of expired rows
+
+
+class ResponseCache:
+    """LRU of key -> (request fingerprint, result) with TTL eviction."""
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()   # key -> (fingerprint, result, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key, fingerprint, result):
+        with self._lock:
+            self._entries[key] = (fingerprint, result, time.monotonic() + self._ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def update(self, key, **fields):
+        """Add fields to key's cached result, if it is still cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], dict(entry[1], **fields), entry[2])
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def load(conn, key):
+    """(fingerprint, result) stored for key, or None. Call inside the posting transaction."""
+    row = conn.execute(
+        "SELECT fingerprint, response FROM idempotency_keys WHERE key = ? AND created_at >= ?",
+        (key, time.time() - KEY_TTL),
+    ).fetchone()
+    return (row[0], json.loads(row[1])) if row else None
+
+
+_saves = 0
+
+
+def save(conn, key, fingerprint, result):
+    """Record a posting's result under key, in the caller's transaction."""
+    global _saves
+    now = time.time()
+    # REPLACE: an expired row with the same key may still be on disk
+    conn.execute(
+        "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, response, created_at) "
+        "VALUES (?, ?, ?, ?)",
+        (key, fingerprint, json.dumps(result), now),
+    )
+    _saves += 1
+    if _saves % PRUNE_EVERY == 0:
+        conn.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (now - KEY_TTL,))
+
+
+def attach_receipt(conn, key, receipt_seq):
+    """Add receipt_seq to the result stored under key. Runs in the caller's transaction."""
+    conn.execute(
+        "UPDATE idempotency_keys SET response = json_set(response, '$.receipt_seq', ?) "
+        "WHERE key = ?",
+        (receipt_seq, key),
+    )
+
+
+responses = ResponseCache()
@@ -0,0 +1,737 @@
+"""
+Electronic journal: every session event and receipt, append-only on disk.
+
+    python journal.py 1234                      # one record, with its receipt
+    python journal.py --user 42 --limit 20      # newest records for a user
+    python journal.py --kind withdraw --since 2026-05-01
+    python journal.py --verify                  # check every record against the index
+"""
+import argparse
+import bisect
+import json
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import database
+from atm_logging import get_logger
+from metrics import Counter, Histogram
+
+log = get_logger("atm.journal")
+
+# ==============================
+#   Electronic journal
+# ==============================
+# What the ATM did, in the order it did it: card taps, PIN checks, postings
+# and the exact receipt each one rendered, so a receipt can be reprinted or
+# an event traced without the ledger.
+#
+# The journal is a directory of segments (ATM_JOURNAL_DIR, default
+# journal/ next to the database). Each segment is three files:
+#
+#   journal-000001.ej    records, appended and never rewritten: a fixed
+#                        header (seq, time, user, kind, CRC) and a JSON body
+#   journal-000001.idx   one fixed-width entry per record (seq, time, user,
+#                        kind, offset, length), preallocated and written
+#                        through a shared mmap
+#   journal-000001.uidx  written when the segment is sealed: (user, slot)
+#                        pairs sorted by user
+#
+# A segment is sealed, and the next one started, once it holds SEGMENT_BYTES
+# of records or SEGMENT_RECORDS entries. Seq numbers and times only go up,
+# so finding a record by seq or a time range is a binary search over the
+# segments and then over one .idx file; a user's records are a binary
+# search in each sealed .uidx (the open segment keeps its users in memory,
+# which is at most SEGMENT_RECORDS slots). Only the entries touched by the
+# search and the records returned are read, and the OS page cache decides
+# what stays in RAM.
+#
+# The API appends through JournalWriter, one thread that writes whatever
+# has queued up as one batch: one write and one fdatasync per batch.
+# Records reach the .ej file (and with ATM_JOURNAL_SYNC=1, the disk) before
+# the index is updated. On open the index of the last segment is checked
+# against its records: entries without a record are dropped, records
+# without an entry are indexed again, and a torn record at the end is cut
+# off.
+
+KINDS = (
+    "card_inserted", "card_removed", "card_recognized",
+    "pin_verified", "pin_rejected",
+    "withdraw", "deposit", "balance_receipt", "reprint",
+)
+SEGMENT_BYTES = int(float(os.getenv("ATM_JOURNAL_SEGMENT_MB", "8")) * 1024 * 1024)
+SEGMENT_RECORDS = 65536     # index slots preallocated per segment
+KEEP_SEGMENTS = int(os.getenv("ATM_JOURNAL_KEEP_SEGMENTS", "0"))   # 0: keep them all
+SYNC = os.getenv("ATM_JOURNAL_SYNC", "1") == "1"    # fdatasync every record
+MAX_BATCH = 256             # records per group commit
+QUEUE_SIZE = 4096           # records waiting for the writer before submit() refuses new ones
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+_MAGIC = b"EJR1"
+_RECORD = struct.Struct("<4sIIQdqB3x")  # magic, body length, crc, seq, ts, user_id, kind
+_META = struct.Struct("<QdqB")          # the header fields the crc covers
+_ENTRY = struct.Struct("<QdqIIB3x")     # seq, ts, user_id, offset, length, kind
+_USER = struct.Struct("<qI")            # user_id, slot
+SEQ, TS, USER, OFFSET, LENGTH, KIND = range(6)
+
+records_written = Counter("atm_journal_records_total", "Records appended to the journal, by kind.")
+append_seconds = Histogram("atm_journal_append_seconds", "Time to append one journal record.")
+records_refused = Counter("atm_journal_refused_total",
+                          "Records not journalled because the writer's queue was full, by kind.")
+
+
+class JournalError(Exception):
+    pass
+
+
+class JournalFull(JournalError):
+    """The writer's queue is full; the disk has fallen too far behind."""
+
+
+def journal_dir():
+    return os.getenv("ATM_JOURNAL_DIR") or os.path.join(
+        os.path.dirname(os.path.abspath(database.DB_NAME)), "journal")
+
+
+def epoch(bound):
+    """A since/until bound from export.parse_bound (UTC text) as epoch seconds."""
+    if bound is None:
+        return None
+    return datetime.strptime(bound, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+
+# Not on Windows or older macOS; fsync there also flushes the metadata
+_datasync = os.fdatasync if hasattr(os, "fdatasync") else os.fsync
+
+
+def _checksum(seq, ts, user_id, kind, body):
+    return zlib.crc32(body, zlib.crc32(_META.pack(seq, ts, user_id, kind)))
+
+
+class _Table:
+    """A packed array of structs in a buffer, as a read-only sequence for bisect."""
+
+    def __init__(self, buf, layout, count):
+        self._buf = buf
+        self._layout = layout
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        return self._layout.unpack_from(self._buf, i * self._layout.size)
+
+
+class Segment:
+    def __init__(self, directory, number):
+        self.number = number
+        base = os.path.join(directory, f"journal-{number:06d}")
+        self.data_path, self.index_path, self.users_path = base + ".ej", base + ".idx", base + ".uidx"
+        self.count = 0
+        self.size = 0           # bytes of records
+        self._data = None       # file the records are read through
+        self._index = None      # mmap of the .idx file
+        self._users_index = None
+        self._users = None      # open segment only: user_id -> [slot, ...]
+        self._append_fd = None
+        self._lock = threading.Lock()   # the .ej read position and the reader count
+        self._readers = 0
+        self._retired = False   # dropped by rotation: no new readers
+
+    @property
+    def sealed(self):
+        return self._users is None
+
+    # ---------- opening ----------
+    def open_sealed(self):
+        self.count = os.path.getsize(self.index_path) // _ENTRY.size
+        self._index = _map(self.index_path, self.count * _ENTRY.size)
+        self._users_index = _map(self.users_path, os.path.getsize(self.users_path))
+        self.size = self._end(self.count)
+        return self
+
+    def open_active(self, capacity):
+        """Open for appending, repairing the index after a crash."""
+        self._append_fd = os.open(self.data_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        with open(self.index_path, "ab") as f:
+            if f.tell() < capacity * _ENTRY.size:
+                f.truncate(capacity * _ENTRY.size)
+        with open(self.index_path, "r+b") as f:
+            self._index = mmap.mmap(f.fileno(), capacity * _ENTRY.size)
+        self.capacity = capacity
+        self._users = {}
+        # Filled slots are a prefix (seq is never 0)
+        self.count = bisect.bisect_left(
+            _Table(self._index, _ENTRY, capacity), True, key=lambda e: e[SEQ] == 0)
+        self._recover()
+        for slot in range(self.count):
+            user_id = self.entry(slot)[USER]
+            if user_id:
+                self._users.setdefault(user_id, []).append(slot)
+        return self
+
+    def _recover(self):
+        data_size = os.fstat(self._append_fd).st_size
+        dropped = 0
+        while self.count and not self._intact(self.entry(self.count - 1), data_size):
+            self.count -= 1
+            _ENTRY.pack_into(self._index, self.count * _ENTRY.size, *(0,) * 6)
+            dropped += 1
+        offset = self._end(self.count)
+        reindexed = 0
+        while offset < data_size:
+            entry = self._entry_at(offset, data_size)
+            if entry is None or self.count >= self.capacity:
+                break
+            _ENTRY.pack_into(self._index, self.count * _ENTRY.size, *entry)
+            self.count += 1
+            offset += entry[LENGTH]
+            reindexed += 1
+        if offset < data_size:
+            os.ftruncate(self._append_fd, offset)
+        self.size = offset
+        if dropped or reindexed or offset < data_size:
+            log.warning("journal repaired", segment=self.number, dropped_entries=dropped,
+                        reindexed=reindexed, truncated_bytes=data_size - offset)
+
+    def _intact(self, entry, data_size):
+        if entry[OFFSET] + entry[LENGTH] > data_size:
+            return False
+        found = self._entry_at(entry[OFFSET], data_size)
+        return found is not None and found[SEQ] == entry[SEQ]
+
+    def _entry_at(self, offset, data_size):
+        """Index entry for the record at offset, or None if it is torn or corrupt."""
+        if offset + _RECORD.size > data_size:
+            return None
+        raw = _read_at(self._append_fd, _RECORD.size, offset)
+        magic, length, crc, seq, ts, user_id, kind = _RECORD.unpack(raw)
+        if magic != _MAGIC or offset + _RECORD.size + length > data_size:
+            return None
+        body = _read_at(self._append_fd, length, offset + _RECORD.size)
+        if len(body) != length:
+            return None
+        if _checksum(seq, ts, user_id, kind, body) != crc:
+            return None
+        return seq, ts, user_id, offset, _RECORD.size + length, kind
+
+    def _end(self, count):
+        if not count:
+            return 0
+        last = self.entry(count - 1)
+        return last[OFFSET] + last[LENGTH]
+
+    # ---------- writing ----------
+    def has_room(self, count, size, length, max_bytes):
+        """Whether a record of length bytes fits after count records / size bytes."""
+        return count < self.capacity and (not count or size + length <= max_bytes)
+
+    def append(self, records, sync):
+        """Write [(seq, ts, user_id, kind, body), ...] in one write (and one sync)."""
+        chunks, entries, offset = [], [], self.size
+        for seq, ts, user_id, kind, body in records:
+            chunks.append(_RECORD.pack(_MAGIC, len(body), _checksum(seq, ts, user_id, kind, body),
+                                       seq, ts, user_id, kind))
+            chunks.append(body)
+            length = _RECORD.size + len(body)
+            entries.append((seq, ts, user_id, offset, length, kind))
+            offset += length
+        try:
+            view = memoryview(b"".join(chunks))
+            while view:
+                view = view[os.write(self._append_fd, view):]
+            if sync:
+                _datasync(self._append_fd)
+        except OSError:
+            # Don't leave half a batch where the next one expects to start
+            os.ftruncate(self._append_fd, self.size)
+            raise
+        # Entries go in after their records, and count after the entry, so
+        # readers never see an entry whose record isn't there
+        for entry in entries:
+            slot = self.count
+            _ENTRY.pack_into(self._index, slot * _ENTRY.size, *entry)
+            if entry[USER]:
+                self._users.setdefault(entry[USER], []).append(slot)
+            self.count = slot + 1
+        self.size = offset
+
+    def seal(self):
+        """Write the user index and trim the .idx file to the slots in use."""
+        self._index.flush()
+        pairs = sorted((user_id, slot) for user_id, slots in self._users.items() for slot in slots)
+        tmp = self.users_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(b"".join(_USER.pack(*pair) for pair in pairs))
+            f.flush()
+            os.fsync(f.fileno())
+        os.truncate(self.index_path, self.count * _ENTRY.size)
+        os.replace(tmp, self.users_path)
+        self._users_index = _map(self.users_path, len(pairs) * _USER.size)
+        self._users = None
+        os.close(self._append_fd)
+        self._append_fd = None
+
+    # ---------- reading ----------
+    def entry(self, slot):
+        return _ENTRY.unpack_from(self._index, slot * _ENTRY.size)
+
+    def entries(self):
+        return _Table(self._index, _ENTRY, self.count)
+
+    @property
+    def first_seq(self):
+        return self.entry(0)[SEQ] if self.count else None
+
+    @property
+    def last_ts(self):
+        return self.entry(self.count - 1)[TS] if self.count else None
+
+    def slot_of(self, seq):
+        slot = bisect.bisect_left(self.entries(), seq, key=lambda e: e[SEQ])
+        return slot if slot < self.count and self.entry(slot)[SEQ] == seq else None
+
+    def slots_before(self, before=None, since=None, until=None):
+        """[lo, hi) of the slots with seq < before and since <= ts < until."""
+        entries = self.entries()
+        hi = self.count
+        if before is not None:
+            hi = bisect.bisect_left(entries, before, hi=hi, key=lambda e: e[SEQ])
+        if until is not None:
+            hi = bisect.bisect_left(entries, until, hi=hi, key=lambda e: e[TS])
+        lo = 0 if since is None else bisect.bisect_left(entries, since, hi=hi, key=lambda e: e[TS])
+        return lo, hi
+
+    def user_slots(self, user_id, lo, hi):
+        """user_id's slots in [lo, hi), oldest first."""
+        users = self._users
+        if users is not None:
+            slots = users.get(user_id, [])
+            return slots[bisect.bisect_left(slots, lo):bisect.bisect_left(slots, hi)]
+        if self._users_index is None:
+            return []
+        table = _Table(self._users_index, _USER, len(self._users_index) // _USER.size)
+        start = bisect.bisect_left(table, (user_id, lo))
+        end = bisect.bisect_left(table, (user_id, hi), lo=start)
+        return [table[i][1] for i in range(start, end)]
+
+    def read(self, slot):
+        entry = self.entry(slot)
+        with self._lock:
+            if self._data is None:
+                self._data = open(self.data_path, "rb", buffering=0)
+            self._data.seek(entry[OFFSET])
+            raw = self._data.read(entry[LENGTH])
+        if len(raw) != entry[LENGTH]:
+            raise JournalError(f"Journal record {entry[SEQ]} is corrupt")
+        magic, length, crc, seq, ts, user_id, kind = _RECORD.unpack_from(raw)
+        body = raw[_RECORD.size:]
+        if (magic != _MAGIC or seq != entry[SEQ] or length != entry[LENGTH] - _RECORD.size
+                or _checksum(seq, ts, user_id, kind, body) != crc):
+            raise JournalError(f"Journal record {entry[SEQ]} is corrupt")
+        return _record(seq, ts, user_id, kind, body)
+
+    @contextmanager
+    def held(self):
+        """
+        Keep the segment open while reading it. Yields False if rotation has
+        already dropped it.
+        """
+        with self._lock:
+            held = not self._retired
+            if held:
+                self._readers += 1
+        try:
+            yield held
+        finally:
+            if held:
+                with self._lock:
+                    self._readers -= 1
+                    last = self._retired and not self._readers
+                if last:
+                    self._discard()
+
+    def retire(self):
+        """Drop the segment: closed and deleted once no reader holds it."""
+        with self._lock:
+            self._retired = True
+            idle = not self._readers
+        if idle:
+            self._discard()
+
+    def _discard(self):
+        self.close()
+        for path in (self.data_path, self.index_path, self.users_path):
+            os.remove(path)
+
+    def close(self):
+        for handle in (self._index, self._users_index, self._data):
+            if handle is not None:
+                handle.close()
+        if self._append_fd is not None:
+            os.close(self._append_fd)
+
+
+def _read_at(fd, length, offset):
+    """Up to length bytes at offset (os.pread isn't on Windows)."""
+    os.lseek(fd, offset, os.SEEK_SET)
+    chunks = []
+    while length:
+        chunk = os.read(fd, length)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b"".join(chunks)
+
+
+def _map(path, length):
+    if not length:
+        return None
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ)
+
+
+def _record(seq, ts, user_id, kind, body):
+    return {
+        "seq": seq,
+        "time": datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+        "kind": KINDS[kind - 1],
+        "user_id": user_id or None,
+        **json.loads(body),
+    }
+
+
+class Journal:
+    """The journal directory: appends go to the open segment, reads to any of them."""
+
+    def __init__(self, directory=None, segment_bytes=SEGMENT_BYTES,
+                 segment_records=SEGMENT_RECORDS, keep_segments=KEEP_SEGMENTS, sync=SYNC):
+        self._directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_records = segment_records
+        self.keep_segments = keep_segments
+        self.sync = sync
+        self._write_lock = threading.Lock()
+        self._segments = None       # oldest first; replaced, never changed in place
+        self._seq = 0
+        self._ts = 0.0
+
+    @property
+    def directory(self):
+        return self._directory or journal_dir()
+
+    def open(self):
+        """Open (and if need be repair) the journal now rather than on first use."""
+        self._opened()
+        return self
+
+    def _opened(self):
+        if self._segments is None:
+            with self._write_lock:
+                if self._segments is None:
+                    self._open()
+        return self._segments
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        numbers = sorted(
+            int(name[8:14]) for name in os.listdir(self.directory)
+            if name.startswith("journal-") and name.endswith(".ej"))
+        segments = []
+        for number in numbers:
+            segment = Segment(self.directory, number)
+            if os.path.exists(segment.users_path):
+                segments.append(segment.open_sealed())
+                continue
+            # Not sealed: the open segment, or one that crashed while sealing
+            segment.open_active(self.segment_records)
+            if number != numbers[-1]:
+                segment.seal()
+            segments.append(segment)
+        if not segments or segments[-1].sealed:
+            segments.append(self._new_segment(numbers[-1] + 1 if numbers else 1))
+        for segment in reversed(segments):
+            if segment.count:
+                last = segment.entry(segment.count - 1)
+                self._seq, self._ts = last[SEQ], last[TS]
+                break
+        self._segments = segments
+        log.info("journal opened", directory=self.directory, segments=len(segments),
+                 last_seq=self._seq)
+
+    def _new_segment(self, number):
+        return Segment(self.directory, number).open_active(self.segment_records)
+
+    # ---------- writing ----------
+    def append(self, kind, user_id=None, **fields):
+        """
+        Append a record and return its seq. fields (terminal, rfid_tag, amounts,
+        receipt text...) must be JSON-serialisable. Blocks for the disk write.
+        """
+        return self.append_many([(kind, user_id, fields)])[0]
+
+    def append_many(self, records):
+        """
+        Append [(kind, user_id, fields), ...] in order, with one write and one
+        sync per segment touched. Returns their seqs.
+        """
+        encoded = []
+        for kind, user_id, fields in records:
+            if kind not in KINDS:
+                raise ValueError(f"Unknown journal record kind: {kind!r}")
+            encoded.append((KINDS.index(kind) + 1, user_id or 0,
+                            json.dumps(fields, separators=(",", ":")).encode("utf-8")))
+        self._opened()
+        with self._write_lock:
+            started = time.perf_counter()
+            active = self._segments[-1]
+            seq, ts = self._seq, self._ts
+            batch, count, size = [], active.count, active.size
+            for kind, user_id, body in encoded:
+                length = _RECORD.size + len(body)
+                if not active.has_room(count, size, length, self.segment_bytes):
+                    self._write(active, batch)
+                    active, batch, count, size = self._rotate(), [], 0, 0
+                # The clock can step back; keep times in seq order for searches
+                seq, ts = seq + 1, max(time.time(), ts)
+                batch.append((seq, ts, user_id, kind, body))
+                count, size = count + 1, size + length
+            self._write(active, batch)
+            append_seconds.observe(time.perf_counter() - started)
+        for kind, _, _ in records:
+            records_written.inc(kind=kind)
+        return list(range(seq - len(records) + 1, seq + 1))
+
+    def _write(self, segment, batch):
+        if batch:
+            segment.append(batch, self.sync)
+            self._seq, self._ts = batch[-1][0], batch[-1][1]
+
+    def _rotate(self):
+        segments = self._segments
+        segments[-1].seal()
+        segments = segments + [self._new_segment(segments[-1].number + 1)]
+        dropped = []
+        if self.keep_segments and len(segments) > self.keep_segments:
+            dropped, segments = segments[:-self.keep_segments], segments[-self.keep_segments:]
+        self._segments = segments
+        # Readers may still hold a dropped segment; the last one to let go
+        # closes and deletes it
+        for segment in dropped:
+            segment.retire()
+        log.info("journal rotated", segment=segments[-1].number, dropped=len(dropped))
+        return segments[-1]
+
+    # ---------- reading ----------
+    def get(self, seq):
+        """The record with this seq, or None."""
+        segments = self._opened()
+        # The open segment may still be empty; it sorts last either way
+        i = bisect.bisect_right(segments, seq, key=lambda s: s.first_seq or sys.maxsize) - 1
+        if i < 0:
+            return None
+        with segments[i].held() as held:
+            slot = segments[i].slot_of(seq) if held else None
+            return None if slot is None else segments[i].read(slot)
+
+    def search(self, user_id=None, kinds=None, since=None, until=None, before=None,
+               limit=DEFAULT_LIMIT):
+        """
+        Records newest first, filtered by user, kind and time (epoch seconds,
+        until exclusive). Returns (records, next_before): pass next_before as
+        before= for the next page; it is None on the last page.
+        """
+        codes = None if not kinds else {KINDS.index(k) + 1 for k in kinds}
+        found = []
+        for segment in reversed(self._opened()):
+            with segment.held() as held:
+                if not held or not segment.count or (
+                        before is not None and segment.first_seq >= before):
+                    continue
+                if since is not None and segment.last_ts < since:
+                    break
+                lo, hi = segment.slots_before(before, since, until)
+                if user_id is None:
+                    slots = range(hi - 1, lo - 1, -1)
+                else:
+                    slots = reversed(segment.user_slots(user_id, lo, hi))
+                for slot in slots:
+                    if codes is None or segment.entry(slot)[KIND] in codes:
+                        found.append(segment.read(slot))
+                        if len(found) == limit:
+                            return found, found[-1]["seq"]
+        return found, None
+
+    def stats(self):
+        segments = self._opened()
+        return {
+            "directory": self.directory,
+            "segments": len(segments),
+            "records": sum(s.count for s in segments),
+            "bytes": sum(s.size for s in segments),
+            "last_seq": self._seq,
+        }
+
+    def verify(self):
+        """Read every record back through the index. Returns the number checked."""
+        checked = 0
+        for segment in self._opened():
+            with segment.held() as held:
+                for slot in range(segment.count if held else 0):
+                    segment.read(slot)
+                    checked += 1
+        return checked
+
+    def close(self):
+        with self._write_lock:
+            for segment in self._segments or ():
+                segment.close()
+            self._segments = None
+
+
+# -------------------- WRITER THREAD --------------------
+class JournalWriter:
+    """
+    Appends on a background thread, so handlers never wait on the disk.
+    Everything queued while one batch was being written goes out together
+    in the next: one write and one fdatasync however many terminals
+    submitted (group commit), in the order they were submitted. At most
+    queue_size records wait; past that, submit() raises JournalFull rather
+    than holding receipts in memory the disk can't keep up with.
+    """
+
+    def __init__(self, journal, max_batch=MAX_BATCH, queue_size=QUEUE_SIZE):
+        self._journal = journal
+        self._max_batch = max_batch
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Write what is queued, then stop."""
+        self._running = False
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            log.warning("journal writer still busy at shutdown", pending=self.pending())
+        if self._thread:
+            self._thread.join(timeout)
+
+    def submit(self, kind, user_id=None, **fields):
+        """
+        Queue a record. Returns a concurrent.futures.Future of its seq.
+        Raises JournalFull if the queue is full.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown journal record kind: {kind!r}")
+        future = Future()
+        try:
+            self._queue.put_nowait((future, (kind, user_id, fields)))
+        except queue.Full:
+            records_refused.inc(kind=kind)
+            log.warning("journal queue full; record not written", kind=kind, user_id=user_id,
+                        sample=50)
+            raise JournalFull("Journal queue is full") from None
+        return future
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        try:
+            self._journal.open()    # repairs the last segment if it has to
+        except Exception as e:
+            log.exception("journal open failed", error=e)
+        while True:
+            item = self._queue.get()
+            batch = [] if item is None else [item]
+            while len(batch) < self._max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    batch.append(item)
+            if batch:
+                self._write(batch)
+            if not self._running and self._queue.empty():
+                return
+
+    def _write(self, batch):
+        try:
+            seqs = self._journal.append_many([record for _, record in batch])
+        except Exception as e:
+            log.exception("journal write failed", records=len(batch), error=e)
+            for future, _ in batch:
+                future.set_exception(e)
+            return
+        for (future, _), seq in zip(batch, seqs):
+            future.set_result(seq)
+
+
+ej = Journal()   # this ATM's journal
+
+
+def main():
+    import export
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("seq", nargs="?", type=int, help="show this record")
+    parser.add_argument("--user", type=int, help="only this user id")
+    parser.add_argument("--kind", action="append", choices=KINDS, help="only these kinds")
+    parser.add_argument("--since", help="date or datetime (UTC)")
+    parser.add_argument("--until", help="date or datetime (UTC), exclusive")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    parser.add_argument("--verify", action="store_true", help="check every record's CRC")
+    parser.add_argument("--dir", help="journal directory (default: ATM_JOURNAL_DIR or journal/)")
+    args = parser.parse_args()
+
+    store = Journal(args.dir)
+    try:
+        if args.verify:
+            print(f"{store.verify()} record(s) OK in {store.stats()['segments']} segment(s)")
+        elif args.seq is not None:
+            record = store.get(args.seq)
+            if record is None:
+                print(f"No journal record {args.seq}")
+                return 1
+            receipt = record.pop("receipt", None)
+            print(json.dumps(record, indent=2))
+            if receipt:
+                print(receipt)
+        else:
+            records, _ = store.search(
+                args.user, args.kind,
+                epoch(export.parse_bound(args.since)),
+                epoch(export.parse_bound(args.until, end=True)), limit=args.limit)
+            for record in records:
+                record.pop("receipt", None)
+                print(json.dumps(record))
+        return 0
+    except JournalError as e:
+        print(e)
+        return 1
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,36 @@
-import RPi.GPIO as GPIO
+import queue
+import threading
 import time
 
+try:
+    import RPi.GPIO as GPIO
+except ImportError:  # not on a Pi; pass a backend such as simulators.FakeGPIO
+    GPIO = None
+
+from atm_logging import get_logger
+
+log = get_logger("atm.keypad")
+
+POLL_INTERVAL = 0.01   # seconds between scans in polling mode
+DEBOUNCE_MS = 50       # same key within this window counts as one press
+
+
 class Keypad:
-    def __init__(self):
+    """
+    4x4 matrix keypad.
+
+    mode="edge" (default) idles with every row driven HIGH and lets the GPIO
+    layer raise an event when a column goes HIGH; the matrix is only scanned
+    after an edge, so an idle keypad costs no CPU. mode="poll" is the original
+    row-by-row scan, kept as a fallback for boards where edge detection fails.
+    """
+
+    def __init__(self, gpio=None, mode="edge", debounce_ms=DEBOUNCE_MS):
+        self.gpio = gpio or GPIO
+        if self.gpio is None:
+            raise RuntimeError("RPi.GPIO is not available; pass a gpio backend")
+        gpio = self.gpio
+
         # --- Pin Configuration (BCM Numbering) ---
         # R1, R2, R3, R4
         self.ROW_PINS = [5, 6, 13, 19]
@@ -17,70 +45,161 @@ class Keypad:
             ['*', '0', '#', 'D']
         ]
 
+        self.debounce = debounce_ms / 1000
+        self._events = queue.Queue()
+        self._scan_lock = threading.Lock()
+        self._scanning = False
+        self._last_key = None
+        self._last_key_at = 0.0
+
         # Initialize GPIO
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
+        gpio.setmode(gpio.BCM)
+        gpio.setwarnings(False)
 
         # Set Rows as Outputs
         for pin in self.ROW_PINS:
-            GPIO.setup(pin, GPIO.OUT)
-            GPIO.output(pin, GPIO.LOW)  # Initialize Low
+            gpio.setup(pin, gpio.OUT)
+            gpio.output(pin, gpio.LOW)  # Initialize Low
 
         # Set Columns as Inputs with Pull-Down resistors
         # (Default is Low, reads High when connected to an active Row)
         for pin in self.COL_PINS:
-            GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+            gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_DOWN)
+
+        self.mode = "poll"
+        if mode == "edge":
+            try:
+                self._enable_edge_detection()
+                self.mode = "edge"
+            except RuntimeError as e:
+                # e.g. "Failed to add edge detection" on some kernels
+                log.warning("edge detection unavailable, polling instead", error=e)
+
+    # ---------- edge-triggered mode ----------
+    def _enable_edge_detection(self):
+        gpio = self.gpio
+        # Idle with all rows HIGH so any key press raises its column
+        for pin in self.ROW_PINS:
+            gpio.output(pin, gpio.HIGH)
+        bouncetime = max(1, int(self.debounce * 1000))
+        for pin in self.COL_PINS:
+            gpio.add_event_detect(pin, gpio.RISING, callback=self._on_edge,
+                                  bouncetime=bouncetime)
 
-    def read_key(self):
+    def _on_edge(self, channel):
+        """GPIO callback thread: find which key raised the column and queue it."""
+        if self._scanning:
+            return  # our own row toggling, not a key press
+        with self._scan_lock:
+            self._scanning = True
+            try:
+                key = self._scan_column(channel)
+            finally:
+                self._scanning = False
+        if key is None:
+            return
+        now = time.monotonic()
+        if key == self._last_key and now - self._last_key_at < self.debounce:
+            return
+        self._last_key, self._last_key_at = key, now
+        self._events.put(key)
+
+    def _scan_column(self, col_pin):
+        gpio = self.gpio
+        col_num = self.COL_PINS.index(col_pin)
+        for pin in self.ROW_PINS:
+            gpio.output(pin, gpio.LOW)
+        try:
+            for row_num, row_pin in enumerate(self.ROW_PINS):
+                gpio.output(row_pin, gpio.HIGH)
+                hit = gpio.input(col_pin) == gpio.HIGH
+                gpio.output(row_pin, gpio.LOW)
+                if hit:
+                    return self.KEY_MAP[row_num][col_num]
+            return None
+        finally:
+            # Back to idle: every row HIGH, waiting for the next edge
+            for pin in self.ROW_PINS:
+                gpio.output(pin, gpio.HIGH)
+
+    # ---------- polling mode ----------
+    def scan(self):
         """
-        Scans the keypad and returns the single character pressed.
+        Scans the keypad once and returns the single character pressed.
         Returns None if no key is pressed.
         """
+        gpio = self.gpio
         key_pressed = None
 
         # Scan each row
         for row_num, row_pin in enumerate(self.ROW_PINS):
             # Set current row High
-            GPIO.output(row_pin, GPIO.HIGH)
+            gpio.output(row_pin, gpio.HIGH)
 
             # Check columns for a connection
             for col_num, col_pin in enumerate(self.COL_PINS):
-                if GPIO.input(col_pin) == GPIO.HIGH:
+                if gpio.input(col_pin) == gpio.HIGH:
                     # Key detected
                     key_pressed = self.KEY_MAP[row_num][col_num]
-                    
+
                     # Basic Debounce: Wait for key release
-                    while GPIO.input(col_pin) == GPIO.HIGH:
+                    while gpio.input(col_pin) == gpio.HIGH:
                         time.sleep(0.01)
-                    
+
                     # Return immediately after finding the key
-                    GPIO.output(row_pin, GPIO.LOW)
+                    gpio.output(row_pin, gpio.LOW)
                     return key_pressed
 
             # Set row back to Low before moving to next row
-            GPIO.output(row_pin, GPIO.LOW)
+            gpio.output(row_pin, gpio.LOW)
 
         return None
 
+    def read_key(self, timeout=0):
+        """
+        Return the next key pressed, or None if none arrives within timeout
+        seconds. timeout=0 checks once without waiting; None waits forever.
+        """
+        if self.mode == "edge":
+            try:
+                if timeout == 0:
+                    return self._events.get_nowait()
+                return self._events.get(timeout=timeout)
+            except queue.Empty:
+                return None
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            key = self.scan()
+            if key or (deadline is not None and time.monotonic() >= deadline):
+                return key
+            time.sleep(POLL_INTERVAL)
+
     def cleanup(self):
         """Resets GPIO settings."""
-        GPIO.cleanup()
+        if self.mode == "edge":
+            for pin in self.COL_PINS:
+                try:
+                    self.gpio.remove_event_detect(pin)
+                except Exception:
+                    pass
+        self.gpio.cleanup()
 
 # --- FOR TESTING PURPOSES ONLY ---
 # You can run this file directly (python keypad_driver.py) to test the hardware.
 if __name__ == "__main__":
     print("--- 4x4 Keypad Test ---")
     print("Press any key (Press Ctrl+C to exit)...")
-    
+
     kp = Keypad()
-    
+    print(f"Mode: {kp.mode}")
+
     try:
         while True:
-            key = kp.read_key()
+            key = kp.read_key(timeout=None)
             if key:
                 print(f"Detected Key: {key}")
-            time.sleep(0.1)
     except KeyboardInterrupt:
         print("\nExiting...")
     finally:
-        kp.cleanup()
\ No newline at end of file
+        kp.cleanup()
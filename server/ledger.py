@@ -0,0 +1,387 @@
+import math
+import os
+import random
+import sqlite3
+import time
+from collections import namedtuple
+
+from database import get_write_connection
+from account_cache import accounts
+import daily_totals
+import idempotency
+
+# ==============================
+#   Ledger posting engine
+# ==============================
+# Every balance change goes through here. A posting is one BEGIN IMMEDIATE
+# transaction: look up the account, apply a guarded UPDATE, write the
+# transactions rows, read back the new balance. Nothing is computed from a
+# balance read outside the transaction, so concurrent terminals can't lose
+# each other's updates.
+
+WITHDRAW_FEE = 18.0
+MAX_AMOUNT = float(os.getenv("ATM_MAX_AMOUNT", "1000000000"))  # largest single posting
+
+# Per-user withdrawal limits per (UTC) day, checked against daily_totals.
+# Unset or 0 means no limit. The amount limit counts what was withdrawn,
+# not the fees.
+DailyLimits = namedtuple("DailyLimits", "amount count")
+DAILY_LIMITS = DailyLimits(
+    amount=float(os.getenv("ATM_DAILY_WITHDRAW_AMOUNT", "0")) or None,
+    count=int(os.getenv("ATM_DAILY_WITHDRAW_COUNT", "0")) or None,
+)
+
+MAX_ATTEMPTS = 5        # total tries before giving up on SQLITE_BUSY
+BACKOFF_BASE = 0.005    # seconds, doubled on each retry
+BACKOFF_CAP = 0.25      # seconds, upper bound for a single wait
+
+
+class LedgerError(Exception):
+    """Base class for posting failures the API maps to HTTP errors."""
+
+
+class AccountNotFound(LedgerError):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+class InvalidAmount(LedgerError):
+    pass
+
+
+class LedgerBusy(LedgerError):
+    """The database stayed locked through every retry."""
+
+
+class IdempotencyConflict(LedgerError):
+    """The Idempotency-Key was already used for a different posting."""
+
+
+class DailyLimitExceeded(LedgerError):
+    pass
+
+
+def _is_busy(exc):
+    msg = str(exc).lower()
+    return "locked" in msg or "busy" in msg
+
+
+def _backoff(attempt):
+    # Full jitter so retrying terminals don't wake up in lockstep
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt))
+    time.sleep(random.uniform(0, delay))
+
+
+def run_in_transaction(work, on_commit=None):
+    """
+    Run work(conn) inside BEGIN IMMEDIATE on the writer connection and commit.
+    on_commit(result) runs after the commit but before the writer is released,
+    so in-process caches see updates in commit order.
+
+    The write lock is taken up front, so the balance check and the UPDATE see
+    the same snapshot. SQLITE_BUSY (another process holds the lock past the
+    busy timeout) is retried with bounded exponential backoff; any other
+    error rolls back and propagates.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        conn = get_write_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = work(conn)
+            conn.commit()
+            if on_commit:
+                on_commit(result)
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if not _is_busy(e):
+                raise
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+        # Back off with the writer released so other threads can proceed
+        _backoff(attempt)
+    raise LedgerBusy("Database is busy, please try again")
+
+
+def run_idempotent(key, fingerprint, work, on_commit=None):
+    """
+    run_in_transaction(work, on_commit), deduplicated by an idempotency key.
+
+    The first call with a key that commits stores its result under the key
+    in the same transaction. Later calls with the key return that result,
+    flagged "replayed", without running work; a later call with the same key
+    but a different fingerprint (another card or amount) raises
+    IdempotencyConflict. key=None runs work as usual.
+    """
+    if key is None:
+        return run_in_transaction(work, on_commit)
+
+    replay = replay_from_cache(key, fingerprint)
+    if replay is not None:
+        return replay
+
+    def guarded(conn):
+        # Checked under the write lock: two retries racing each other can't
+        # both get past this
+        stored = idempotency.load(conn, key)
+        if stored is not None:
+            return _replay(key, stored, fingerprint)
+        result = work(conn)
+        idempotency.save(conn, key, fingerprint, result)
+        return result
+
+    def committed(result):
+        if result.get("replayed"):
+            return  # nothing changed; the cache is already right
+        if on_commit:
+            on_commit(result)
+        idempotency.responses.put(key, fingerprint, result)
+
+    return run_in_transaction(guarded, committed)
+
+
+def replay_from_cache(key, fingerprint):
+    """
+    The stored result for key if it is in the in-memory cache, else None.
+    Doesn't need the writer, so a retry is answered even while postings
+    are queued. Raises IdempotencyConflict like run_idempotent.
+    """
+    cached = idempotency.responses.get(key)
+    return None if cached is None else _replay(key, cached, fingerprint)
+
+
+def record_receipt(key, receipt_seq):
+    """
+    Store the journal seq of the receipt for the posting made under key,
+    so a replay returns it too.
+    """
+    idempotency.responses.update(key, receipt_seq=receipt_seq)
+    run_in_transaction(lambda conn: idempotency.attach_receipt(conn, key, receipt_seq))
+
+
+def withdraw_fingerprint(tag_id, amount, fee=WITHDRAW_FEE):
+    return f"withdraw {tag_id} {amount!r} {fee!r}"
+
+
+def deposit_fingerprint(tag_id, amount):
+    return f"deposit {tag_id} {amount!r}"
+
+
+def _replay(key, stored, fingerprint):
+    stored_fingerprint, result = stored
+    if stored_fingerprint != fingerprint:
+        raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+    idempotency.responses.put(key, stored_fingerprint, result)
+    return dict(result, replayed=True)
+
+
+def _resolve_user(conn, tag_id):
+    row = conn.execute("SELECT id FROM users WHERE rfid_tag = ?", (tag_id,)).fetchone()
+    if not row:
+        raise AccountNotFound("User not found")
+    return row[0]
+
+
+def _user_exists(conn, user_id):
+    return conn.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone() is not None
+
+
+def _read_balance(conn, user_id):
+    return conn.execute("SELECT balance FROM users WHERE id = ?", (user_id,)).fetchone()[0]
+
+
+def _refresh_cache(tag_id):
+    return lambda result: accounts.update_balance(tag_id, result["new_balance"])
+
+
+def _amount_error(amount):
+    """Why amount can't be posted, or None if it can."""
+    # inf passes "> 0" and would be written into the balance as Infinity
+    if amount is None or not math.isfinite(amount):
+        return "Amount must be a finite number"
+    if not amount > 0:
+        return "Amount must be greater than zero"
+    if amount > MAX_AMOUNT:
+        return f"Amount must not exceed {MAX_AMOUNT:,.2f}"
+    return None
+
+
+def _check_amount(amount):
+    error = _amount_error(amount)
+    if error:
+        raise InvalidAmount(error)
+
+
+def _check_daily_limits(conn, uid, amount, limits, posted_at):
+    if not (limits.amount or limits.count):
+        return
+    totals = daily_totals.today(conn, uid, posted_at)
+    if limits.count and totals["withdraw_count"] >= limits.count:
+        raise DailyLimitExceeded(f"Daily limit of {limits.count} withdrawals reached")
+    if limits.amount and totals["withdraw_amount"] + amount > limits.amount:
+        left = max(limits.amount - totals["withdraw_amount"], 0)
+        raise DailyLimitExceeded(
+            f"Daily withdrawal limit of {limits.amount:,.2f} exceeded ({left:,.2f} left today)")
+
+
+def withdraw(tag_id, amount, fee=WITHDRAW_FEE, user_id=None, idempotency_key=None, limits=None):
+    """
+    Debit amount + fee and record both rows. Returns the posting summary.
+    Pass user_id when the caller already resolved the tag (PIN session), and
+    idempotency_key to make retries of the same withdrawal safe. limits
+    (a DailyLimits) defaults to DAILY_LIMITS.
+    """
+    _check_amount(amount)
+    total = amount + fee
+    limits = limits or DAILY_LIMITS
+
+    def work(conn):
+        uid = user_id or _resolve_user(conn, tag_id)
+        # One clock read: the limit check, the ledger rows and their
+        # daily_totals row all agree on which day this is
+        posted_at = daily_totals.posting_time()
+        _check_daily_limits(conn, uid, amount, limits, posted_at)
+        # Guarded UPDATE: only succeeds if the balance covers amount + fee
+        cur = conn.execute(
+            "UPDATE users SET balance = balance - ? WHERE id = ? AND balance >= ?",
+            (total, uid, total),
+        )
+        if cur.rowcount == 0:
+            if user_id and not _user_exists(conn, uid):
+                raise AccountNotFound("User not found")
+            raise InsufficientFunds("Insufficient balance (including fee)")
+        conn.executemany(
+            "INSERT INTO transactions (user_id, type, amount, timestamp) VALUES (?, ?, ?, ?)",
+            [(uid, "withdraw", amount, posted_at), (uid, "fee", fee, posted_at)],
+        )
+        daily_totals.record(conn, uid, [("withdraw", amount), ("fee", fee)], posted_at)
+        return {
+            "user_id": uid,
+            "new_balance": _read_balance(conn, uid),
+            "amount": amount,
+            "fee": fee,
+        }
+
+    return run_idempotent(idempotency_key, withdraw_fingerprint(tag_id, amount, fee),
+                          work, _refresh_cache(tag_id))
+
+
+def deposit(tag_id, amount, user_id=None, idempotency_key=None):
+    """Credit amount and record the deposit row. Returns the posting summary."""
+    _check_amount(amount)
+
+    def work(conn):
+        uid = user_id or _resolve_user(conn, tag_id)
+        cur = conn.execute("UPDATE users SET balance = balance + ? WHERE id = ?", (amount, uid))
+        if cur.rowcount == 0:
+            raise AccountNotFound("User not found")
+        posted_at = daily_totals.posting_time()
+        conn.execute(
+            "INSERT INTO transactions (user_id, type, amount, timestamp) VALUES (?, ?, ?, ?)",
+            (uid, "deposit", amount, posted_at),
+        )
+        daily_totals.record(conn, uid, [("deposit", amount)], posted_at)
+        return {
+            "user_id": uid,
+            "new_balance": _read_balance(conn, uid),
+            "amount": amount,
+        }
+
+    return run_idempotent(idempotency_key, deposit_fingerprint(tag_id, amount),
+                          work, _refresh_cache(tag_id))
+
+
+# -------------------- BULK POSTING --------------------
+# Settlement and payroll loads: thousands of postings applied in one
+# transaction instead of one BEGIN IMMEDIATE (and one fsync) each.
+
+BULK_TYPES = ("deposit", "withdraw")
+RESOLVE_BATCH = 500     # tags per IN (...) lookup; stays under SQLite's variable limit
+
+
+def _resolve_accounts(conn, tags):
+    """{rfid_tag: [user_id, balance]} for the tags that exist."""
+    found = {}
+    tags = list(tags)
+    for i in range(0, len(tags), RESOLVE_BATCH):
+        batch = tags[i:i + RESOLVE_BATCH]
+        rows = conn.execute(
+            f"SELECT rfid_tag, id, balance FROM users WHERE rfid_tag IN ({', '.join('?' * len(batch))})",
+            batch,
+        )
+        for tag, uid, balance in rows:
+            found[tag] = [uid, balance]
+    return found
+
+
+def post_bulk(postings):
+    """
+    Apply a batch of (ref, tag_id, type, amount) postings in one transaction.
+
+    type is "deposit" or "withdraw"; bulk withdrawals are transfers out, not
+    cash at the ATM, so no WITHDRAW_FEE is charged and DAILY_LIMITS don't
+    apply (they still count in daily_totals). Postings are applied in
+    order against the balances read inside the transaction, and one that
+    can't be applied (unknown tag, an amount _check_amount would refuse,
+    insufficient funds) is skipped without affecting the rest.
+
+    Returns {"posted": n, "failures": [(ref, message), ...]}.
+    """
+
+    def work(conn):
+        accounts_by_tag = _resolve_accounts(conn, {p[1] for p in postings})
+        posted_at = daily_totals.posting_time()
+        rows, failures, touched, by_user = [], [], {}, {}
+        for ref, tag_id, kind, amount in postings:
+            account = accounts_by_tag.get(tag_id)
+            if account is None:
+                failures.append((ref, "User not found"))
+                continue
+            if kind not in BULK_TYPES:
+                failures.append((ref, f"Unknown posting type: {kind!r}"))
+                continue
+            amount_error = _amount_error(amount)
+            if amount_error:
+                failures.append((ref, amount_error))
+                continue
+            uid, balance = account
+            if kind == "withdraw":
+                if balance < amount:
+                    failures.append((ref, "Insufficient balance"))
+                    continue
+                account[1] = balance - amount
+            else:
+                account[1] = balance + amount
+            touched[tag_id] = account
+            rows.append((uid, kind, amount, posted_at))
+            by_user.setdefault(uid, []).append((kind, amount))
+
+        # Balances were read under the write lock, so writing the final
+        # values back is the same as applying every posting one by one
+        conn.executemany(
+            "UPDATE users SET balance = ? WHERE id = ?",
+            [(balance, uid) for uid, balance in touched.values()],
+        )
+        conn.executemany(
+            "INSERT INTO transactions (user_id, type, amount, timestamp) VALUES (?, ?, ?, ?)", rows
+        )
+        daily_totals.record_many(conn, by_user, posted_at)
+        return {
+            "posted": len(rows),
+            "failures": failures,
+            "balances": {tag: balance for tag, (_, balance) in touched.items()},
+        }
+
+    def refresh_cache(result):
+        for tag_id, balance in result.pop("balances").items():
+            accounts.update_balance(tag_id, balance)
+
+    return run_in_transaction(work, refresh_cache)
@@ -1,10 +1,38 @@
-from fastapi import FastAPI, HTTPException, WebSocket
+from typing import Optional
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from database import init_db, get_connection
-from printer_utils import print_balance_receipt
-from keypad_driver import Keypad  # Ensure keypad_driver.py is in the same folder
+from database import init_db, get_connection, get_pool, read_connection
+from printer_utils import (render_balance_receipt, render_withdrawal_receipt,
+                           render_deposit_receipt, mark_reprint)
+from print_spooler import PrintSpooler, SpoolerFull
+from hardware import drivers, DriverUnavailable, RETRY_BASE
+from terminals import Terminal, terminals, LOCAL_TERMINAL
+from account_cache import accounts
+from sessions import SessionStore
+from rfid_service import RfidReaderService, DirectPublisher
+import ledger
+import history
+import export
+import bulk
+import idempotency
+from archive import ArchiveJob
+import journal
+import executors
+from executors import db_readers, db_writer
+from atm_logging import setup_logging, get_logger, set_level, get_levels
+import metrics
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import threading
 import asyncio
+import functools
+import json
+import os
+import time
+
+# ATM_LOG_LEVEL (or ATM_DEBUG=1) sets the starting level; /debug/log-level changes it live
+setup_logging()
+log = get_logger("atm.api")
+keypad_log = get_logger("atm.keypad")
 
 app = FastAPI()
 
@@ -15,129 +43,443 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 # -------------------- INITIALIZE DB --------------------
 init_db()
 
+# -------------------- HARDWARE --------------------
+# Devices come from the driver registry and are opened lazily, so nothing
+# here touches GPIO or serial. ATM_HARDWARE=real|fake|null (see hardware.py)
+# runs the backend on a Pi, on simulators, or with no devices at all.
+
+# -------------------- HANDLERS --------------------
+# Handlers are async. Anything that touches SQLite is awaited on
+# executors.db_readers / db_writer, and device I/O stays off the event loop
+# (print spooler thread, executors.hardware), so Starlette's shared
+# threadpool is left to streamed exports.
+
+# -------------------- ELECTRONIC JOURNAL --------------------
+# Card taps, PIN checks, postings and the receipts they rendered are
+# appended to journal.ej by journal_writer's thread. Session events are
+# queued without waiting; postings and receipts wait for their record so
+# the response can carry its receipt_seq, the handle for a reprint. A
+# journal failure is logged by the writer and never fails the request: the
+# money has already moved.
+journal_writer = journal.JournalWriter(journal.ej)
+
+
+async def _journal(kind, user_id=None, **fields):
+    """Append a record and return its seq (None if it couldn't be written)."""
+    try:
+        return await asyncio.wrap_future(journal_writer.submit(kind, user_id, **fields))
+    except Exception:
+        return None
+
+
+def _journal_event(kind, user_id=None, **fields):
+    """Queue a session event; it is written after anything already queued."""
+    try:
+        journal_writer.submit(kind, user_id, **fields)
+    except journal.JournalFull:
+        pass  # counted and logged by the writer; the session carries on
+
+
 # -------------------- GLOBAL STATE --------------------
-inserted_card = None  # None = no card inserted
+# Per-terminal card and key hubs live in terminals.terminals
+session_store = SessionStore()  # PIN sessions handed out by /verify-pin
+
+
+def _session_for(tag_id: str, token: Optional[str]):
+    """
+    Resolve an X-Session-Token header. Returns None when no token was sent
+    (the caller falls back to looking the tag up); a token that is expired or
+    belongs to another card is rejected.
+    """
+    if not token:
+        return None
+    session = session_store.get(token)
+    if session is None or session.tag_id != tag_id:
+        raise HTTPException(status_code=401, detail="Session expired, please enter your PIN again")
+    return session
+
+async def _terminal(terminal: str = Query(LOCAL_TERMINAL)):
+    """?terminal=<id> on card/keypad routes; the local kiosk when omitted. 404 if unknown."""
+    term = terminals.find(terminal)
+    if term is None:
+        raise HTTPException(status_code=404, detail=f"Unknown terminal: {terminal!r}")
+    return term
+
+
+async def _terminal_or_new(terminal: str = Query(LOCAL_TERMINAL)):
+    """Like _terminal, but creates the terminal (card insert is where a kiosk first shows up)."""
+    try:
+        return terminals.get(terminal)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
 class KeypadManager:
+    """Reads the keypad wired to this Pi and publishes keys to the local terminal."""
+
     def __init__(self):
-        self.kp = Keypad()
-        self.active_connections: list[WebSocket] = []
+        # The Keypad is opened by the scanner thread on first use
+        # (ATM_KEYPAD_MODE=poll falls back to scanning the matrix continuously)
+        self.keypad = drivers["keypad"]
         self.running = False
-        self.loop = None  # Will hold the main event loop
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        print("Client connected to Keypad WebSocket")
-
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            print("Client disconnected from Keypad WebSocket")
-
-    async def broadcast_key(self, key: str):
-        # Send the key to all connected frontends
-        # We iterate over a copy to avoid modification issues during iteration
-        for connection in self.active_connections[:]:
-            try:
-                await connection.send_text(key)
-            except Exception as e:
-                print(f"Error sending to socket: {e}")
-                self.disconnect(connection)
 
-    def start_scanning(self, loop):
+    def start_scanning(self):
         """Runs in a background thread to continuously check hardware"""
+        keys = terminals.get(LOCAL_TERMINAL).keys
         self.running = True
-        print("--- Keypad Scanning Started ---")
+        keypad_log.info("scanning started", backend=self.keypad.backend)
         while self.running:
-            # This blocks until a key is pressed or returns None
-            key = self.kp.read_key()
+            try:
+                kp = self.keypad.get()
+            except DriverUnavailable:
+                # The driver logs it and backs off; check again shortly
+                time.sleep(RETRY_BASE)
+                continue
+            # Blocks until a key is pressed (or the timeout passes, so we can
+            # notice self.running going False)
+            try:
+                key = kp.read_key(timeout=0.5)
+            except Exception as e:
+                self.keypad.reset(e)
+                continue
+            metrics.keypad_loop_iterations.inc()
             if key:
-                print(f"Physical Key Pressed: {key}")
-                # Schedule the async broadcast on the main event loop
-                if loop and loop.is_running():
-                    asyncio.run_coroutine_threadsafe(self.broadcast_key(key), loop)
-            # Small sleep is handled inside read_key usually, but adding one here is safe
-            # time.sleep(0.01) 
+                metrics.keypad_keys.inc()
+                keypad_log.debug("key pressed", key=key)
+                keys.press(key)  # delivered on the event loop
 
 keypad_manager = KeypadManager()
+print_spooler = PrintSpooler(drivers["printer"])
+# Moves old ledger rows to the archive every ATM_ARCHIVE_INTERVAL_HOURS
+# (off by default; archive.py can run from cron instead)
+archive_job = ArchiveJob()
+
+# ATM_RFID_MODE=inprocess reads the MFRC522 on a thread inside this process;
+# the default leaves it to rfid_listener.py posting to /rfid/insert
+RFID_MODE = os.getenv("ATM_RFID_MODE", "external")
+rfid_service = None
+
 
 @app.on_event("startup")
 def startup_event():
+    global rfid_service
     # Get the main loop so the thread can talk back to it
     loop = asyncio.get_event_loop()
-    keypad_manager.loop = loop
+    terminals.set_loop(loop)
+    # Open the devices on the hardware pool; requests are served meanwhile
+    drivers.warm_up(executors.hardware)
+    print_spooler.start()
+    journal_writer.start()
+    session_store.start_sweeper()
+    archive_job.start()
     
     # Start the keypad scanner in a separate thread
-    threading.Thread(target=keypad_manager.start_scanning, args=(loop,), daemon=True).start()
+    threading.Thread(target=keypad_manager.start_scanning, daemon=True).start()
+
+    if RFID_MODE == "inprocess":
+        rfid_service = RfidReaderService(
+            drivers["rfid"],
+            DirectPublisher(terminals.get(LOCAL_TERMINAL).cards, accounts.get,
+                            functools.partial(_journal_event, terminal=LOCAL_TERMINAL)),
+        )
+        rfid_service.start()
 
 @app.on_event("shutdown")
 def shutdown_event():
     keypad_manager.running = False
-    keypad_manager.kp.cleanup()
+    print_spooler.stop()
+    session_store.stop_sweeper()
+    archive_job.stop()
+    journal_writer.stop()
+    journal.ej.close()
+    if rfid_service:
+        rfid_service.stop()
+    drivers.close_all()
+    get_pool().close_all()
     
-# -------------------- WEBSOCKET ENDPOINT --------------------
-@app.websocket("/ws/keypad")
-async def websocket_endpoint(websocket: WebSocket):
-    await keypad_manager.connect(websocket)
+# -------------------- WEBSOCKET ENDPOINTS --------------------
+WS_SEND_TIMEOUT = 2.0  # a send stuck this long means the client has stalled
+
+
+async def _send_unless_overflowed(sub, sending):
+    """
+    Await a send, but stop waiting as soon as sub's queue overflows: a
+    client stuck mid-send on a "close" hub is dropped then, not after
+    WS_SEND_TIMEOUT. Returns False if it overflowed; raises
+    asyncio.TimeoutError if the send stalled.
+    """
+    send = asyncio.ensure_future(sending)
+    overflow = asyncio.ensure_future(sub.wait_overflowed())
+    try:
+        done, _ = await asyncio.wait({send, overflow}, timeout=WS_SEND_TIMEOUT,
+                                     return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (send, overflow):
+            task.cancel()   # no-op for the one that finished
+    if send in done:
+        send.result()
+        return True
+    if overflow in done:
+        return False
+    raise asyncio.TimeoutError
+
+
+async def _pump_events(websocket: WebSocket, hub, channel, send_batch, catch_up=None):
+    """
+    Writer task for one socket: forward a hub's events until it disconnects.
+
+    Each socket has its own bounded Subscription, so a slow client only ever
+    delays itself. send_batch(events) gets everything that queued up while
+    the previous send was in flight and may coalesce it into one frame. A
+    client whose queue overflows (on a "close" hub) or whose send stalls for
+    WS_SEND_TIMEOUT is disconnected. The receive side is watched too, so a
+    closed socket is noticed right away.
+
+    catch_up(), if given, returns (events, seq): what to send before live
+    events (a snapshot, a replay) and the hub seq it covers. It runs after
+    subscribing so nothing can fall between the two, and live events it
+    already covers are skipped.
+    """
+    sub = hub.subscribe()
+    incoming = asyncio.ensure_future(websocket.receive_text())
+    after_seq = 0
+    slow = None
     try:
+        if catch_up:
+            missed, after_seq = catch_up()
+            if missed:
+                await asyncio.wait_for(send_batch(missed), WS_SEND_TIMEOUT)
         while True:
-            # Keep connection alive
-            await websocket.receive_text()
+            next_batch = asyncio.ensure_future(sub.next_batch())
+            done, _ = await asyncio.wait({incoming, next_batch}, return_when=asyncio.FIRST_COMPLETED)
+            if next_batch in done:
+                if sub.overflowed:
+                    slow = "queue overflow"
+                    break
+                batch = [event for event in next_batch.result() if event["seq"] > after_seq]
+                if batch:
+                    with metrics.ws_send_seconds.time(channel=channel):
+                        sent = await _send_unless_overflowed(sub, send_batch(batch))
+                    if not sent:
+                        slow = "queue overflow"
+                        break
+            else:
+                next_batch.cancel()
+            if incoming in done:
+                if incoming.exception() is not None:
+                    break  # disconnected
+                incoming = asyncio.ensure_future(websocket.receive_text())
+    except asyncio.TimeoutError:
+        slow = "send timeout"
     except Exception:
-        keypad_manager.disconnect(websocket)
+        pass
+    finally:
+        incoming.cancel()
+        hub.unsubscribe(sub)
+        if sub.dropped:
+            metrics.ws_dropped_events.inc(sub.dropped, channel=channel)
+
+    if slow:
+        metrics.ws_slow_disconnects.inc(channel=channel, reason=slow)
+        log.warning("disconnecting slow client", channel=channel, reason=slow,
+                    dropped=sub.dropped)
+        try:
+            # 1013 "try again later": the client should reconnect
+            await asyncio.wait_for(websocket.close(code=1013, reason=slow), 1.0)
+        except Exception:
+            pass
+
+
+async def _accept_for_terminal(websocket: WebSocket, terminal_id: str):
+    """Accept the socket and resolve ?terminal=; closes it (1008) if the id is bad."""
+    try:
+        terminal = terminals.get(terminal_id)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return None
+    await websocket.accept()
+    return terminal
+
+
+@app.websocket("/ws/keypad")
+async def websocket_endpoint(websocket: WebSocket, terminal: str = LOCAL_TERMINAL,
+                             last_seq: Optional[int] = None):
+    """
+    Push the keys pressed at this terminal. Each frame is a JSON array of
+    {"event": "key", "seq", "key", "ts"} objects, oldest first; keys that
+    piled up while the client lagged share one frame.
+
+    Reconnect with ?last_seq=<seq of the last key handled> and the keys
+    pressed in between are replayed before live ones.
+    """
+    term = await _accept_for_terminal(websocket, terminal)
+    if term is None:
+        return
+    keypad_log.info("client connected", terminal=term.id, last_seq=last_seq,
+                    clients=term.keys.subscriber_count() + 1)
+
+    def catch_up():
+        if last_seq is None:
+            return [], term.keys.seq  # fresh client: live keys only
+        missed, seq = term.keys.replay(last_seq)
+        if missed:
+            keypad_log.info("replaying keys", terminal=term.id, count=len(missed),
+                            first=missed[0]["seq"], last=seq)
+        return missed, seq
+
+    await _pump_events(websocket, term.keys, "keypad", websocket.send_json, catch_up)
+    keypad_log.info("client disconnected", terminal=term.id, clients=term.keys.subscriber_count())
+
+@app.websocket("/ws/card")
+async def card_websocket(websocket: WebSocket, terminal: str = LOCAL_TERMINAL):
+    """
+    Push card events as JSON: a snapshot of the current card on connect, then
+    insert/remove/recognized events. Every message carries a seq; a gap means
+    the client missed something and should trust the next snapshot.
+    """
+    term = await _accept_for_terminal(websocket, terminal)
+    if term is None:
+        return
+    async def send_events(batch):
+        for event in batch:
+            await websocket.send_json(event)
+
+    def catch_up():
+        snapshot = term.cards.snapshot()
+        return [snapshot], snapshot["seq"]
+
+    await _pump_events(websocket, term.cards, "card", send_events, catch_up)
+
+# -------------------- METRICS --------------------
+metrics.Gauge("atm_ws_connections", "Open WebSocket connections by channel.", lambda: {
+    (("channel", channel),): count for channel, count in terminals.subscriber_counts().items()
+})
+metrics.Gauge("atm_terminals", "Terminals seen by this backend.", lambda: len(terminals))
+metrics.Gauge("atm_print_queue_depth", "Receipts waiting for the printer.", print_spooler.pending)
+metrics.Gauge("atm_journal_queue_depth", "Records waiting to be journalled.", journal_writer.pending)
+metrics.Gauge("atm_sessions", "Live PIN sessions.", lambda: len(session_store))
+metrics.Gauge("atm_account_cache_entries", "Accounts in the lookup cache.",
+              lambda: accounts.stats()["size"])
+metrics.Gauge("atm_idempotency_cache_entries", "Idempotency keys held in memory.",
+              lambda: len(idempotency.responses))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(metrics.render_all(), media_type="text/plain; version=0.0.4")
 
 # -------------------- ROOT --------------------
 @app.get("/")
-def root():
+async def root():
     return {"message": "Mini ATM backend is running"}
 
 
+def _ping_db():
+    with read_connection() as conn:
+        conn.execute("SELECT 1").fetchone()
+
+
+def _supervisor_status():
+    """Component states written by run_all.py (None when not started by it)."""
+    path = os.getenv("ATM_SUPERVISOR_STATUS")
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@app.get("/health")
+async def health(response: Response):
+    """
+    Readiness probe for run_all.py: 200 once the API can serve a card tap.
+    Lists run_all.py's components too; status is "degraded" if one failed.
+    """
+    try:
+        await db_readers.run(_ping_db)
+    except Exception as e:
+        response.status_code = 503
+        return {"status": "unavailable", "error": str(e)}
+    components = _supervisor_status()
+    failed = components and any(c.get("state") == "failed" for c in components.values())
+    return {
+        "status": "degraded" if failed else "ok",
+        "rfid_mode": RFID_MODE,
+        "printer_queue": print_spooler.pending(),
+        "hardware": drivers.status(),
+        "executors": executors.status(),
+        "components": components,
+    }
+
+
 # -------------------- RFID LATEST --------------------
 @app.get("/rfid/latest")
-def rfid_latest():
-    """Return the last inserted RFID card (if any)."""
-    return {"rfid_tag": inserted_card}
+async def rfid_latest(term: Terminal = Depends(_terminal)):
+    """Return the last inserted RFID card (if any). Prefer /ws/card for live updates."""
+    snapshot = term.cards.snapshot()
+    return {"rfid_tag": snapshot["rfid_tag"], "seq": snapshot["seq"], "terminal": term.id}
 
 
 # -------------------- SIMULATE CARD INSERT/REMOVE --------------------
 @app.post("/rfid/insert/{tag_id}")
-def insert_card(tag_id: str):
+async def insert_card(tag_id: str, term: Terminal = Depends(_terminal_or_new)):
     """Simulate RFID card insertion."""
-    global inserted_card
-    inserted_card = tag_id
-    print(f"💳 Card detected: {tag_id}")
-    return {"status": "card inserted", "rfid_tag": tag_id}
+    event = term.cards.insert(tag_id)
+    log.info("card inserted", terminal=term.id, tag=tag_id, seq=event["seq"])
+    _journal_event("card_inserted", terminal=term.id, rfid_tag=tag_id)
+    return {"status": "card inserted", "rfid_tag": tag_id, "seq": event["seq"], "terminal": term.id}
 
 
 @app.post("/rfid/remove")
-def remove_card():
+async def remove_card(term: Terminal = Depends(_terminal)):
     """Simulate RFID card removal."""
-    global inserted_card
-    print("❌ Card removed.")
-    inserted_card = None
-    return {"status": "card removed"}
+    event = term.cards.remove()
+    log.info("card removed", terminal=term.id, seq=event["seq"])
+    _journal_event("card_removed", terminal=term.id)
+    return {"status": "card removed", "seq": event["seq"], "terminal": term.id}
+
+
+# -------------------- REMOTE KEYPADS / TERMINALS --------------------
+KEYPAD_KEYS = set("0123456789ABCD*#")
+
+
+@app.post("/keypad/{key}")
+async def press_key(key: str, term: Terminal = Depends(_terminal)):
+    """Key press from a kiosk whose keypad isn't wired to this Pi (or a simulator)."""
+    if key not in KEYPAD_KEYS:
+        raise HTTPException(status_code=400, detail=f"Unknown key: {key!r}")
+    event = term.keys.press(key)
+    return {"status": "key sent", "key": key, "seq": event["seq"], "terminal": term.id}
+
+
+@app.get("/terminals")
+async def list_terminals():
+    """Every terminal this backend has seen, with its card and client counts."""
+    return {"terminals": [t.to_dict() for t in terminals.all()]}
 
 
 # -------------------- RFID AUTHENTICATION --------------------
 @app.get("/rfid/{tag_id}")
 @app.post("/rfid/{tag_id}")
-def rfid_tap(tag_id: str):
+async def rfid_tap(tag_id: str, term: Terminal = Depends(_terminal)):
     """Authenticate RFID card (check if it exists in the database)."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, balance FROM users WHERE rfid_tag = ?", (tag_id,))
-    user = cursor.fetchone()
-    conn.close()
+    user = await db_readers.run(accounts.get, tag_id)
 
     if user:
-        user_id, name, balance = user
-        print(f"✅ RFID recognized: {tag_id} ({name})")
+        name, balance = user.name, user.balance
+        term.cards.recognized(tag_id, name)
+        log.info("rfid recognized", terminal=term.id, tag=tag_id, user_id=user.id)
+        _journal_event("card_recognized", user.id, terminal=term.id, rfid_tag=tag_id)
         return {
             "status": "success",
             "rfid_tag": tag_id,
@@ -145,256 +487,470 @@ def rfid_tap(tag_id: str):
             "balance": balance
         }
     else:
-        print(f"🚫 Unknown RFID: {tag_id}")
+        log.info("rfid unknown", tag=tag_id)
         raise HTTPException(status_code=404, detail="RFID not recognized. Access denied.")
 
 
 # -------------------- PIN VERIFICATION --------------------
 @app.post("/verify-pin/{tag_id}/{pin}")
-def verify_pin(tag_id: str, pin: str):
+async def verify_pin(tag_id: str, pin: str):
     """Verify PIN associated with the RFID tag."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT pin FROM users WHERE rfid_tag = ?", (tag_id,))
-    user = cursor.fetchone()
-    conn.close()
+    user = await db_readers.run(accounts.get, tag_id)
 
     if not user:
-        print(f"🚫 RFID not recognized for PIN check: {tag_id}")
+        log.info("pin check for unknown rfid", tag=tag_id)
         raise HTTPException(status_code=404, detail="RFID not recognized")
 
-    stored_pin = user[0]
+    stored_pin = user.pin
     if stored_pin == pin:
-        print(f"🔐 PIN verified for {tag_id}")
-        return {"status": "success", "message": "PIN verified"}
+        session = session_store.create(tag_id, user.id, user.name)
+        log.info("pin verified", tag=tag_id, user_id=user.id)
+        _journal_event("pin_verified", user.id, rfid_tag=tag_id)
+        return {
+            "status": "success",
+            "message": "PIN verified",
+            "session_token": session.token,
+            "expires_in": session_store.ttl,
+        }
     else:
-        print(f"❌ Invalid PIN for {tag_id}")
+        log.info("pin rejected", tag=tag_id, user_id=user.id)
+        _journal_event("pin_rejected", user.id, rfid_tag=tag_id)
         raise HTTPException(status_code=401, detail="Invalid PIN")
 
 
 # -------------------- WITHDRAW --------------------
-@app.post("/withdraw/{tag_id}/{amount}")
-def withdraw(tag_id: str, amount: float):
-    """Withdraw funds from user's balance."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, balance FROM users WHERE rfid_tag = ?", (tag_id,))
-    user = cursor.fetchone()
+def _ledger_http_error(e: ledger.LedgerError) -> HTTPException:
+    """Map a ledger posting failure to the HTTP error the frontend expects."""
+    if isinstance(e, ledger.AccountNotFound):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, ledger.LedgerBusy):
+        return HTTPException(status_code=503, detail=str(e))
+    if isinstance(e, ledger.IdempotencyConflict):
+        return HTTPException(status_code=409, detail=str(e))
+    return HTTPException(status_code=400, detail=str(e))
+
+
+def _check_idempotency_key(key: Optional[str]):
+    if key is not None and not 0 < len(key) <= idempotency.MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=(
+            f"Idempotency-Key must be 1 to {idempotency.MAX_KEY_LENGTH} characters"))
+
+
+async def _holder_name(tag_id: str, session):
+    if session:
+        return session.name
+    user = await db_readers.run(accounts.get, tag_id)
+    return user.name if user else None
+
+
+async def _remember_receipt(idempotency_key, receipt_seq):
+    """Store receipt_seq with an idempotent posting's result, so a retry gets it back."""
+    if idempotency_key is None or receipt_seq is None:
+        return
+    try:
+        await db_writer.run(ledger.record_receipt, idempotency_key, receipt_seq)
+    except Exception as e:
+        # The posting stands; only a replay would miss its receipt_seq
+        log.warning("could not store receipt_seq for idempotency key",
+                    receipt_seq=receipt_seq, error=e)
 
-    if not user:
-        conn.close()
-        raise HTTPException(status_code=404, detail="User not found")
 
-    user_id, balance = user
-    fee = 18.0  # ⬅️ Define the fee
-    total_deduction = amount + fee  # ⬅️ Calculate total to deduct
-    
-    if balance < total_deduction:  # ⬅️ Check if balance covers amount + fee
-        conn.close()
-        raise HTTPException(status_code=400, detail="Insufficient balance (including fee)")
+def _mark_replayed(result: dict, response: Response):
+    """A retry answered from the stored result: say so, for logs and clients."""
+    if result.get("replayed"):
+        response.headers["Idempotent-Replayed"] = "true"
 
-    new_balance = balance - total_deduction  # ⬅️ Subtract amount + fee
-    cursor.execute("UPDATE users SET balance = ? WHERE id = ?", (new_balance, user_id))
-    
-    # Record both withdrawal and fee in transactions (optional but good for tracking)
-    cursor.execute(
-        "INSERT INTO transactions (user_id, type, amount) VALUES (?, ?, ?)",
-        (user_id, "withdraw", amount)
-    )
-    cursor.execute(
-        "INSERT INTO transactions (user_id, type, amount) VALUES (?, ?, ?)",
-        (user_id, "fee", fee)  # ⬅️ Record fee separately
-    )
 
-    conn.commit()
-    conn.close()
+@app.post("/withdraw/{tag_id}/{amount}")
+async def withdraw(
+    tag_id: str,
+    amount: float,
+    response: Response,
+    x_session_token: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    Withdraw funds from user's balance.
+
+    Send an Idempotency-Key header (e.g. a UUID per withdrawal) to make the
+    request safe to retry: repeats get the first result back, with an
+    Idempotent-Replayed: true header, and nothing is debited again.
 
-    print(f"💸 Withdrawn {amount} + fee {fee} from {tag_id}. New balance: {new_balance}")
+    The withdrawal and its receipt go to the electronic journal; receipt_seq
+    in the response reprints it (POST /journal/{receipt_seq}/reprint). A
+    replayed request isn't journalled again; it returns the first receipt_seq.
+    """
+    started = time.perf_counter()
+    session = _session_for(tag_id, x_session_token)
+    _check_idempotency_key(idempotency_key)
+    try:
+        result = idempotency_key and ledger.replay_from_cache(
+            idempotency_key, ledger.withdraw_fingerprint(tag_id, amount))
+        if not result:
+            result = await db_writer.run(ledger.withdraw, tag_id, amount,
+                                         user_id=session and session.user_id,
+                                         idempotency_key=idempotency_key)
+    except ledger.LedgerError as e:
+        raise _ledger_http_error(e)
+    _mark_replayed(result, response)
+
+    new_balance, fee = result["new_balance"], result["fee"]
+    receipt_seq = result.get("receipt_seq")     # a replay carries the original's
+    if not result.get("replayed"):
+        name = await _holder_name(tag_id, session)
+        receipt_seq = await _journal(
+            "withdraw", result["user_id"], rfid_tag=tag_id, amount=amount, fee=fee,
+            new_balance=new_balance,
+            receipt=render_withdrawal_receipt(name, amount, fee, new_balance).decode("utf-8"))
+        await _remember_receipt(idempotency_key, receipt_seq)
+    log.info("withdraw", tag=tag_id, user_id=result["user_id"], amount=amount, fee=fee,
+             replayed=result.get("replayed", False),
+             latency_ms=(time.perf_counter() - started) * 1000)
     return {
         "rfid_tag": tag_id, 
         "new_balance": new_balance, 
         "status": "Withdrawal successful",
         "fee": fee,  # ⬅️ Return fee in response
-        "amount_withdrawn": amount
+        "amount_withdrawn": amount,
+        "receipt_seq": receipt_seq,
     }
 
 # -------------------- DEPOSIT --------------------
 @app.post("/deposit/{tag_id}/{amount}")
-def deposit(tag_id: str, amount: float):
-    """Deposit funds to user's balance."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, balance FROM users WHERE rfid_tag = ?", (tag_id,))
-    user = cursor.fetchone()
-
-    if not user:
-        conn.close()
-        raise HTTPException(status_code=404, detail="User not found")
-
-    user_id, balance = user
-    new_balance = balance + amount
-
-    cursor.execute("UPDATE users SET balance = ? WHERE id = ?", (new_balance, user_id))
-    cursor.execute(
-        "INSERT INTO transactions (user_id, type, amount) VALUES (?, ?, ?)",
-        (user_id, "deposit", amount)
-    )
+async def deposit(
+    tag_id: str,
+    amount: float,
+    response: Response,
+    x_session_token: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    Deposit funds to user's balance. Idempotency-Key and receipt_seq work as
+    for /withdraw.
+    """
+    started = time.perf_counter()
+    session = _session_for(tag_id, x_session_token)
+    _check_idempotency_key(idempotency_key)
+    try:
+        result = idempotency_key and ledger.replay_from_cache(
+            idempotency_key, ledger.deposit_fingerprint(tag_id, amount))
+        if not result:
+            result = await db_writer.run(ledger.deposit, tag_id, amount,
+                                         user_id=session and session.user_id,
+                                         idempotency_key=idempotency_key)
+    except ledger.LedgerError as e:
+        raise _ledger_http_error(e)
+    _mark_replayed(result, response)
+
+    new_balance = result["new_balance"]
+    receipt_seq = result.get("receipt_seq")     # a replay carries the original's
+    if not result.get("replayed"):
+        name = await _holder_name(tag_id, session)
+        receipt_seq = await _journal(
+            "deposit", result["user_id"], rfid_tag=tag_id, amount=amount, new_balance=new_balance,
+            receipt=render_deposit_receipt(name, amount, new_balance).decode("utf-8"))
+        await _remember_receipt(idempotency_key, receipt_seq)
+    log.info("deposit", tag=tag_id, user_id=result["user_id"], amount=amount,
+             replayed=result.get("replayed", False),
+             latency_ms=(time.perf_counter() - started) * 1000)
+    return {"rfid_tag": tag_id, "new_balance": new_balance, "status": "Deposit successful",
+            "receipt_seq": receipt_seq}
+
+
+# -------------------- BULK POSTING --------------------
+@app.post("/bulk/postings")
+async def bulk_postings(request: Request, format: str = Query("csv", pattern="^(csv|ndjson)$")):
+    """
+    Apply a CSV or NDJSON file of (rfid_tag, type, amount) postings, e.g.
+    curl --data-binary @payroll.csv localhost:8000/bulk/postings?format=csv
 
-    conn.commit()
-    conn.close()
+    The body is parsed as it arrives and posted bulk.CHUNK_ROWS rows per
+    transaction. Rows that fail are listed (with their line number) in the
+    response; they don't stop the rest of the file.
+    """
+    loader = bulk.BulkLoader(format)
+    lines = bulk.LineSplitter()
+    try:
+        async for data in request.stream():
+            # Full chunks are posted as they fill up, so this runs on the writer
+            await db_writer.run(loader.add, lines.feed(data))
+        await db_writer.run(loader.add, lines.end())
+        summary = await db_writer.run(loader.finish)
+    except bulk.BulkFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    print(f"💰 Deposited {amount} to {tag_id}. New balance: {new_balance}")
-    return {"rfid_tag": tag_id, "new_balance": new_balance, "status": "Deposit successful"}
+    log.info("bulk postings", format=format, rows=summary["rows"], posted=summary["posted"],
+             failed=summary["failed"], chunks=summary["chunks"], seconds=summary["seconds"])
+    return summary
 
 
 # -------------------- BALANCE CHECK --------------------
 @app.get("/balance/{tag_id}")
-def get_balance(tag_id: str):
+async def get_balance(tag_id: str, x_session_token: Optional[str] = Header(None)):
     """Return balance for a given RFID tag."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT balance FROM users WHERE rfid_tag = ?", (tag_id,))
-    user = cursor.fetchone()
-    conn.close()
+    _session_for(tag_id, x_session_token)
+    user = await db_readers.run(accounts.get, tag_id)
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    balance = user[0]
-    print(f"📊 Balance check for {tag_id}: {balance}")
+    balance = user.balance
+    log.debug("balance check", tag=tag_id, user_id=user.id, sample=10)
     return {"rfid_tag": tag_id, "balance": balance}
 
 # -------------------- TRANSACTION HISTORY --------------------
+def _fetch_history(session, tag_id, after, limit):
+    conn = get_connection()
+    try:
+        if session:
+            return history.fetch_page(conn, session.user_id, after, limit)
+        return history.fetch_page_by_tag(conn, tag_id, after, limit)
+    finally:
+        conn.close()
+
+
 @app.get("/transactions/{tag_id}")
-def get_transactions(tag_id: str):
-    """Fetch transaction history for a specific user."""
-    print(f"📥 GET /transactions/{tag_id} called")
-    
-    conn = None
+async def get_transactions(
+    tag_id: str,
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(history.DEFAULT_PAGE_SIZE, ge=1, le=history.MAX_PAGE_SIZE),
+    x_session_token: Optional[str] = Header(None),
+):
+    """
+    Fetch transaction history for a specific user, newest first.
+
+    Pass the X-Next-Cursor header of one page as ?after= to get the next one.
+    """
+    started = time.perf_counter()
+    session = _session_for(tag_id, x_session_token)
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # DEBUG: Check if the table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transactions'")
-        table_exists = cursor.fetchone()
-        if not table_exists:
-            print(f"❌ ERROR: 'transactions' table does not exist in database!")
-            raise HTTPException(status_code=500, detail="Transactions table not found in database")
-        
-        # DEBUG: List all tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = cursor.fetchall()
-        print(f"📋 Available tables: {tables}")
-        
-        # 1. Get the user_id from the RFID tag
-        print(f"🔍 Looking up user with RFID tag: '{tag_id}'")
-        cursor.execute("SELECT id, name FROM users WHERE rfid_tag = ?", (tag_id,))
-        user = cursor.fetchone()
-        
-        if not user:
-            print(f"❌ User with RFID tag '{tag_id}' not found in users table")
-            conn.close()
+        try:
+            page = await db_readers.run(_fetch_history, session, tag_id, after, limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        if page is None:
+            log.info("history for unknown rfid", tag=tag_id)
             raise HTTPException(status_code=404, detail=f"User with RFID {tag_id} not found")
-        
-        user_id, user_name = user
-        print(f"✅ Found user: ID={user_id}, Name={user_name}")
-        
-        # DEBUG: Check transactions table structure
-        cursor.execute("PRAGMA table_info(transactions)")
-        columns = cursor.fetchall()
-        print(f"📊 Transactions table columns: {columns}")
-        
-        # DEBUG: Check if there are any transactions for this user
-        cursor.execute("SELECT COUNT(*) FROM transactions WHERE user_id = ?", (user_id,))
-        count = cursor.fetchone()[0]
-        print(f"📈 Total transactions for user_id {user_id}: {count}")
-        
-        # 2. Fetch the last 10 transactions for this user
-        print(f"📋 Fetching transactions for user_id: {user_id}")
-        cursor.execute("""
-            SELECT id, type, amount, timestamp, user_id 
-            FROM transactions 
-            WHERE user_id = ? 
-            ORDER BY timestamp DESC 
-            LIMIT 10
-        """, (user_id,))
-        
-        rows = cursor.fetchall()
-        
-        # DEBUG: Print raw rows
-        print(f"📄 Raw transaction rows ({len(rows)}):")
-        for i, row in enumerate(rows):
-            print(f"  [{i}] id={row[0]}, type={row[1]}, amount={row[2]}, timestamp={row[3]}, user_id={row[4]}")
-        
-        # 3. Format the data into a list of dictionaries (JSON)
-        history = []
+
+        rows, next_cursor = page
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+
+        log.debug("history page", tag=tag_id, rows=len(rows), more=bool(next_cursor),
+                  latency_ms=(time.perf_counter() - started) * 1000)
         for row in rows:
-            history.append({
-                "id": row[0],
-                "type": row[1],
-                "amount": float(row[2]) if row[2] is not None else 0.0,
-                "timestamp": row[3],
-                "user_id": row[4]
-            })
-        
-        print(f"✅ Sending history for {tag_id} ({user_name}): {len(history)} records")
-        return history
+            log.debug("history row", id=row[0], type=row[1], amount=row[2],
+                      timestamp=row[3], user_id=row[4])
+
+        return [history.row_to_dict(row) for row in rows]
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ ERROR in get_transactions: {str(e)}")
-        print(f"📝 Error type: {type(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("get_transactions failed", tag=tag_id)
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
+
+# -------------------- TRANSACTION EXPORT --------------------
+@app.get("/export/transactions")
+async def export_transactions(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    rfid_tag: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    type: Optional[list[str]] = Query(None),
+    x_session_token: Optional[str] = Header(None),
+):
+    """
+    Stream the ledger as CSV or NDJSON, for audits and reconciliation.
+
+    Without rfid_tag the export is ATM-wide. since/until take a date or a
+    datetime (until is exclusive; a bare date includes that day), and type
+    can be repeated: ?type=withdraw&type=fee
+    """
+    user_id = None
+    if rfid_tag:
+        session = _session_for(rfid_tag, x_session_token)
+        if session:
+            user_id = session.user_id
+        else:
+            user = await db_readers.run(accounts.get, rfid_tag)
+            if not user:
+                raise HTTPException(status_code=404, detail=f"User with RFID {rfid_tag} not found")
+            user_id = user.id
+
+    try:
+        chunks = export.stream_transactions(
+            format, user_id,
+            export.parse_bound(since), export.parse_bound(until, end=True), type,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    log.info("export started", format=format, user_id=user_id, since=since, until=until, types=type)
+    filename = f"transactions-{rfid_tag or 'all'}.{format}"
+    return StreamingResponse(
+        chunks,
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# -------------------- ACCOUNT CACHE STATS --------------------
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for the account cache."""
+    return accounts.stats()
+
+# -------------------- LOG LEVELS --------------------
+@app.get("/debug/log-level")
+async def read_log_levels():
+    return get_levels()
+
+
+@app.post("/debug/log-level/{level}")
+async def change_log_level(level: str, logger: str = "atm"):
+    """Switch logging at runtime, e.g. POST /debug/log-level/DEBUG?logger=atm.api"""
+    try:
+        set_level(level, logger)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return get_levels()
 
 # -------------------- DEBUG: VIEW ALL USERS --------------------
-@app.get("/users")
-def get_users():
-    """List all users (for debugging)."""
+def _all_users():
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, name, rfid_tag, balance, pin FROM users")
     users = cursor.fetchall()
     conn.close()
-    return {"users": users}
+    return users
+
+
+@app.get("/users")
+async def get_users():
+    """List all users (for debugging)."""
+    return {"users": await db_readers.run(_all_users)}
 
 @app.post("/print/receipt")
-def print_receipt_endpoint(data: dict):
+async def print_receipt_endpoint(data: dict, x_session_token: Optional[str] = Header(None)):
     """
-    Print a Balance Inquiry receipt for a given RFID tag.
+    Print a Balance Inquiry receipt for a given RFID tag. 503 if the printer
+    queue is full.
     """
-    try:
-        rfid_tag = data.get("rfid_tag")
-        if not rfid_tag:
-            raise HTTPException(status_code=400, detail="RFID tag is required")
-
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, balance FROM users WHERE rfid_tag = ?", (rfid_tag,))
-        user = cursor.fetchone()
-        conn.close()
+    rfid_tag = data.get("rfid_tag")
+    if not rfid_tag:
+        raise HTTPException(status_code=400, detail="RFID tag is required")
+    _session_for(rfid_tag, x_session_token)
 
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
+    user = await db_readers.run(accounts.get, rfid_tag)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    name, balance = user.name, user.balance
 
-        name, balance = user
-        print(f"?? Printing balance receipt for {name} ({rfid_tag})")
+    # --- Hand the receipt to the spooler (it prints in the background), ---
+    # --- then journal it: a receipt the spooler refused was never issued ---
+    receipt = render_balance_receipt(name, balance)
+    try:
+        job = print_spooler.submit(receipt, f"balance:{rfid_tag}")
+    except SpoolerFull as e:
+        log.warning("printer warning", tag=rfid_tag, error=e)
+        raise HTTPException(status_code=503, detail=str(e))
+    log.info("receipt queued", tag=rfid_tag, user_id=user.id, job_id=job.id)
+    receipt_seq = await _journal("balance_receipt", user.id, rfid_tag=rfid_tag,
+                                 balance=balance, job_id=job.id,
+                                 receipt=receipt.decode("utf-8"))
 
-        # --- Print the receipt ---
-        print_balance_receipt(name, balance)
+    return {
+        "status": "queued",
+        "job_id": job.id,
+        "receipt_seq": receipt_seq,
+        "message": f"Receipt queued for {name}",
+    }
 
-        print(f"? Receipt printed successfully for {name}")
-        return {"status": "success", "message": f"Receipt printed successfully for {name}"}
 
-    except Exception as e:
-        # Log the error but do NOT throw a 500 if the print actually succeeded
-        print(f"?? Printer warning: {e}")
-        return {"status": "warning", "message": f"Printer warning: {str(e)}"}
+@app.get("/print/jobs/{job_id}")
+async def print_job_status(job_id: int):
+    """Status of a queued receipt: queued, printing, done or failed."""
+    job = print_spooler.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Print job not found")
+    return job
+
+
+# -------------------- ELECTRONIC JOURNAL: REPRINT & SEARCH --------------------
+def _journal_record(seq, x_session_token):
+    record = journal.ej.get(seq)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Journal record {seq} not found")
+    if x_session_token:
+        _session_for(record.get("rfid_tag"), x_session_token)
+    return record
+
+
+@app.get("/journal")
+async def search_journal(
+    response: Response,
+    rfid_tag: Optional[str] = None,
+    user_id: Optional[int] = None,
+    kind: Optional[list[str]] = Query(None),
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    before: Optional[int] = None,
+    limit: int = Query(journal.DEFAULT_LIMIT, ge=1, le=journal.MAX_LIMIT),
+):
+    """
+    Journal records, newest first. Filter by card (rfid_tag) or user_id,
+    kind (repeatable: ?kind=withdraw&kind=deposit) and since/until (as for
+    /export/transactions). Pass the X-Next-Cursor header as ?before= for
+    the next page.
+    """
+    unknown = set(kind or ()) - set(journal.KINDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown kind: {', '.join(sorted(unknown))}")
+    if rfid_tag:
+        user = await db_readers.run(accounts.get, rfid_tag)
+        if not user:
+            raise HTTPException(status_code=404, detail=f"User with RFID {rfid_tag} not found")
+        user_id = user.id
+    try:
+        since_ts = journal.epoch(export.parse_bound(since))
+        until_ts = journal.epoch(export.parse_bound(until, end=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Index lookups and record reads are disk reads, like any other lookup
+    records, next_before = await db_readers.run(
+        journal.ej.search, user_id, kind, since_ts, until_ts, before, limit)
+    if next_before is not None:
+        response.headers["X-Next-Cursor"] = str(next_before)
+    return records
+
+
+@app.get("/journal/{seq}")
+async def get_journal_record(seq: int, x_session_token: Optional[str] = Header(None)):
+    """One journal record, with the receipt text if it produced one."""
+    try:
+        return await db_readers.run(_journal_record, seq, x_session_token)
+    except journal.JournalError as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/journal/{seq}/reprint")
+async def reprint_receipt(seq: int, x_session_token: Optional[str] = Header(None)):
+    """Print a journalled receipt again, marked as a reprint, exactly as it was issued."""
+    try:
+        record = await db_readers.run(_journal_record, seq, x_session_token)
+    except journal.JournalError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not record.get("receipt"):
+        raise HTTPException(status_code=400, detail=f"Journal record {seq} has no receipt")
+
+    try:
+        job = print_spooler.submit(mark_reprint(record["receipt"].encode("utf-8")), f"reprint:{seq}")
+    except SpoolerFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    reprint_seq = await _journal("reprint", record["user_id"], rfid_tag=record.get("rfid_tag"),
+                                 of_seq=seq)
+    log.info("receipt reprint queued", seq=seq, job_id=job.id)
+    return {"status": "queued", "job_id": job.id, "seq": seq, "reprint_seq": reprint_seq}
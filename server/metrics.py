@@ -0,0 +1,225 @@
+import threading
+import time
+
+# ==============================
+#   Metrics (Prometheus text format)
+# ==============================
+# Counters and histograms are sharded per thread: each thread only ever
+# touches its own shard, so recording a value takes no lock. /metrics sums
+# the shards when it is scraped. Gauges are callbacks evaluated at scrape
+# time (queue depth, open sockets), so keeping them current costs nothing.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+class _Sharded:
+    """Per-thread storage; the lock is only taken the first time a thread records."""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshot(self):
+        with self._shards_lock:
+            return [dict(s) for s in self._shards]
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = tuple(sorted(labels.items()))
+        shard[key] = shard.get(key, 0) + amount
+
+    def render(self):
+        totals = {}
+        for shard in self._snapshot():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        for key, value in sorted(totals.items()):
+            yield f"{self.name}{_labels(key)} {_num(value)}"
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = tuple(sorted(labels.items()))
+        series = shard.get(key)
+        if series is None:
+            # [per-bucket counts..., +Inf count, sum]
+            series = shard[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[-2] += 1
+        series[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        merged = {}
+        for shard in self._snapshot():
+            for key, series in shard.items():
+                total = merged.setdefault(key, [0] * len(series))
+                for i, v in enumerate(list(series)):
+                    total[i] += v
+        for key, series in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = bound if bound == "+Inf" else _num(bound)
+                yield f"{self.name}_bucket{_labels(key + (('le', le),))} {cumulative}"
+            yield f"{self.name}_sum{_labels(key)} {_num(series[-1])}"
+            yield f"{self.name}_count{_labels(key)} {cumulative}"
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help = help_text
+        self.fn = fn  # () -> number, or {labels tuple: number}
+        with _registry_lock:
+            _registry.append(self)
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                yield f"{self.name}{_labels(key)} {_num(v)}"
+        else:
+            yield f"{self.name} {_num(value)}"
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "start")
+
+    def __init__(self, hist, labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def _labels(key):
+    if not key:
+        return ""
+    parts = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+    return "{" + parts + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _num(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render_all():
+    """Every registered metric in Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# -------------------- SHARED METRICS --------------------
+http_request_seconds = Histogram(
+    "atm_http_request_seconds", "HTTP request latency by route template.")
+http_responses = Counter(
+    "atm_http_responses_total", "HTTP responses by route template and status code.")
+db_acquire_seconds = Histogram(
+    "atm_db_acquire_seconds", "Time spent waiting for a pooled SQLite connection.")
+db_statement_seconds = Histogram(
+    "atm_db_statement_seconds", "SQLite statement execution time.")
+printer_write_seconds = Histogram(
+    "atm_printer_write_seconds", "Time to write one receipt to the thermal printer.")
+print_jobs = Counter(
+    "atm_print_jobs_total", "Print jobs finished, by outcome.")
+keypad_loop_iterations = Counter(
+    "atm_keypad_loop_iterations_total", "Keypad scanner loop passes (rate = scan rate).")
+keypad_keys = Counter(
+    "atm_keypad_keys_total", "Keys read from the physical keypad.")
+ws_send_seconds = Histogram(
+    "atm_ws_send_seconds", "WebSocket send latency by channel.")
+ws_dropped_events = Counter(
+    "atm_ws_dropped_events_total", "Events not queued for a lagging WebSocket client.")
+ws_slow_disconnects = Counter(
+    "atm_ws_slow_disconnects_total", "WebSocket clients disconnected for falling behind.")
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware timing every HTTP request. Requests are labelled
+    with the matched route template (/balance/{tag_id}), not the raw path,
+    so card numbers don't explode the number of series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            http_request_seconds.observe(time.perf_counter() - start, method=method, route=path)
+            http_responses.inc(method=method, route=path, status=status)
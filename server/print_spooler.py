@@ -0,0 +1,166 @@
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from atm_logging import get_logger
+from hardware import DriverUnavailable
+from metrics import printer_write_seconds, print_jobs
+
+log = get_logger("atm.printer")
+
+# ==============================
+#   Background print spooler
+# ==============================
+# One thread writes to the printer. Request handlers render a receipt to
+# bytes, submit it, and return straight away with a job id; the spooler
+# writes each job in a single call and records how it went. Opening and
+# reopening the port is left to the printer's hardware.Driver.
+
+QUEUE_SIZE = 32         # pending jobs before submit() refuses new ones
+HISTORY_SIZE = 256      # finished jobs kept around for status lookups
+
+
+class SpoolerFull(Exception):
+    """The job queue is full; the printer has fallen too far behind."""
+
+
+class PrintJob:
+    def __init__(self, job_id, data, description=""):
+        self.id = job_id
+        self.data = data
+        self.size = len(data)
+        self.description = description
+        self.status = "queued"      # queued -> printing -> done | failed
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "description": self.description,
+            "error": self.error,
+            "bytes": self.size,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class PrintSpooler:
+    def __init__(self, printer, queue_size=QUEUE_SIZE, history_size=HISTORY_SIZE):
+        self._printer = printer  # hardware.Driver for the serial port
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._history_size = history_size
+        self._ids = itertools.count(1)
+        self._thread = None
+        self._running = False
+
+    # ---------- lifecycle ----------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="print-spooler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._running = False
+        try:
+            self._queue.put_nowait(None)  # wake the thread up
+        except queue.Full:
+            pass  # it's busy printing and will see _running on the next pass
+        if self._thread:
+            self._thread.join(timeout)
+
+    # ---------- producer side ----------
+    def submit(self, data, description=""):
+        """Queue rendered bytes for printing. Raises SpoolerFull if the queue is full."""
+        job = PrintJob(next(self._ids), data, description)
+        with self._jobs_lock:
+            self._jobs[job.id] = job
+            self._trim_history()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._jobs_lock:
+                self._jobs.pop(job.id, None)
+            raise SpoolerFull("Printer queue is full, please try again later")
+        return job
+
+    def get(self, job_id):
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _trim_history(self):
+        # Drop the oldest finished jobs; queued ones are never evicted
+        excess = len(self._jobs) - self._history_size
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].status in ("done", "failed"):
+                del self._jobs[job_id]
+                excess -= 1
+
+    # ---------- printer thread ----------
+    def _print(self, job):
+        job.status = "printing"
+        try:
+            port = self._printer.get()
+            start = time.perf_counter()
+            port.write(job.data)
+            port.flush()
+            printer_write_seconds.observe(time.perf_counter() - start)
+            job.status = "done"
+        except DriverUnavailable as e:
+            job.status = "failed"
+            job.error = str(e)
+        except Exception as e:
+            # Drop the handle so the driver reconnects for the next job
+            self._printer.reset(e)
+            job.status = "failed"
+            job.error = str(e)
+            log.warning("print job failed", job_id=job.id, error=e)
+        finally:
+            print_jobs.inc(status=job.status)
+            job.data = b""  # the status record doesn't need the payload
+            job.finished_at = time.time()
+
+    def _run(self):
+        while self._running:
+            job = self._queue.get()
+            if job is None:
+                continue
+            self._print(job)
+
+
+# --- FOR TESTING PURPOSES ONLY ---
+# Run this file directly (python print_spooler.py) to exercise the spooler
+# against a simulated printer.
+if __name__ == "__main__":
+    from hardware import Driver
+    from printer_utils import render_balance_receipt
+    from simulators import FakeSerial
+
+    fake = FakeSerial(baudrate=9600)
+    spooler = PrintSpooler(Driver("printer", "fake", lambda: fake))
+    spooler.start()
+
+    started = time.perf_counter()
+    jobs = [spooler.submit(render_balance_receipt("Juan", 300.0 + i), "test") for i in range(3)]
+    print(f"Queued {len(jobs)} jobs in {(time.perf_counter() - started) * 1000:.2f} ms")
+
+    while any(spooler.get(j.id)["status"] in ("queued", "printing") for j in jobs):
+        time.sleep(0.05)
+    for j in jobs:
+        print(spooler.get(j.id))
+    print(f"Writes: {fake.write_calls}, bytes: {len(fake.written)}")
+    spooler.stop()
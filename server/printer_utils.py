@@ -1,5 +1,4 @@
 # printer_utils.py
-import serial
 import time
 from datetime import datetime
 
@@ -7,71 +6,114 @@ from datetime import datetime
 #   Maloi Bank Thermal Printer
 # ==============================
 
-# Configure the thermal printer
-printer = None
-try:
-    printer = serial.Serial("/dev/ttyUSB0", baudrate=9600, timeout=1)
-    print("? Thermal printer connected on /dev/ttyUSB0")
-except Exception as e:
-    print(f"?? Printer not connected: {e}")
+PRINTER_PORT = "/dev/ttyUSB0"
+PRINTER_BAUDRATE = 9600
+LINE_WIDTH = 32
+
+
+def open_printer():
+    """Open the thermal printer's serial port. Raises if the device is missing."""
+    import serial  # pyserial is only needed with the real printer
+
+    return serial.Serial(PRINTER_PORT, baudrate=PRINTER_BAUDRATE, timeout=1)
+
 
 def safe_write(text):
     """Safely write text to printer."""
+    from hardware import drivers, DriverUnavailable
+
+    printer = drivers["printer"]
     try:
-        if printer and printer.is_open:
-            printer.write(text.encode('utf-8') + b'\n')
-            time.sleep(0.05)
-        else:
-            print("?? Printer not available for writing.")
+        printer.get().write(text.encode('utf-8') + b'\n')
+        time.sleep(0.05)
+    except DriverUnavailable:
+        print("?? Printer not available for writing.")
     except Exception as e:
+        printer.reset(e)
         print(f"?? Error writing to printer: {e}")
 
-def print_center(text):
-    """Print centered text."""
-    safe_write(text.center(32))
+def center_line(text):
+    return text.center(LINE_WIDTH)
 
-def print_left_right(left, right, width=32):
-    """Print text aligned left and right."""
+def left_right_line(left, right, width=LINE_WIDTH):
     space = width - len(left) - len(right)
     if space < 0:
         space = 0
-    line = left + (" " * space) + right
-    safe_write(line)
+    return left + (" " * space) + right
 
-def print_balance_receipt(name, balance):
-    """?? Print Balance Inquiry Receipt for Maloi Bank."""
-    global printer
+def print_center(text):
+    """Print centered text."""
+    safe_write(center_line(text))
 
-    # Reconnect printer if it was closed or lost
-    if not printer or not printer.is_open:
-        try:
-            printer = serial.Serial("/dev/ttyUSB0", baudrate=9600, timeout=1)
-            print("?? Reconnected to thermal printer.")
-        except Exception as e:
-            print(f"? Printer unavailable: {e}")
-            return
+def print_left_right(left, right, width=LINE_WIDTH):
+    """Print text aligned left and right."""
+    safe_write(left_right_line(left, right, width))
 
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def render_receipt(transaction, rows, now=None):
+    """Render a transaction slip: the bank header, then (label, value) rows."""
+    now = now or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     # ===== Receipt Layout =====
-    print_center("================================")
-    print_center("        MALOI BANK ATM")
-    print_center("================================")
-    print_center("      OFFICIAL TRANSACTION SLIP")
-    safe_write("--------------------------------")
-    print_left_right("DATE:", now)
-    safe_write("--------------------------------")
-    print_left_right("TRANSACTION:", "BALANCE INQUIRY")
-    print_left_right("CUSTOMER:", name)
-    print_left_right("BALANCE:", f"{balance:,.2f}")
-    safe_write("--------------------------------")
-    print_center("Thank you for banking with us!")
-    print_center("        Visit again soon.")
-    print_center("================================")
-    safe_write("\n\n\n")
+    lines = [
+        center_line("================================"),
+        center_line("        MALOI BANK ATM"),
+        center_line("================================"),
+        center_line("      OFFICIAL TRANSACTION SLIP"),
+        "--------------------------------",
+        left_right_line("DATE:", now),
+        "--------------------------------",
+        left_right_line("TRANSACTION:", transaction),
+        *(left_right_line(label, value) for label, value in rows),
+        "--------------------------------",
+        center_line("Thank you for banking with us!"),
+        center_line("        Visit again soon."),
+        center_line("================================"),
+        "\n\n\n",
+    ]
+    return "".join(line + "\n" for line in lines).encode("utf-8")
+
+def render_balance_receipt(name, balance, now=None):
+    """Render the Balance Inquiry receipt into one buffer, ready for a single write."""
+    return render_receipt("BALANCE INQUIRY", [
+        ("CUSTOMER:", name),
+        ("BALANCE:", f"{balance:,.2f}"),
+    ], now)
+
+def render_withdrawal_receipt(name, amount, fee, balance, now=None):
+    return render_receipt("WITHDRAWAL", [
+        ("CUSTOMER:", name),
+        ("AMOUNT:", f"{amount:,.2f}"),
+        ("FEE:", f"{fee:,.2f}"),
+        ("BALANCE:", f"{balance:,.2f}"),
+    ], now)
+
+def render_deposit_receipt(name, amount, balance, now=None):
+    return render_receipt("DEPOSIT", [
+        ("CUSTOMER:", name),
+        ("AMOUNT:", f"{amount:,.2f}"),
+        ("BALANCE:", f"{balance:,.2f}"),
+    ], now)
 
+def mark_reprint(receipt):
+    """A copy of a journalled receipt, flagged so it can't pass for the original."""
+    return (center_line("*** REPRINT ***") + "\n").encode("utf-8") + receipt
+
+def print_balance_receipt(name, balance):
+    """?? Print Balance Inquiry Receipt for Maloi Bank (blocking; prefer the spooler)."""
+    from hardware import drivers, DriverUnavailable
+
+    # The driver reopens the port if it was closed or lost
+    printer = drivers["printer"]
     try:
+        port = printer.get()
+    except DriverUnavailable as e:
+        print(f"? Printer unavailable: {e}")
+        return
 
+    try:
+        port.write(render_balance_receipt(name, balance))
+        port.flush()
         print(f"? Receipt printed successfully for: {name}")
     except Exception as e:
-        print(f"?? Could not close printer properly: {e}")
+        printer.reset(e)
+        print(f"?? Error writing to printer: {e}")
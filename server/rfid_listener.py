@@ -1,41 +1,27 @@
-from mfrc522 import SimpleMFRC522
-import requests
-import time
-import RPi.GPIO as GPIO
-
-API_BASE = "http://127.0.0.1:8000"  # Adjust to your Pi’s IP if remote frontend
-READER_DELAY = 2  # seconds
-
-reader = SimpleMFRC522()
-
-try:
-    while True:
-        print("Place your card...")
-        id, text = reader.read()
-        id = str(id).strip()  # sanitize RFID to avoid trailing spaces/newlines
-        print(f"Detected RFID: {id}")
-
-        try:
-            # Step 1: Notify backend that a card was inserted
-            insert_res = requests.post(f"{API_BASE}/rfid/insert/{id}")
-            print("Inserted:", insert_res.json())
-
-            # Step 2: Get user info for this RFID
-            response = requests.get(f"{API_BASE}/rfid/{id}")
-            print("Response:", response.json())
-
-            # Wait a few seconds before simulating card removal
-            time.sleep(3)
-
-            # Step 3: Notify backend that card was removed
-            remove_res = requests.post(f"{API_BASE}/rfid/remove")
-            print("Removed:", remove_res.json())
-
-        except requests.exceptions.RequestException as e:
-            print("Error connecting to server:", e)
-
-        # small delay before next scan
-        time.sleep(READER_DELAY)
-
-finally:
-    GPIO.cleanup()
+"""
+Standalone RFID listener for a reader that is not inside the FastAPI process.
+
+Events go to the backend over HTTP on one keep-alive session. To read the
+card inside the backend instead, start uvicorn with ATM_RFID_MODE=inprocess
+and don't run this script.
+"""
+import os
+
+from atm_logging import setup_logging
+from hardware import drivers
+from rfid_service import RfidReaderService, HttpPublisher
+
+API_BASE = os.getenv("ATM_API_BASE", "http://127.0.0.1:8000")  # Adjust to your Pi’s IP if remote frontend
+TERMINAL_ID = os.getenv("ATM_TERMINAL_ID")  # which kiosk this reader belongs to
+
+if __name__ == "__main__":
+    setup_logging()
+    service = RfidReaderService(drivers["rfid"], HttpPublisher(API_BASE, TERMINAL_ID))
+    print("Place your card...")
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        print("\nExiting...")
+    finally:
+        service.publisher.close()
+        drivers.close_all()
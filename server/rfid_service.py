@@ -0,0 +1,168 @@
+import threading
+import time
+
+from atm_logging import get_logger
+from hardware import DriverUnavailable
+
+try:
+    from mfrc522 import SimpleMFRC522
+except ImportError:  # not on a Pi; use the fake or null rfid driver (hardware.py)
+    SimpleMFRC522 = None
+
+# ==============================
+#   RFID reader service
+# ==============================
+# Watches the MFRC522 and reports card insert/remove. Removal is detected by
+# the card disappearing from the field rather than a fixed timer, so the
+# next card can be read as soon as the previous one is pulled away.
+#
+# Where the events go is up to the publisher:
+#   DirectPublisher - inside the FastAPI process, straight into the card hub
+#   HttpPublisher   - a remote reader talking to the backend over HTTP
+
+log = get_logger("atm.rfid")
+
+POLL_INTERVAL = 0.1     # seconds between reader polls
+REMOVAL_MISSES = 3      # consecutive empty polls before the card counts as removed
+                        # (the MFRC522 often misses a present card on alternate polls)
+
+
+def open_reader():
+    if SimpleMFRC522 is None:
+        raise RuntimeError("mfrc522 is not installed; pass a reader backend")
+    return SimpleMFRC522()
+
+
+class DirectPublisher:
+    """
+    Publishes into a CardEventHub in the same process. These events never
+    reach the /rfid routes, so the publisher journals them itself through
+    journal(kind, user_id=None, **fields), as those routes would.
+    """
+
+    def __init__(self, hub, resolve_user=None, journal=None):
+        self.hub = hub
+        self.resolve_user = resolve_user  # tag -> account (with .id and .name) or None
+        self.journal = journal
+
+    def _record(self, kind, user_id=None, **fields):
+        if self.journal is None:
+            return
+        try:
+            self.journal(kind, user_id, **fields)
+        except Exception as e:
+            log.warning("journal submit failed", kind=kind, error=e)
+
+    def card_inserted(self, tag_id):
+        self.hub.insert(tag_id)
+        self._record("card_inserted", rfid_tag=tag_id)
+        if self.resolve_user:
+            user = self.resolve_user(tag_id)
+            if user is not None:
+                self.hub.recognized(tag_id, user.name)
+                self._record("card_recognized", user.id, rfid_tag=tag_id)
+
+    def card_removed(self):
+        self.hub.remove()
+        self._record("card_removed")
+
+    def close(self):
+        pass
+
+
+class HttpPublisher:
+    """Publishes to a backend over HTTP, reusing one keep-alive connection."""
+
+    def __init__(self, api_base, terminal=None, timeout=3.0):
+        import requests  # only remote readers need it
+
+        self.api_base = api_base.rstrip("/")
+        self.params = {"terminal": terminal} if terminal else None
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._errors = requests.exceptions.RequestException
+
+    def _call(self, method, path):
+        try:
+            res = self.session.request(method, f"{self.api_base}{path}",
+                                       params=self.params, timeout=self.timeout)
+            return res.json()
+        except self._errors as e:
+            log.warning("backend unreachable", path=path, error=e)
+        except ValueError:
+            log.warning("non-JSON response", path=path)
+        return None
+
+    def card_inserted(self, tag_id):
+        inserted = self._call("POST", f"/rfid/insert/{tag_id}")
+        user = self._call("GET", f"/rfid/{tag_id}")
+        log.info("card posted", tag=tag_id, inserted=inserted, user=user)
+
+    def card_removed(self):
+        log.info("card removal posted", response=self._call("POST", "/rfid/remove"))
+
+    def close(self):
+        self.session.close()
+
+
+class RfidReaderService:
+    """Polls the reader behind a hardware.Driver and publishes card changes."""
+
+    def __init__(self, reader, publisher, poll_interval=POLL_INTERVAL,
+                 removal_misses=REMOVAL_MISSES):
+        self.reader = reader
+        self.publisher = publisher
+        self.poll_interval = poll_interval
+        self.removal_misses = removal_misses
+        self.current = None
+        self._misses = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Run the reader loop on a daemon thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name="rfid-reader", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout)
+        self.publisher.close()
+
+    def run(self):
+        self._running = True
+        log.info("reader started", poll_interval=self.poll_interval)
+        while self._running:
+            self.poll()
+            time.sleep(self.poll_interval)
+
+    def _read_tag(self):
+        try:
+            tag = self.reader.get().read_id_no_block()
+        except DriverUnavailable:
+            return None  # the driver logs the failure and retries with backoff
+        except Exception as e:
+            log.warning("read error", error=e, sample=50)
+            return None
+        return None if tag is None else str(tag).strip()
+
+    def poll(self):
+        """Take one reading and publish whatever changed."""
+        tag = self._read_tag()
+        if tag:
+            self._misses = 0
+            if tag != self.current:
+                if self.current is not None:
+                    # Swapped cards without a gap
+                    self.publisher.card_removed()
+                self.current = tag
+                log.info("card detected", tag=tag)
+                self.publisher.card_inserted(tag)
+        elif self.current is not None:
+            self._misses += 1
+            if self._misses >= self.removal_misses:
+                self.current = None
+                self._misses = 0
+                self.publisher.card_removed()
@@ -1,40 +1,295 @@
+"""
+Starts the whole ATM stack and keeps it running.
+
+Each component starts as soon as the components it depends on are ready,
+so independent ones come up in parallel. "Ready" is a real probe (the API's
+/health endpoint) rather than a fixed sleep. Long-running components that
+crash are restarted with exponential backoff, and the time every component
+took to become ready is printed, so a kiosk reboot can be timed end to end.
+A oneshot component that keeps failing is given up on after a few tries:
+it and everything that depends on it are marked failed, in the log and in
+the API's /health.
+
+    python run_all.py                 # API + sample cards + RFID listener
+    ATM_RFID_MODE=inprocess python run_all.py   # the API reads the card itself
+"""
+import json
+import os
+import signal
 import subprocess
+import sys
+import threading
 import time
-import os
-
+import urllib.request
 
-# ?? Correct project directory for your Raspberry Pi
-PROJECT_DIR = "/home/group2embeddedcpe4a/PIT/ES-PIT-ATM-Maloi-Digital/server"
+PROJECT_DIR = os.getenv("ATM_PROJECT_DIR", os.path.dirname(os.path.abspath(__file__)))
 VENV_PYTHON = os.path.join(PROJECT_DIR, "venv", "bin", "python")
+if not os.path.exists(VENV_PYTHON):
+    VENV_PYTHON = sys.executable
+
+API_PORT = int(os.getenv("ATM_API_PORT", "8000"))
+HEALTH_URL = f"http://127.0.0.1:{API_PORT}/health"
+# Component states for /health; children find the path in the environment
+STATUS_PATH = os.getenv("ATM_SUPERVISOR_STATUS") or os.path.join(PROJECT_DIR, "supervisor-status.json")
+
+READY_TIMEOUT = 60.0    # seconds a component gets to pass its probe
+PROBE_INTERVAL = 0.1    # seconds between readiness probes
+BACKOFF_BASE = 1.0      # first restart delay, doubled after every crash
+BACKOFF_CAP = 30.0
+STABLE_AFTER = 60.0     # a child that ran this long resets its backoff
+STOP_TIMEOUT = 5.0      # grace period after SIGTERM before SIGKILL
+ONESHOT_ATTEMPTS = 3    # runs a oneshot component gets before it is marked failed
+
+
+def http_probe(url, timeout=1.0):
+    """Probe that passes once `url` answers 200."""
+    def probe():
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as res:
+                return res.status == 200
+        except Exception:
+            return False
+    return probe
+
+
+class Component:
+    """
+    One child process.
+
+    oneshot components run to completion and count as ready when they exit
+    0, and are marked failed after ONESHOT_ATTEMPTS nonzero exits; the rest
+    are ready once `probe` passes (or right away without one) and are
+    restarted whenever they exit.
+    """
+
+    def __init__(self, name, cmd, depends=(), probe=None, oneshot=False):
+        self.name = name
+        self.cmd = cmd
+        self.depends = list(depends)
+        self.probe = probe
+        self.oneshot = oneshot
+        self.ready = threading.Event()
+        self.failed = threading.Event()
+        self.error = None
+        self.process = None
+        self.restarts = 0
+        self.ready_after = None  # seconds from supervisor start to first ready
+
+
+class Supervisor:
+    def __init__(self, components):
+        self.components = {c.name: c for c in components}
+        self._stopping = threading.Event()
+        self._stopped = False
+        self._threads = []
+        self._started = None
+        self._status_lock = threading.Lock()
+
+    def log(self, message):
+        elapsed = time.monotonic() - self._started
+        print(f"[{elapsed:7.2f}s] {message}", flush=True)
+
+    def state(self, component):
+        if component.failed.is_set():
+            return "failed"
+        if component.ready.is_set():
+            return "ready"
+        return "running" if component.process is not None else "waiting"
+
+    def write_status(self):
+        """Write every component's state to STATUS_PATH for the API's /health."""
+        status = {
+            c.name: {"state": self.state(c), "restarts": c.restarts, "error": c.error}
+            for c in self.components.values()
+        }
+        with self._status_lock:
+            tmp = f"{STATUS_PATH}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(status, f)
+                os.replace(tmp, STATUS_PATH)
+            except OSError as e:
+                self.log(f"could not write {STATUS_PATH} ({e})")
+
+    def _fail(self, component, error):
+        component.error = error
+        component.failed.set()
+        self.log(f"{component.name}: FAILED, not restarting ({error})")
+        self.write_status()
+
+    # ---------- lifecycle ----------
+    def start(self):
+        self._started = time.monotonic()
+        os.environ["ATM_SUPERVISOR_STATUS"] = STATUS_PATH
+        self.write_status()
+        for component in self.components.values():
+            thread = threading.Thread(target=self._supervise, args=(component,),
+                                      name=f"supervise-{component.name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        threading.Thread(target=self._report_ready, name="supervise-report", daemon=True).start()
+
+    def wait(self):
+        try:
+            while not self._stopping.is_set():
+                self._stopping.wait(0.5)
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def request_stop(self):
+        """Signal-safe: wait() notices and shuts everything down."""
+        self._stopping.set()
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self._stopping.set()
+        print("\nShutting down...", flush=True)
+        # Dependents first, so nothing posts to an API that is going away
+        for component in reversed(self._start_order()):
+            self._terminate(component)
+
+    def _start_order(self):
+        order, seen = [], set()
+
+        def visit(name):
+            if name not in seen:
+                seen.add(name)
+                for dep in self.components[name].depends:
+                    visit(dep)
+                order.append(self.components[name])
+
+        for name in self.components:
+            visit(name)
+        return order
+
+    # ---------- per-component thread ----------
+    def _supervise(self, component):
+        for dep in component.depends:
+            while not self.components[dep].ready.wait(0.2):
+                if self._stopping.is_set():
+                    return
+                if self.components[dep].failed.is_set():
+                    self._fail(component, f"{dep} failed")
+                    return
+
+        backoff = BACKOFF_BASE
+        while not self._stopping.is_set():
+            spawned = time.monotonic()
+            try:
+                component.process = subprocess.Popen(component.cmd, cwd=PROJECT_DIR)
+            except OSError as e:
+                self.log(f"{component.name}: failed to start ({e})")
+                component.process = None
+                component.error = f"failed to start ({e})"
+            else:
+                self.log(f"{component.name}: started (pid {component.process.pid})")
+                self.write_status()
+                if self._stopping.is_set():
+                    # stop() ran while we were spawning
+                    self._terminate(component)
+                self._wait_ready(component, spawned)
+                code = component.process.wait()
+                component.process = None
+                component.ready.clear()
+                if self._stopping.is_set():
+                    return
+                if component.oneshot and code == 0:
+                    self._mark_ready(component, spawned)
+                    return
+                self.log(f"{component.name}: exited with code {code}")
+                component.error = f"exited with code {code}"
+                if time.monotonic() - spawned >= STABLE_AFTER:
+                    backoff = BACKOFF_BASE
+
+            if component.oneshot and component.restarts + 1 >= ONESHOT_ATTEMPTS:
+                self._fail(component, f"{component.error} "
+                                      f"after {ONESHOT_ATTEMPTS} attempts")
+                return
+            component.restarts += 1
+            self.write_status()
+            self.log(f"{component.name}: restarting in {backoff:.0f}s (restart #{component.restarts})")
+            if self._stopping.wait(backoff):
+                return
+            backoff = min(backoff * 2, BACKOFF_CAP)
+
+    def _wait_ready(self, component, spawned):
+        if component.oneshot:
+            return  # ready means "finished", handled by the caller
+        if component.probe is None:
+            self._mark_ready(component, spawned)
+            return
+        deadline = spawned + READY_TIMEOUT
+        while component.process.poll() is None and not self._stopping.is_set():
+            if component.probe():
+                self._mark_ready(component, spawned)
+                return
+            if time.monotonic() > deadline:
+                self.log(f"{component.name}: not ready after {READY_TIMEOUT:.0f}s, restarting")
+                self._terminate(component)
+                return
+            time.sleep(PROBE_INTERVAL)
+
+    def _mark_ready(self, component, spawned):
+        now = time.monotonic()
+        if component.ready_after is None:
+            component.ready_after = now - self._started
+        component.error = None
+        component.ready.set()
+        self.log(f"{component.name}: ready in {now - spawned:.2f}s")
+        self.write_status()
+
+    def _report_ready(self):
+        waiting = list(self.components.values())
+        while waiting:
+            if self._stopping.wait(0.2):
+                return
+            waiting = [c for c in waiting if not (c.ready.is_set() or c.failed.is_set())]
+        failed = [c.name for c in self.components.values() if c.failed.is_set()]
+        if failed:
+            self.log(f"Not all systems running: {', '.join(failed)} failed")
+            return
+        self.log("All systems running! Ready for card (Press CTRL+C to stop everything)")
+        for component in self._start_order():
+            print(f"    {component.name:<10} ready at {component.ready_after:6.2f}s", flush=True)
+
+    @staticmethod
+    def _terminate(component):
+        process = component.process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def build_components():
+    components = [
+        Component(
+            "api",
+            [VENV_PYTHON, "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", str(API_PORT)],
+            probe=http_probe(HEALTH_URL),
+        ),
+        # The API creates the tables at import, so the sample cards wait for it
+        Component("cards", [VENV_PYTHON, os.path.join(PROJECT_DIR, "add_card.py")],
+                  depends=["api"], oneshot=True),
+    ]
+    # The RFID listener posts to the API (unless the backend reads the card itself)
+    if os.getenv("ATM_RFID_MODE", "external") != "inprocess":
+        components.append(Component(
+            "rfid", [VENV_PYTHON, os.path.join(PROJECT_DIR, "rfid_listener.py")],
+            depends=["api"],
+        ))
+    return components
+
 
-def get_connection():
-    db_path = os.path.join(os.path.dirname(__file__), "database.db")
-    print(f"?? Using DB at: {db_path}")
-    return sqlite3.connect(db_path)
-
-# Step 1: Start FastAPI server
-print("?? Starting FastAPI server...")
-fastapi_process = subprocess.Popen([
-    VENV_PYTHON, "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", "8000"
-], cwd=PROJECT_DIR)
-
-# Wait a few seconds for the server to be ready
-time.sleep(5)
-
-# Step 2: Initialize database with sample cards
-print("??? Initializing database with sample cards...")
-subprocess.run([VENV_PYTHON, os.path.join(PROJECT_DIR, "add_card.py")], cwd=PROJECT_DIR)
-
-# Step 3: Start RFID listener
-print("?? Starting RFID listener...")
-rfid_process = subprocess.Popen([VENV_PYTHON, os.path.join(PROJECT_DIR, "rfid_listener.py")], cwd=PROJECT_DIR)
-
-print("? All systems running! (Press CTRL+C to stop everything)")
-
-try:
-    fastapi_process.wait()
-    rfid_process.wait()
-except KeyboardInterrupt:
-    print("\n?? Shutting down...")
-    fastapi_process.terminate()
-    rfid_process.terminate()
+if __name__ == "__main__":
+    supervisor = Supervisor(build_components())
+    signal.signal(signal.SIGTERM, lambda *_: supervisor.request_stop())
+    supervisor.start()
+    supervisor.wait()
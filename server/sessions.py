@@ -0,0 +1,104 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# ==============================
+#   PIN sessions
+# ==============================
+# verify_pin issues a short-lived token carrying the resolved user, so the
+# rest of the ATM session (/balance, /withdraw, /transactions, ...) doesn't
+# have to turn the tag back into a user on every call.
+#
+# Sessions end SESSION_TTL after the PIN was entered, or IDLE_TIMEOUT after
+# the last request, whichever comes first. The store never holds more than
+# MAX_SESSIONS; past that the least recently used session is dropped.
+
+SESSION_TTL = 300.0       # seconds from PIN entry
+IDLE_TIMEOUT = 90.0       # seconds without a request
+MAX_SESSIONS = 2048
+SWEEP_INTERVAL = 30.0     # seconds between sweeps for expired sessions
+
+
+class Session:
+    __slots__ = ("token", "tag_id", "user_id", "name", "created_at", "last_seen")
+
+    def __init__(self, token, tag_id, user_id, name, now):
+        self.token = token
+        self.tag_id = tag_id
+        self.user_id = user_id
+        self.name = name
+        self.created_at = now
+        self.last_seen = now
+
+    def expired(self, now, ttl, idle):
+        return now - self.created_at > ttl or now - self.last_seen > idle
+
+
+class SessionStore:
+    def __init__(self, ttl=SESSION_TTL, idle_timeout=IDLE_TIMEOUT, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()   # token -> Session, least recently used first
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stop = threading.Event()
+        self.evicted = 0
+
+    def create(self, tag_id, user_id, name=None):
+        now = time.monotonic()
+        session = Session(secrets.token_urlsafe(24), tag_id, user_id, name, now)
+        with self._lock:
+            self._sessions[session.token] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        return session
+
+    def get(self, token):
+        """Return the live Session for token and mark it used, or None."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            if session.expired(now, self.ttl, self.idle_timeout):
+                del self._sessions[token]
+                return None
+            session.last_seen = now
+            self._sessions.move_to_end(token)
+            return session
+
+    def revoke(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def sweep(self):
+        """Drop every expired session. Returns how many were removed."""
+        now = time.monotonic()
+        with self._lock:
+            dead = [t for t, s in self._sessions.items()
+                    if s.expired(now, self.ttl, self.idle_timeout)]
+            for token in dead:
+                del self._sessions[token]
+        return len(dead)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    # ---------- sweeper thread ----------
+    def start_sweeper(self, interval=SWEEP_INTERVAL):
+        if self._sweeper and self._sweeper.is_alive():
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                self.sweep()
+
+        self._sweeper = threading.Thread(target=run, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
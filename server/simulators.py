@@ -0,0 +1,209 @@
+import queue
+import threading
+import time
+
+# ==============================
+#   Simulated ATM hardware
+# ==============================
+# Stand-ins for the Pi's devices so the backend can be exercised on a laptop.
+
+
+class FakeSerial:
+    """
+    Stands in for serial.Serial on the thermal printer.
+
+    Keeps everything written in memory. With simulate_baud=True, write() blocks
+    for as long as the bytes would take on the wire at the configured baudrate
+    (10 bits per byte), like the real USB-serial adapter does.
+    """
+
+    def __init__(self, port="/dev/fake-printer", baudrate=9600, simulate_baud=False):
+        self.port = port
+        self.baudrate = baudrate
+        self.simulate_baud = simulate_baud
+        self.is_open = True
+        self.written = bytearray()
+        self.write_calls = 0
+        self.fail_writes = False  # flip to True to simulate a yanked cable
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        if not self.is_open:
+            raise OSError("Port is closed")
+        if self.fail_writes:
+            raise OSError("Simulated printer failure")
+        if self.simulate_baud:
+            time.sleep(len(data) * 10 / self.baudrate)
+        with self._lock:
+            self.written.extend(data)
+            self.write_calls += 1
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeGPIO:
+    """
+    Drop-in for the RPi.GPIO module, wired as a keypad matrix.
+
+    press(row_pin, col_pin) closes the switch between a row and a column: the
+    column reads HIGH whenever that row is driven HIGH. Edge callbacks run on
+    their own thread, as they do with RPi.GPIO. input_calls/output_calls count
+    pin accesses so polling cost can be compared with edge-triggered mode.
+    """
+
+    BCM = "BCM"
+    OUT = "OUT"
+    IN = "IN"
+    LOW = 0
+    HIGH = 1
+    PUD_DOWN = "PUD_DOWN"
+    PUD_UP = "PUD_UP"
+    RISING = "RISING"
+    FALLING = "FALLING"
+    BOTH = "BOTH"
+
+    def __init__(self):
+        self._outputs = {}
+        self._inputs = set()
+        self._pressed = set()
+        self._levels = {}
+        self._detect = {}       # pin -> (edge, callback, bouncetime seconds)
+        self._last_edge = {}
+        self._lock = threading.RLock()
+        self._edges = None
+        self._thread = None
+        self.input_calls = 0
+        self.output_calls = 0
+
+    # ---------- RPi.GPIO API ----------
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        with self._lock:
+            if direction == self.OUT:
+                self._outputs[pin] = initial or self.LOW
+            else:
+                self._inputs.add(pin)
+            self._refresh()
+
+    def output(self, pin, value):
+        with self._lock:
+            self.output_calls += 1
+            self._outputs[pin] = value
+            self._refresh()
+
+    def input(self, pin):
+        with self._lock:
+            self.input_calls += 1
+            return self._levels.get(pin, self.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        with self._lock:
+            if self._thread is None:
+                self._edges = queue.Queue()
+                self._thread = threading.Thread(target=self._dispatch, daemon=True)
+                self._thread.start()
+            self._detect[pin] = (edge, callback, (bouncetime or 0) / 1000)
+
+    def remove_event_detect(self, pin):
+        with self._lock:
+            self._detect.pop(pin, None)
+
+    def cleanup(self):
+        with self._lock:
+            self._detect.clear()
+            self._outputs.clear()
+            self._inputs.clear()
+            self._levels.clear()
+        if self._edges is not None:
+            self._edges.put(None)
+
+    # ---------- simulation controls ----------
+    def press(self, row_pin, col_pin):
+        with self._lock:
+            self._pressed.add((row_pin, col_pin))
+            self._refresh()
+
+    def release(self, row_pin, col_pin):
+        with self._lock:
+            self._pressed.discard((row_pin, col_pin))
+            self._refresh()
+
+    # ---------- internals ----------
+    def _refresh(self):
+        """Recompute input levels and queue callbacks for any edges."""
+        for pin in self._inputs:
+            level = self.HIGH if any(
+                col == pin and self._outputs.get(row) == self.HIGH
+                for row, col in self._pressed
+            ) else self.LOW
+            previous = self._levels.get(pin, self.LOW)
+            self._levels[pin] = level
+            if level != previous and pin in self._detect:
+                self._queue_edge(pin, level)
+
+    def _queue_edge(self, pin, level):
+        edge, callback, bounce = self._detect[pin]
+        rising = level == self.HIGH
+        if edge == self.RISING and not rising or edge == self.FALLING and rising:
+            return
+        now = time.monotonic()
+        if now - self._last_edge.get(pin, -1e9) < bounce:
+            return
+        self._last_edge[pin] = now
+        if callback:
+            self._edges.put((callback, pin))
+
+    def _dispatch(self):
+        while True:
+            item = self._edges.get()
+            if item is None:
+                return
+            callback, pin = item
+            callback(pin)
+
+
+class FakeMFRC522:
+    """
+    Stands in for mfrc522.SimpleMFRC522. place(tag) puts a card on the
+    reader and take() lifts it off; read() blocks until a card is present.
+    """
+
+    def __init__(self):
+        self._tag = None
+        self._text = ""
+        self._present = threading.Condition()
+
+    def place(self, tag_id, text=""):
+        with self._present:
+            self._tag, self._text = int(tag_id), text
+            self._present.notify_all()
+
+    def take(self):
+        with self._present:
+            self._tag = None
+
+    def read_id_no_block(self):
+        return self._tag
+
+    def read_no_block(self):
+        if self._tag is None:
+            return None, None
+        return self._tag, self._text
+
+    def read_id(self):
+        return self.read()[0]
+
+    def read(self):
+        with self._present:
+            self._present.wait_for(lambda: self._tag is not None)
+            return self._tag, self._text
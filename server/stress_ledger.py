@@ -0,0 +1,147 @@
+"""
+Multi-threaded stress test for the ledger posting engine.
+
+Hammers a single account from many threads (and optionally many processes,
+each with its own connection pool, so SQLITE_BUSY retries are exercised)
+against a throwaway database, then checks that the final balance and the
+transactions table match exactly what was posted.
+
+    python stress_ledger.py --threads 16 --posts 500 --processes 2
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import daily_totals
+import database
+import ledger
+
+TAG = "STRESS-0001"
+START_BALANCE = 1_000_000.0
+DEPOSIT = 25.0
+WITHDRAW = 10.0
+
+
+def _worker(posts, counts, lock):
+    deposits = withdrawals = busy = 0
+    for i in range(posts):
+        try:
+            if i % 2 == 0:
+                ledger.deposit(TAG, DEPOSIT)
+                deposits += 1
+            else:
+                ledger.withdraw(TAG, WITHDRAW)
+                withdrawals += 1
+        except ledger.LedgerBusy:
+            busy += 1
+    with lock:
+        counts["deposit"] += deposits
+        counts["withdraw"] += withdrawals
+        counts["busy"] += busy
+
+
+def _run_process(db_path, threads, posts, result_queue):
+    database.configure(db_path)
+    counts = {"deposit": 0, "withdraw": 0, "busy": 0}
+    lock = threading.Lock()
+    workers = [
+        threading.Thread(target=_worker, args=(posts, counts, lock)) for _ in range(threads)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    database.get_pool().close_all()
+    result_queue.put(counts)
+
+
+def _seed(db_path):
+    database.configure(db_path)
+    database.init_db()
+    conn = database.get_write_connection()
+    conn.execute(
+        "INSERT INTO users (name, rfid_tag, balance, pin) VALUES (?, ?, ?, ?)",
+        ("Stress", TAG, START_BALANCE, "0000"),
+    )
+    conn.commit()
+    conn.close()
+    database.get_pool().close_all()
+
+
+def _verify(db_path, counts):
+    database.configure(db_path)
+    conn = database.get_connection()
+    balance, user_id = conn.execute(
+        "SELECT balance, id FROM users WHERE rfid_tag = ?", (TAG,)
+    ).fetchone()
+    rows = dict(conn.execute(
+        "SELECT type, COUNT(*) FROM transactions WHERE user_id = ? GROUP BY type", (user_id,)
+    ).fetchall())
+    drifted = daily_totals.drift(conn, user_id)
+    conn.close()
+
+    expected = (START_BALANCE + counts["deposit"] * DEPOSIT
+                - counts["withdraw"] * (WITHDRAW + ledger.WITHDRAW_FEE))
+    ok = True
+    if abs(balance - expected) > 1e-6:
+        print(f"❌ Lost update: balance {balance:,.2f}, expected {expected:,.2f}")
+        ok = False
+    if rows.get("deposit", 0) != counts["deposit"] or rows.get("withdraw", 0) != counts["withdraw"]:
+        print(f"❌ Transaction rows {rows} don't match postings {counts}")
+        ok = False
+    if rows.get("fee", 0) != counts["withdraw"]:
+        print(f"❌ Fee rows {rows.get('fee', 0)} != withdrawals {counts['withdraw']}")
+        ok = False
+    if drifted:
+        print(f"❌ Daily totals don't match the ledger for {drifted}")
+        ok = False
+    return ok, balance
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8, help="threads per process")
+    parser.add_argument("--posts", type=int, default=250, help="postings per thread")
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "stress.db")
+        _seed(db_path)
+
+        result_queue = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(
+                target=_run_process, args=(db_path, args.threads, args.posts, result_queue)
+            )
+            for _ in range(args.processes)
+        ]
+        started = time.perf_counter()
+        for p in procs:
+            p.start()
+        totals = {"deposit": 0, "withdraw": 0, "busy": 0}
+        for _ in procs:
+            for key, value in result_queue.get().items():
+                totals[key] += value
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - started
+
+        ok, balance = _verify(db_path, totals)
+        database.get_pool().close_all()
+
+    posted = totals["deposit"] + totals["withdraw"]
+    print(f"Processes: {args.processes}  Threads/process: {args.threads}")
+    print(f"Postings:  {posted} ({totals['deposit']} deposits, {totals['withdraw']} withdrawals)")
+    print(f"Busy:      {totals['busy']} gave up after {ledger.MAX_ATTEMPTS} attempts")
+    print(f"Balance:   {balance:,.2f}")
+    print(f"Elapsed:   {elapsed:.2f}s  ->  {posted / elapsed:,.0f} posts/sec")
+    print("✅ No lost updates" if ok else "❌ Ledger is inconsistent")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
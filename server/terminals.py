@@ -0,0 +1,118 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from card_events import CardEventHub, KeyEventHub
+
+# ==============================
+#   Terminals
+# ==============================
+# One backend can serve many ATMs. Each terminal has its own inserted card
+# and its own card/key event hubs, so a card tapped or a key pressed at one
+# kiosk only reaches the screens subscribed to that kiosk. A terminal is
+# created from the id the kiosk passes (?terminal=atm-3) when a card is
+# inserted there or a screen subscribes to it; every other route only looks
+# terminals up. When the registry is full, the least recently used terminal
+# with no card in it and no screens subscribed makes room for the new one.
+#
+# The keypad and reader wired to this Pi belong to LOCAL_TERMINAL, which is
+# also the default for clients that don't send an id.
+
+LOCAL_TERMINAL = os.getenv("ATM_TERMINAL_ID", "default")
+MAX_TERMINALS = 256
+TERMINAL_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class Terminal:
+    def __init__(self, terminal_id):
+        self.id = terminal_id
+        self.cards = CardEventHub()
+        self.keys = KeyEventHub()
+        self.created_at = time.time()
+
+    def is_idle(self):
+        """No card inserted and nobody subscribed: safe to forget."""
+        return (self.cards.current is None and not self.cards.subscriber_count()
+                and not self.keys.subscriber_count())
+
+    def to_dict(self):
+        return {
+            "terminal": self.id,
+            "rfid_tag": self.cards.current,
+            "card_seq": self.cards.seq,
+            "key_seq": self.keys.seq,
+            "card_clients": self.cards.subscriber_count(),
+            "keypad_clients": self.keys.subscriber_count(),
+        }
+
+
+class TerminalRegistry:
+    def __init__(self, max_terminals=MAX_TERMINALS):
+        self._terminals = OrderedDict()     # least recently used first
+        self._lock = threading.Lock()
+        self._max = max_terminals
+        self._loop = None
+        self.get(LOCAL_TERMINAL)
+
+    def find(self, terminal_id):
+        """The terminal with this id, or None if there isn't one. Never creates it."""
+        with self._lock:
+            terminal = self._terminals.get(terminal_id)
+            if terminal is not None:
+                self._terminals.move_to_end(terminal_id)
+        return terminal
+
+    def get(self, terminal_id):
+        """
+        The terminal with this id, created if there isn't one. Raises
+        ValueError for a malformed id, or when the registry is full and no
+        terminal is idle.
+        """
+        terminal = self.find(terminal_id)
+        if terminal is not None:
+            return terminal
+        if not TERMINAL_ID_RE.match(terminal_id):
+            raise ValueError(f"Invalid terminal id: {terminal_id!r}")
+        with self._lock:
+            terminal = self._terminals.get(terminal_id)
+            if terminal is None:
+                if len(self._terminals) >= self._max and not self._evict_idle():
+                    raise ValueError(f"Too many terminals (max {self._max})")
+                terminal = Terminal(terminal_id)
+                terminal.cards.loop = terminal.keys.loop = self._loop
+                self._terminals[terminal_id] = terminal
+        return terminal
+
+    def _evict_idle(self):
+        # Caller holds the lock
+        for terminal_id, terminal in self._terminals.items():
+            if terminal_id != LOCAL_TERMINAL and terminal.is_idle():
+                del self._terminals[terminal_id]
+                return True
+        return False
+
+    def set_loop(self, loop):
+        """Event loop that WebSocket subscriber queues live on."""
+        with self._lock:
+            self._loop = loop
+            for terminal in self._terminals.values():
+                terminal.cards.loop = terminal.keys.loop = loop
+
+    def all(self):
+        with self._lock:
+            return list(self._terminals.values())
+
+    def __len__(self):
+        return len(self._terminals)
+
+    def subscriber_counts(self):
+        cards = keys = 0
+        for terminal in self.all():
+            cards += terminal.cards.subscriber_count()
+            keys += terminal.keys.subscriber_count()
+        return {"card": cards, "keypad": keys}
+
+
+terminals = TerminalRegistry()
@@ -0,0 +1,86 @@
+"""
+Postings with amounts that aren't finite numbers must be refused without
+touching the ledger.
+
+    cd server && python -m pytest -q test_amounts.py
+"""
+import os
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp()
+os.environ["ATM_DB_PATH"] = os.path.join(_tmp, "test.db")
+os.environ["ATM_JOURNAL_DIR"] = os.path.join(_tmp, "journal")
+os.environ["ATM_HARDWARE"] = "fake"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import database  # noqa: E402
+import main  # noqa: E402
+
+TAG = "111"
+BALANCE = 5000.0
+BAD_AMOUNTS = ("inf", "1e309", "-inf", "nan")
+
+
+@pytest.fixture(scope="module")
+def client():
+    conn = database.get_write_connection()
+    conn.execute("INSERT INTO users (name, rfid_tag, balance, pin) VALUES (?, ?, ?, ?)",
+                 ("Test", TAG, BALANCE, "1234"))
+    conn.commit()
+    conn.close()
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _ledger_state():
+    with database.read_connection() as conn:
+        balance = conn.execute("SELECT balance FROM users WHERE rfid_tag = ?", (TAG,)).fetchone()[0]
+        rows = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    return balance, rows
+
+
+@pytest.mark.parametrize("route", ["deposit", "withdraw"])
+@pytest.mark.parametrize("amount", BAD_AMOUNTS)
+def test_non_finite_amount_is_rejected(client, route, amount):
+    before = _ledger_state()
+    response = client.post(f"/{route}/{TAG}/{amount}")
+    assert response.status_code == 400
+    assert "finite" in response.json()["detail"]
+    assert _ledger_state() == before
+
+
+@pytest.mark.parametrize("route", ["deposit", "withdraw"])
+def test_amount_above_maximum_is_rejected(client, route):
+    before = _ledger_state()
+    response = client.post(f"/{route}/{TAG}/{main.ledger.MAX_AMOUNT * 10}")
+    assert response.status_code == 400
+    assert _ledger_state() == before
+
+
+def test_finite_amount_still_posts(client):
+    balance, rows = _ledger_state()
+    response = client.post(f"/deposit/{TAG}/100")
+    assert response.status_code == 200
+    assert response.json()["new_balance"] == balance + 100
+    assert _ledger_state() == (balance + 100, rows + 1)
+
+
+def test_bulk_rows_with_non_finite_amounts_fail_alone(client):
+    balance, rows = _ledger_state()
+    body = "\n".join([
+        "rfid_tag,type,amount",
+        f"{TAG},deposit,inf",
+        f"{TAG},deposit,1e309",
+        f"{TAG},withdraw,nan",
+        f"{TAG},deposit,-inf",
+        f"{TAG},deposit,25",
+    ])
+    response = client.post("/bulk/postings?format=csv", content=body)
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["posted"] == 1
+    assert summary["failed"] == 4
+    assert _ledger_state() == (balance + 25, rows + 1)
@@ -0,0 +1,86 @@
+"""
+An export that runs while the archive job moves rows still lists every
+row exactly once.
+
+    cd server && python -m pytest -q test_export.py
+"""
+import json
+import os
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp()
+os.environ["ATM_DB_PATH"] = os.path.join(_tmp, "test.db")
+os.environ["ATM_JOURNAL_DIR"] = os.path.join(_tmp, "journal")
+os.environ["ATM_HARDWARE"] = "fake"
+
+import archive  # noqa: E402
+import database  # noqa: E402
+import export  # noqa: E402
+import ledger  # noqa: E402
+
+OLD_MONTHS = ("2020-01", "2020-02", "2020-03")
+
+
+def _insert(conn, user_id, timestamps):
+    conn.executemany(
+        "INSERT INTO transactions (user_id, type, amount, timestamp) VALUES (?, 'deposit', 1, ?)",
+        [(user_id, ts) for ts in timestamps])
+
+
+@pytest.fixture
+def user_id():
+    """A user with archived rows in three months and recent rows in the hot table."""
+    database.configure()    # a fresh pool; another module's app shutdown closes the shared one
+    database.init_db()
+    with database.write_connection() as conn:
+        cur = conn.execute("INSERT INTO users (name, rfid_tag, balance, pin) "
+                           "VALUES ('Export', NULL, 0, '0000')")
+        uid = cur.lastrowid
+        _insert(conn, uid, [f"{month}-1{day} 12:00:00" for month in OLD_MONTHS for day in range(5)])
+        _insert(conn, uid, [f"2099-01-0{day} 12:00:00" for day in range(1, 6)])
+    archive.archive_old_rows(pause=0)
+    return uid
+
+
+def _all_ids(uid):
+    with database.read_connection() as conn:
+        archive.attach(conn)
+        return sorted({row[0] for row in conn.execute(
+            f"SELECT id FROM {archive.ledger_source(conn)} AS t WHERE user_id = ?", (uid,))})
+
+
+def _exported_ids(chunks):
+    return sorted(json.loads(line)["id"] for chunk in chunks
+                  for line in chunk.decode("utf-8").splitlines())
+
+
+def test_archive_batch_between_the_two_reads(user_id):
+    # Late rows for the oldest month: the next archive run copies them into a
+    # month table the export has already read and deletes them from the hot
+    # table it hasn't reached yet
+    with database.write_connection() as conn:
+        _insert(conn, user_id, [f"{OLD_MONTHS[0]}-20 12:00:0{i}" for i in range(5)])
+    expected = _all_ids(user_id)
+
+    chunks = export.stream_transactions("ndjson", user_id=user_id, fetch_rows=100)
+    first = next(chunks)    # all of the oldest month table
+    assert archive.archive_old_rows(pause=0) == 5
+    exported = _exported_ids([first, *chunks])
+
+    assert exported == expected
+    assert _all_ids(user_id) == expected
+
+
+def test_rows_in_both_files_are_exported_once(user_id):
+    # What a crash between the archive's copy and its delete leaves behind
+    with database.write_connection() as conn:
+        _insert(conn, user_id, [f"{OLD_MONTHS[1]}-20 12:00:0{i}" for i in range(5)])
+    rows = archive._next_batch(archive.cutoff(), archive.BATCH_ROWS)
+    with archive.attached_writer():
+        ledger.run_in_transaction(lambda conn: archive._copy(conn, rows))
+
+    exported = _exported_ids(export.stream_transactions("ndjson", user_id=user_id))
+    assert exported == sorted(set(exported))
+    assert exported == _all_ids(user_id)
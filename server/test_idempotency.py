@@ -0,0 +1,60 @@
+"""
+A retried posting (same Idempotency-Key) gets the first response back,
+receipt_seq included, whether it is answered from memory or from the
+idempotency_keys table.
+
+    cd server && python -m pytest -q test_idempotency.py
+"""
+import os
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp()
+os.environ["ATM_DB_PATH"] = os.path.join(_tmp, "test.db")
+os.environ["ATM_JOURNAL_DIR"] = os.path.join(_tmp, "journal")
+os.environ["ATM_HARDWARE"] = "fake"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import database  # noqa: E402
+import idempotency  # noqa: E402
+import main  # noqa: E402
+
+TAG = "222"
+
+
+@pytest.fixture(scope="module")
+def client():
+    conn = database.get_write_connection()
+    conn.execute("INSERT INTO users (name, rfid_tag, balance, pin) VALUES (?, ?, ?, ?)",
+                 ("Test", TAG, 5000.0, "1234"))
+    conn.commit()
+    conn.close()
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _forget_cached_keys():
+    """What a backend restart does to the in-memory cache."""
+    idempotency.responses = idempotency.ResponseCache()
+
+
+@pytest.mark.parametrize("route", ["withdraw", "deposit"])
+@pytest.mark.parametrize("from_table", [False, True])
+def test_replay_returns_the_original_receipt_seq(client, route, from_table):
+    headers = {"Idempotency-Key": f"{route}-{from_table}"}
+    first = client.post(f"/{route}/{TAG}/100", headers=headers)
+    assert first.status_code == 200
+    receipt_seq = first.json()["receipt_seq"]
+    assert receipt_seq is not None
+
+    if from_table:
+        _forget_cached_keys()
+    retry = client.post(f"/{route}/{TAG}/100", headers=headers)
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+
+    record = client.get(f"/journal/{receipt_seq}").json()
+    assert record["kind"] == route
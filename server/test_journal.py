@@ -0,0 +1,68 @@
+"""
+The journal's segment files: reads without os.pread, dropped segments
+closed before they are deleted, and a record whose length doesn't match
+its index entry reported as corrupt.
+
+    cd server && python -m pytest -q test_journal.py
+"""
+import os
+
+import pytest
+
+import journal
+from journal import Journal, JournalError
+
+
+def _journal(directory, **kwargs):
+    # Small segments so a handful of records rotate
+    return Journal(str(directory), segment_records=4, sync=False, **kwargs).open()
+
+
+def _fill(store, count):
+    return store.append_many([("deposit", 7, {"amount": i}) for i in range(count)])
+
+
+def test_reads_and_repairs_without_pread(tmp_path, monkeypatch):
+    monkeypatch.delattr(os, "pread", raising=False)
+    store = _journal(tmp_path)
+    seqs = _fill(store, 10)
+    store.close()
+
+    with open(os.path.join(tmp_path, "journal-000003.ej"), "ab") as f:
+        f.write(b"torn")
+    store = _journal(tmp_path)
+    assert store.verify() == 10
+    assert store.get(seqs[-1])["amount"] == 9
+    assert [r["seq"] for r in store.search(user_id=7, limit=3)[0]] == seqs[:-4:-1]
+    store.close()
+
+
+def test_dropped_segment_outlives_its_readers(tmp_path):
+    store = _journal(tmp_path, keep_segments=2)
+    seqs = _fill(store, 4)
+    oldest = store._opened()[0]
+    with oldest.held() as held:
+        assert held
+        _fill(store, 8)     # two rotations: the oldest segment is dropped
+        assert oldest not in store._opened()
+        assert os.path.exists(oldest.data_path)
+        assert oldest.read(0)["seq"] == seqs[0]
+    assert not os.path.exists(oldest.data_path)
+    assert oldest._index.closed
+    with oldest.held() as held:
+        assert not held     # no new readers once dropped
+    assert store.get(seqs[0]) is None
+    store.close()
+
+
+def test_length_mismatch_is_corrupt(tmp_path):
+    store = _journal(tmp_path)
+    seq = store.append("withdraw", 7, amount=100)
+    segment = store._opened()[-1]
+    entry = segment.entry(0)
+    with open(segment.data_path, "r+b") as f:
+        f.seek(entry[journal.OFFSET] + 4)
+        f.write((entry[journal.LENGTH] - journal._RECORD.size + 1).to_bytes(4, "little"))
+    with pytest.raises(JournalError, match=f"record {seq} is corrupt"):
+        store.get(seq)
+    store.close()
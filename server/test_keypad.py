@@ -0,0 +1,23 @@
+"""
+Edge-triggered keypad scanning on the simulated GPIO backend: every press
+is seen, and nothing reads the pins while the keypad is idle.
+
+    cd server && python -m pytest -q test_keypad.py
+"""
+import pytest
+
+from bench_keypad import _bench, problems
+
+PRESSES = 8
+
+
+@pytest.mark.parametrize("mode", ["poll", "edge"])
+def test_every_press_is_detected(mode):
+    result = _bench(mode, idle_seconds=0.3, presses=PRESSES)
+    assert result["mode"] == mode
+    assert problems(result, PRESSES) == []
+
+
+def test_edge_mode_does_not_read_pins_while_idle():
+    result = _bench("edge", idle_seconds=0.5, presses=1)
+    assert result["idle_pin_reads"] == 0
@@ -0,0 +1,106 @@
+"""
+The print spooler against a simulated serial printer: one write per
+receipt, job status as it prints or fails, and a bounded queue.
+
+    cd server && python -m pytest -q test_print_spooler.py
+"""
+import threading
+import time
+
+import pytest
+
+from hardware import Driver
+from print_spooler import PrintSpooler, SpoolerFull
+from simulators import FakeSerial
+
+
+class HeldSerial(FakeSerial):
+    """FakeSerial whose write() waits until the test releases it."""
+
+    def __init__(self):
+        super().__init__()
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, data):
+        self.writing.set()
+        assert self.release.wait(5)
+        return super().write(data)
+
+
+def _spooler(fake, **kwargs):
+    return PrintSpooler(Driver("printer", "fake", lambda: fake), **kwargs)
+
+
+def _wait_finished(spooler, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = spooler.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} still {spooler.get(job_id)['status']}")
+
+
+@pytest.fixture
+def running():
+    started = []
+
+    def start(fake, **kwargs):
+        spooler = _spooler(fake, **kwargs)
+        spooler.start()
+        started.append(spooler)
+        return spooler
+
+    yield start
+    for spooler in started:
+        spooler.stop()
+
+
+def test_one_write_per_job(running):
+    fake = FakeSerial()
+    spooler = running(fake)
+    receipts = [f"receipt {i}\n".encode() * 20 for i in range(5)]
+    jobs = [spooler.submit(data, "test") for data in receipts]
+    for job in jobs:
+        assert _wait_finished(spooler, job.id)["status"] == "done"
+    assert fake.write_calls == len(receipts)
+    assert bytes(fake.written) == b"".join(receipts)
+
+
+def test_status_goes_queued_printing_done(running):
+    fake = HeldSerial()
+    spooler = running(fake)
+    first = spooler.submit(b"first", "test")
+    assert fake.writing.wait(5)
+    second = spooler.submit(b"second", "test")
+    assert spooler.get(first.id)["status"] == "printing"
+    assert spooler.get(second.id)["status"] == "queued"
+
+    fake.release.set()
+    for job in (first, second):
+        finished = _wait_finished(spooler, job.id)
+        assert finished["status"] == "done"
+        assert finished["error"] is None
+        assert finished["finished_at"] is not None
+
+
+def test_job_fails_when_the_port_raises(running):
+    fake = FakeSerial()
+    fake.fail_writes = True
+    spooler = running(fake)
+    job = _wait_finished(spooler, spooler.submit(b"lost", "test").id)
+    assert job["status"] == "failed"
+    assert "Simulated printer failure" in job["error"]
+    assert fake.write_calls == 0
+    assert job["finished_at"] is not None
+
+
+def test_full_queue_refuses_new_jobs():
+    spooler = _spooler(FakeSerial(), queue_size=2)   # not started: nothing drains the queue
+    queued = [spooler.submit(b"x", "test") for _ in range(2)]
+    with pytest.raises(SpoolerFull):
+        spooler.submit(b"x", "test")
+    assert spooler.pending() == 2
+    assert [spooler.get(job.id)["status"] for job in queued] == ["queued", "queued"]
+    assert spooler.get(queued[-1].id + 1) is None   # the refused job isn't tracked
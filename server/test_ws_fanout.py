@@ -0,0 +1,45 @@
+"""
+Keypad fan-out with stalled sockets: healthy clients get every key, and a
+client that stops reading is dropped once its bounded queue overflows.
+
+    cd server && python -m pytest -q test_ws_fanout.py
+"""
+import asyncio
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp()
+os.environ["ATM_DB_PATH"] = os.path.join(_tmp, "test.db")
+os.environ["ATM_JOURNAL_DIR"] = os.path.join(_tmp, "journal")
+os.environ["ATM_HARDWARE"] = "null"
+
+import card_events  # noqa: E402
+import main as atm  # noqa: E402
+from bench_atm import Lifespan  # noqa: E402
+from bench_ws_fanout import TERMINAL, scenario  # noqa: E402
+
+HEALTHY = 3
+STALLED = 2
+KEYS = card_events.SUBSCRIBER_QUEUE_SIZE * 2    # enough to overflow a stalled queue
+
+
+async def _run(stalled, send_timeout):
+    atm.WS_SEND_TIMEOUT = send_timeout
+    async with Lifespan(atm.app):
+        hub = atm.terminals.get(TERMINAL).keys
+        result = await scenario(atm.app, hub, HEALTHY, stalled, 0, KEYS, 0.001, 0)
+        result["subscribers_after"] = hub.subscriber_count()
+    return result
+
+
+def test_healthy_clients_get_every_key():
+    result = asyncio.run(_run(0, send_timeout=2.0))
+    assert len(result["latencies"]) == result["expected"] == KEYS * HEALTHY
+
+
+def test_stalled_client_is_dropped_on_overflow():
+    # A send timeout far longer than the test: only the overflow can drop them
+    result = asyncio.run(_run(STALLED, send_timeout=60.0))
+    assert len(result["latencies"]) == result["expected"]
+    assert result["stalled_left"] == 0
+    assert result["subscribers_after"] == 0